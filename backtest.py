@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+"""
+Offline backtest of the Extended Trading Bot v2 strategy on historical prices
+
+Исторический ряд котировок прогоняется через настоящий Bot (extended-bot-v2-server.py)
+с симулированной биржей (sim_exchange.py) и виртуальными часами (clock.py):
+    - каждая строка ряда двигает часы и исполняет / снимает касающиеся её ордера
+    - run_once вызывается с периодом тика пары (MARKET_TICK_SECONDS / TICK_SECONDS);
+      тики, на которых бот ничего не сделает (Bot.tick_is_idle и нет новых исполнений),
+      пропускаются (--every-tick - вызывать run_once на каждом тике)
+    - лимитер запросов отключён, логи бота выключены (--verbose - включить)
+    - --faults добавляет задержки и сбои биржи (sim_exchange.FaultProfile); задержки идут
+      по виртуальным часам
+
+Форматы ряда:
+    CSV:  ts,last[,bid,ask]  - ts в секундах Unix (или мс), либо ISO-время; заголовок необязателен
+    .bin: float64 (little-endian) строки [ts, last, bid, ask] (см. --convert); файл не читается
+          в память целиком, а отображается (mmap), поэтому процессы перебора параметров делят одну копию
+    --synthetic: ряд по секундам из блуждания котировок режима sim (SIM_START_PRICES, SIM_VOLATILITY)
+          с заданным --seed - воспроизводимый образец без исторических данных
+
+Результаты (в --out):
+    fills.csv     - все исполнения с веткой и ногой из client id
+    branches.csv  - ветки: вход, закрытие, причина, реализованный PnL, исполненные SELL
+    summary.json  - PnL бота и биржи, итоговая позиция, число веток и вызовов API
+
+SL-ордер бота (SELL IOC по last) исполняется, только если bid >= last; на синтетическом ряде
+bid всегда на шаг ниже last, и все SL остаются неисполненными (см. sim_exchange.py).
+Их число печатается в stderr после сводки и видно в order_stages (sl / ioc_unfilled).
+
+Примеры:
+    python backtest.py btc_1s.csv --symbol BTC-USD --out bt_btc
+    python backtest.py btc_1s.csv --convert btc_1s.bin
+    python backtest.py sample_1.bin --synthetic 21600 --seed 1     # 6 ч синтетического ряда BTC-USD
+    python backtest.py btc_1s.bin --symbol BTC-USD --rise-pct 0.004 --sl-pct -0.015
+    python backtest.py btc_1s.bin --faults '{"latency_ms": 80, "partial_fill_rate": 0.2, "drop_rate": 0.01}'
+"""
+
+import argparse
+import array
+import asyncio
+import csv
+import datetime
+import functools
+import importlib.util
+import json
+import math
+import mmap
+import os
+import random
+import sys
+import time
+from decimal import Decimal
+from typing import Dict, Optional
+
+import client_ids
+import config
+from clock import VirtualClock
+from market_specs import MARKET_SPECS, compile_spec
+from rate_limiter import PriorityRateLimiter
+from sim_exchange import FaultProfile, SimExchange, SimTradingClient, walk_quote
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+COLUMNS = 4  # ts, last, bid, ask
+
+
+@functools.lru_cache(maxsize=None)
+def load_bot_module():
+    spec = importlib.util.spec_from_file_location("extended_bot_v2_server", os.path.join(ROOT, "extended-bot-v2-server.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# ---------- price series ----------
+def _parse_ts(v: str) -> float:
+    try:
+        ts = float(v)
+    except ValueError:
+        dt = datetime.datetime.fromisoformat(v.replace("Z", "+00:00"))
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=datetime.timezone.utc)
+        return dt.timestamp()
+    return ts / 1000 if ts > 1e11 else ts
+
+
+def read_csv(path: str) -> array.array:
+    """CSV -> плоский массив float64 [ts, last, bid, ask, ...]; пустые bid/ask = last"""
+    rows = array.array("d")
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        for row in csv.reader(f):
+            if not row or not row[0].strip():
+                continue
+            try:
+                ts = _parse_ts(row[0].strip())
+                last = float(row[1])
+            except ValueError:
+                continue  # заголовок
+            bid = float(row[2]) if len(row) > 2 and row[2].strip() else last
+            ask = float(row[3]) if len(row) > 3 and row[3].strip() else last
+            rows.extend((ts, last, bid, ask))
+    return rows
+
+
+def read_bin(path: str) -> array.array:
+    rows = array.array("d")
+    with open(path, "rb") as f:
+        rows.frombytes(f.read())
+    if sys.byteorder != "little":
+        rows.byteswap()
+    return rows
+
+
+def write_bin(rows: array.array, path: str):
+    out = array.array("d", rows)
+    if sys.byteorder != "little":
+        out.byteswap()
+    with open(path, "wb") as f:
+        out.tofile(f)
+
+
+def map_bin(path: str):
+    """.bin без копирования: memoryview float64 поверх mmap (страницы общие для всех процессов)"""
+    if sys.byteorder != "little":
+        return read_bin(path)
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return array.array("d")
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return memoryview(mm).cast("d")
+
+
+def load_series(path: str):
+    return map_bin(path) if path.endswith(".bin") else read_csv(path)
+
+
+def synthetic_series(symbol: str, seconds: int, seed: int, volatility: float = config.SIM_VOLATILITY,
+                     t0: float = 1735689600.0) -> array.array:
+    """Ряд по секундам из того же блуждания, что котировки EXCHANGE_MODE = "sim" (random_walk_quotes);
+    один seed - один и тот же ряд, поэтому на нём сверяются модели (fastsim.py --validate)"""
+    rng = random.Random(seed)
+    spec = MARKET_SPECS.get(symbol) or compile_spec(symbol)
+    price = float(config.SIM_START_PRICES.get(symbol, 100.0))
+    rows = array.array("d")
+    for i in range(seconds):
+        price *= math.exp(volatility * rng.gauss(0.0, 1.0))
+        rows.extend((t0 + i, *walk_quote(spec, price)))
+    return rows
+
+
+# ---------- backtest ----------
+class Backtest:
+    def __init__(self, symbol: str, series, out_dir: str, specs: Optional[Dict] = None,
+                 tick_seconds: Optional[float] = None, maker_fee: Decimal = Decimal("0"),
+                 taker_fee: Decimal = Decimal("0"), verbose: bool = False, every_tick: bool = False,
+                 faults: Optional[FaultProfile] = None):
+        if symbol not in config.MARKETS:
+            raise ValueError(f"{symbol} нет в MARKETS (config.py)")
+        self.symbol = symbol
+        self.series = series
+        self.out_dir = out_dir
+        self.tick_seconds = tick_seconds or config.MARKET_TICK_SECONDS.get(symbol, config.TICK_SECONDS)
+        self.every_tick = every_tick
+        os.makedirs(out_dir, exist_ok=True)
+        state_file = os.path.join(out_dir, "bt_state.json")
+        for suffix in ("", ".journal"):
+            if os.path.exists(state_file + suffix):
+                os.remove(state_file + suffix)
+        archive_file = os.path.join(out_dir, "bt_state_archive.jsonl")
+        trace_file = os.path.join(out_dir, "bt_state_traces.jsonl")
+        for path in (archive_file, trace_file):
+            if os.path.exists(path):
+                os.remove(path)
+
+        self.clock = VirtualClock(series[0] if len(series) else 0.0)
+        self.exchange = SimExchange(self.clock, maker_fee=maker_fee, taker_fee=taker_fee, faults=faults)
+        self.client = SimTradingClient(self.exchange)
+        bot_module = load_bot_module()
+        self.bot = bot_module.Bot(self.client, limiter=PriorityRateLimiter(0, 0), specs=specs,
+                                  clock=self.clock, state_file=state_file, archive_file=archive_file,
+                                  trace_file=trace_file)
+        if not verbose:
+            self.bot.log = lambda symbol, msg, **kw: None
+        self.ticks = 0
+        self.skipped = 0
+        self.errors = 0
+
+    async def run(self):
+        symbol, rows, clock, exchange, bot = self.symbol, self.series, self.clock, self.exchange, self.bot
+        period = self.tick_seconds
+        next_tick = rows[0] if len(rows) else 0.0
+        seen_events = -1
+        for i in range(0, len(rows), COLUMNS):
+            ts = rows[i]
+            clock.set(ts)
+            exchange.set_quote(symbol, rows[i + 1], rows[i + 2], rows[i + 3])
+            if ts >= next_tick:
+                self.ticks += 1
+                if (not self.every_tick and exchange.events == seen_events
+                        and bot.tick_is_idle(symbol, exchange.stats(symbol).last_price)):
+                    self.skipped += 1
+                else:
+                    # События во время run_once (свои исполнения бота) не дают пропустить следующий тик
+                    seen_events = exchange.events
+                    try:
+                        with bot.metrics.api.tick(symbol):
+                            await bot.run_once(symbol)
+                    except Exception as e:
+                        self.errors += 1
+                        print(f"[{symbol}] Ошибка тика {clock.now().isoformat()}: {e}", flush=True)
+                next_tick += period
+                if next_tick <= ts:
+                    next_tick = ts + period  # дыра в ряду: пропущенные тики не догоняем
+
+    # ---------- report ----------
+    def _branch_rows(self):
+        bot, symbol = self.bot, self.symbol
+        sold: Dict[int, list] = {}
+        for f in self.exchange.fills:
+            parsed = client_ids.decode(f.external_id)
+            if parsed is not None and parsed.branch_id is not None:
+                acc = sold.setdefault(parsed.branch_id, [Decimal("0"), Decimal("0"), 0])
+                acc[0] += f.qty
+                acc[1] += f.qty * f.price
+                acc[2] += 1
+        records = list(bot.archive.iter_branches(symbol))
+        records += [dict(bot._branch_record(b), closed_at=None, close_reason=None) for b in bot.branches[symbol].values()]
+        rows = []
+        for rec in sorted(records, key=lambda r: r["branch_id"]):
+            qty, value, count = sold.get(rec["branch_id"], (Decimal("0"), Decimal("0"), 0))
+            rows.append({
+                "branch_id": rec["branch_id"],
+                "buy_price": rec["buy_price"],
+                "created_at": rec["created_at"],
+                "closed_at": rec.get("closed_at"),
+                "close_reason": rec.get("close_reason"),
+                "size_left": rec["size"],
+                "sell_fills": count,
+                "sold_qty": str(qty),
+                "avg_sell_price": str((value / qty).quantize(bot.specs[symbol].price_step)) if qty else "",
+                "realized_pnl": rec.get("realized_pnl") or "0",
+            })
+        return rows
+
+    def summary(self, wall_seconds: float) -> dict:
+        symbol, ex = self.symbol, self.exchange
+        rows = len(self.series) // COLUMNS
+        return {
+            "symbol": symbol,
+            "rows": rows,
+            "start": datetime.datetime.fromtimestamp(self.series[0], datetime.timezone.utc).isoformat() if rows else None,
+            "end": self.clock.now().isoformat() if rows else None,
+            "ticks": self.ticks,
+            "ticks_skipped": self.skipped,
+            "tick_errors": self.errors,
+            "wall_seconds": round(wall_seconds, 2),
+            "rows_per_second": round(rows / wall_seconds) if wall_seconds > 0 else None,
+            "branches_opened": self.bot.next_branch_id[symbol] - 1,
+            "branches_active": self.bot.aggs[symbol].count,
+            "fills": len(ex.fills),
+            "realized_pnl_bot": str(self.bot.realized_pnl(symbol)),
+            "realized_pnl_exchange": str(ex.realized[symbol]),
+            "fees": str(ex.fees[symbol]),
+            "equity": str(ex.equity(symbol)) if rows else "0",
+            "final_position": str(ex.size[symbol]),
+            "api_calls": dict(sorted(self.client.calls.items())),
+            "api_by_caller": self.bot.metrics.api.summary(),
+            "order_stages": self.bot.tracer.summary(),
+            "faults_injected": dict(sorted(ex.injected.items())),
+        }
+
+    def report(self, wall_seconds: float) -> dict:
+        """summary() + fills.csv, branches.csv и summary.json в out_dir"""
+        ex = self.exchange
+        with open(os.path.join(self.out_dir, "fills.csv"), "w", encoding="utf-8", newline="") as f:
+            w = csv.writer(f)
+            w.writerow(["time", "side", "price", "qty", "fee", "maker", "kind", "branch_id", "leg", "order_id", "external_id"])
+            for fill in ex.fills:
+                parsed = client_ids.decode(fill.external_id)
+                w.writerow([
+                    datetime.datetime.fromtimestamp(fill.ts, datetime.timezone.utc).isoformat(), fill.side.value,
+                    fill.price, fill.qty, fill.fee, int(fill.maker), parsed.kind if parsed else "",
+                    parsed.branch_id if parsed and parsed.branch_id is not None else "",
+                    parsed.leg if parsed and parsed.leg else "", fill.order_id, fill.external_id or "",
+                ])
+        branch_rows = self._branch_rows()
+        with open(os.path.join(self.out_dir, "branches.csv"), "w", encoding="utf-8", newline="") as f:
+            fieldnames = list(branch_rows[0]) if branch_rows else ["branch_id"]
+            w = csv.DictWriter(f, fieldnames=fieldnames)
+            w.writeheader()
+            w.writerows(branch_rows)
+
+        summary = self.summary(wall_seconds)
+        with open(os.path.join(self.out_dir, "summary.json"), "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        return summary
+
+
+def spec_overrides(args) -> dict:
+    def pcts(v):
+        return [Decimal(x) for x in v.split(",")] if v else None
+
+    return {k: v for k, v in {
+        "rise_pct": args.rise_pct, "sell_pcts": pcts(args.sell_pcts), "split": pcts(args.split),
+        "pnl_min_pct": args.pnl_min_pct, "sl_pct": args.sl_pct, "buy_qty": args.buy_qty,
+    }.items() if v is not None}
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Бэктест стратегии Extended Bot v2 на исторических ценах")
+    ap.add_argument("series", help="CSV (ts,last[,bid,ask]) или .bin")
+    ap.add_argument("--symbol", default=config.MARKETS[0])
+    ap.add_argument("--out", default="backtest_out")
+    ap.add_argument("--tick", type=float, default=None, help="период тика, сек (по умолчанию из config.py)")
+    ap.add_argument("--rise-pct", type=Decimal)
+    ap.add_argument("--sell-pcts", help="через запятую, например 0.003,0.004,0.005")
+    ap.add_argument("--split", help="доли SELL через запятую")
+    ap.add_argument("--pnl-min-pct", type=Decimal)
+    ap.add_argument("--sl-pct", type=Decimal)
+    ap.add_argument("--buy-qty", type=Decimal)
+    ap.add_argument("--maker-fee", type=Decimal, default=Decimal("0"))
+    ap.add_argument("--taker-fee", type=Decimal, default=Decimal("0"))
+    ap.add_argument("--verbose", action="store_true", help="печатать логи бота")
+    ap.add_argument("--every-tick", action="store_true", help="не пропускать тики без действий")
+    ap.add_argument("--faults", help="JSON с полями FaultProfile: задержки, 429, частичные исполнения, потери")
+    ap.add_argument("--convert", metavar="OUT_BIN", help="только перевести CSV в .bin и выйти")
+    ap.add_argument("--synthetic", type=int, metavar="SECONDS",
+                    help="только записать в series (.bin) синтетический ряд длиной SECONDS и выйти")
+    ap.add_argument("--seed", type=int, default=1, help="seed синтетического ряда")
+    args = ap.parse_args()
+
+    started = time.perf_counter()
+    if args.synthetic:
+        if not args.series.endswith(".bin"):
+            ap.error("--synthetic пишет ряд в .bin")
+        write_bin(synthetic_series(args.symbol, args.synthetic, args.seed), args.series)
+        print(f"✅ {args.synthetic} строк (seed {args.seed}) -> {args.series} ({time.perf_counter() - started:.1f}s)")
+        return
+    if args.convert:
+        if not args.convert.endswith(".bin"):
+            ap.error("--convert пишет ряд в .bin")
+        if os.path.abspath(args.convert) == os.path.abspath(args.series):
+            ap.error("--convert: файл результата совпадает с исходным рядом")
+    series = load_series(args.series)
+    if args.convert:
+        write_bin(series, args.convert)
+        print(f"✅ {len(series) // COLUMNS} строк -> {args.convert} ({time.perf_counter() - started:.1f}s)")
+        return
+
+    specs = dict(MARKET_SPECS)
+    overrides = spec_overrides(args)
+    if overrides:
+        specs[args.symbol] = compile_spec(args.symbol, **overrides)
+    bt = Backtest(args.symbol, series, args.out, specs=specs, tick_seconds=args.tick,
+                  maker_fee=args.maker_fee, taker_fee=args.taker_fee, verbose=args.verbose,
+                  every_tick=args.every_tick, faults=FaultProfile(**json.loads(args.faults)) if args.faults else None)
+    asyncio.run(bt.run())
+    summary = bt.report(time.perf_counter() - started)
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    unfilled = sum(r["count"] for r in summary["order_stages"] if r["kind"] == "sl" and r["stage"] == "ioc_unfilled")
+    if unfilled:
+        print(f"⚠️ SL IOC не исполнено: {unfilled} (лимит last выше bid - ордер не пересекает рынок); "
+              f"PnL бота не учитывает оставшийся в позиции объём", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark: Decimal vs integer ticks/lots for branch arithmetic
+
+Сравнивает горячие операции бота в двух представлениях:
+    - обновление агрегатов веток (размер, стоимость) при изменении размера
+    - проверка стопов по цене
+    - сравнение суммарного размера веток с позицией
+
+Запуск из корня репозитория:
+    python benchmarks/bench_fixedpoint.py [--branches 2000] [--rounds 200]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from decimal import ROUND_CEILING, Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from market_specs import MARKET_SPECS  # noqa: E402
+
+
+def _timeit(fn, rounds: int) -> float:
+    t = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return (time.perf_counter() - t) / rounds
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--symbol", default="BTC-USD")
+    ap.add_argument("--branches", type=int, default=2000)
+    ap.add_argument("--rounds", type=int, default=200)
+    args = ap.parse_args()
+
+    spec = MARKET_SPECS[args.symbol]
+    rnd = random.Random(1)
+    prices = [spec.rprice(Decimal(rnd.uniform(90000, 110000))) for _ in range(args.branches)]
+    sizes = [spec.rsize(Decimal(rnd.uniform(0.0001, 0.01))) for _ in range(args.branches)]
+    stops = [spec.rprice(p * spec.sl_mult) for p in prices]
+    new_sizes = [spec.rsize(s * Decimal("0.7")) for s in sizes]
+    last = spec.rprice(Decimal(100000)) + spec.price_step / 2
+    position = sum(sizes, Decimal("0"))
+
+    price_ticks = [spec.to_ticks(p) for p in prices]
+    lot_sizes = [spec.to_lots(s) for s in sizes]
+    new_lots = [spec.to_lots(s) for s in new_sizes]
+    stop_ticks = [spec.to_ticks(s) for s in stops]
+    position_lots = spec.to_lots(position)
+
+    def dec_resize():
+        total = Decimal("0"); cost = Decimal("0")
+        for p, old, new in zip(prices, sizes, new_sizes):
+            delta = new - old
+            total += delta
+            cost += delta * p
+        return total, cost
+
+    def int_resize():
+        # Новый размер приходит как Decimal (SDK/rsize) - конвертация входит в замер
+        total = 0; cost = 0
+        for p, old, new in zip(price_ticks, lot_sizes, new_sizes):
+            delta = spec.to_lots(new) - old
+            total += delta
+            cost += delta * p
+        return total, cost
+
+    def dec_total():
+        return sum(sizes, Decimal("0")), sum((s * p for s, p in zip(sizes, prices)), Decimal("0"))
+
+    def int_total():
+        return sum(lot_sizes), sum(s * p for s, p in zip(lot_sizes, price_ticks))
+
+    def dec_stops():
+        return [i for i, s in enumerate(stops) if last <= s]
+
+    def int_stops():
+        lt = spec.to_ticks(last, ROUND_CEILING)
+        return [i for i, s in enumerate(stop_ticks) if lt <= s]
+
+    def dec_mismatch():
+        return abs(sum(sizes, Decimal("0")) - position) > Decimal("0.0001")
+
+    def int_mismatch():
+        return sum(lot_sizes) != position_lots
+
+    # Оба представления должны давать одинаковый результат
+    for dec_fn, int_fn in ((dec_resize, int_resize), (dec_total, int_total)):
+        dt, dc = dec_fn(); it, ic = int_fn()
+        assert spec.from_lots(it) == dt
+        assert Decimal(ic).scaleb(-(spec.size_prec + spec.price_prec)) == dc
+    assert dec_stops() == int_stops()
+    assert dec_mismatch() == int_mismatch()
+
+    print(f"{args.symbol}: {args.branches} веток, {args.rounds} повторов")
+    for name, dec_fn, int_fn in (
+        ("resize aggregates", dec_resize, int_resize),
+        ("full recompute", dec_total, int_total),
+        ("stop check", dec_stops, int_stops),
+        ("position mismatch", dec_mismatch, int_mismatch),
+    ):
+        d = _timeit(dec_fn, args.rounds)
+        i = _timeit(int_fn, args.rounds)
+        print(f"  {name:<20} Decimal {d * 1e6:9.1f} us | int {i * 1e6:9.1f} us | x{d / i:4.1f}")
+
+    conv = _timeit(lambda: [spec.to_lots(s) for s in sizes], args.rounds)
+    print(f"  {'to_lots (граница)':<20} {conv * 1e6:9.1f} us на {args.branches} значений")
+
+
+if __name__ == "__main__":
+    main()
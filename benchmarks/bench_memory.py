@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark: memory per branch (plain dataclass vs slotted Branch/SellLeg)
+
+Строит N веток из записей в формате файла состояния и сравнивает занятую память
+(tracemalloc) для прежнего представления (обычные dataclass + Decimal на каждое поле)
+и текущего (Branch/SellLeg со __slots__ + общие Decimal при загрузке).
+
+Запуск из корня репозитория (нужны зависимости бота: x10 SDK, python-dotenv):
+    python benchmarks/bench_memory.py [--branches 100000]
+"""
+
+import argparse
+import datetime
+import gc
+import importlib.util
+import os
+import sys
+import tracemalloc
+from dataclasses import dataclass, field
+from decimal import Decimal
+from typing import Dict, Optional
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+
+def load_bot_module():
+    spec = importlib.util.spec_from_file_location("extended_bot_v2_server", os.path.join(ROOT, "extended-bot-v2-server.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# Прежнее представление: обычные dataclass, каждое поле разбирается заново
+@dataclass
+class PlainSellLeg:
+    leg: str
+    target_pct: Decimal
+    size: Decimal
+    order_id: Optional[int] = None
+    client_id: Optional[str] = None
+    price: Optional[Decimal] = None
+
+
+@dataclass
+class PlainBranch:
+    branch_id: int
+    symbol: str
+    buy_price: Decimal
+    size: Decimal
+    wap: Decimal
+    stop_price: Decimal
+    active: bool = True
+    sells: Dict[str, PlainSellLeg] = field(default_factory=dict)
+    created_at: Optional[datetime.datetime] = None
+    last_updated: Optional[datetime.datetime] = None
+    realized_pnl: Decimal = Decimal("0")
+
+
+def plain_from_record(branch_id: int, d: dict) -> PlainBranch:
+    b = PlainBranch(
+        branch_id=branch_id,
+        symbol=d["symbol"],
+        buy_price=Decimal(d["buy_price"]),
+        size=Decimal(d["size"]),
+        wap=Decimal(d["wap"]),
+        stop_price=Decimal(d["stop_price"]),
+        active=d["active"],
+        created_at=datetime.datetime.fromisoformat(d["created_at"]),
+        last_updated=datetime.datetime.fromisoformat(d["last_updated"]),
+        realized_pnl=Decimal(d.get("realized_pnl") or "0"),
+    )
+    for name, leg in d["sells"].items():
+        b.sells[name] = PlainSellLeg(
+            leg=name,
+            target_pct=Decimal(leg["target_pct"]),
+            size=Decimal(leg["size"]),
+            order_id=leg["order_id"],
+            client_id=leg["client_id"],
+            price=Decimal(leg["price"]) if leg["price"] else None,
+        )
+    return b
+
+
+def make_record(i: int) -> dict:
+    price = 95000 + (i * 7) % 10000
+    ts = (datetime.datetime(2025, 8, 1, tzinfo=datetime.timezone.utc) + datetime.timedelta(seconds=i * 37)).isoformat()
+    return {
+        "branch_id": i, "symbol": "BTC-USD", "buy_price": str(price), "size": "0.0010", "wap": str(price),
+        "stop_price": str(int(price * 0.98)), "active": True, "created_at": ts, "last_updated": ts, "realized_pnl": "0",
+        "sells": {
+            name: {"leg": name, "target_pct": pct, "size": sz, "order_id": 10 ** 9 + i * 3 + k,
+                   "client_id": f"BTC-USD:BR{i}:S:{name}:{i * 3 + k:06x}", "price": str(int(price * (1 + float(pct))))}
+            for k, (name, pct, sz) in enumerate((("L1", "0.003", "0.0003"), ("L2", "0.004", "0.0003"), ("L3", "0.005", "0.0004")))
+        },
+    }
+
+
+def measure(build, records) -> float:
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objs = [build(i, r) for i, r in enumerate(records)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    assert len(objs) == len(records)
+    return (after - before) / len(records)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--branches", type=int, default=100000)
+    args = ap.parse_args()
+
+    bot = load_bot_module()
+    records = [make_record(i) for i in range(args.branches)]
+
+    plain = measure(plain_from_record, records)
+    slotted = measure(bot.Bot._branch_from_record, records)
+    print(f"{args.branches} веток по 3 SELL ноги")
+    print(f"  dataclass (прежде)      {plain:8.0f} байт/ветка")
+    print(f"  __slots__ + общие Decimal {slotted:6.0f} байт/ветка  ({slotted / plain:.0%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark suite: Bot hot paths against the in-memory simulated exchange
+
+Замеры горячих путей бота без сети - бот работает с SimExchange / SimTradingClient и
+виртуальными часами, состояние с N активными ветками (и их SELL на бирже) строится заранее:
+    rprice / rsize                        - округление цены и размера
+    save_state[N]                         - запись состояния после изменения одной ветки (журнал)
+    load_state[N]                         - загрузка состояния со сжатием журнала (старт бота)
+    get_branch_stats[N]                   - статистика веток пары
+    check_branch_sl[N]                    - проверка стопов без срабатывания (каждый тик)
+    ensure_branch_sells_for_branch[N]     - сверка ног одной ветки с ордерами по client id
+    run_once[N]                           - полный тик без проверки SELL
+    run_once_sell_check[N]                - полный тик с проверкой SELL всех веток
+    sweep[workers=W]                      - sweep.py на 1 / 2 / 4 процессах: время одной комбинации и
+                                            ускорение относительно одного процесса (speedup, cpu_count)
+
+Результаты пишутся в JSON (--out) вместе с коммитом и версией Python; --compare сравнивает
+с прошлым файлом и печатает замедления больше --threshold (код выхода 1 при --fail-on-regression).
+
+Запуск из корня репозитория (нужны зависимости бота: x10 SDK, python-dotenv):
+    python benchmarks/run_benchmarks.py --out bench_before.json
+    python benchmarks/run_benchmarks.py --out bench_after.json --compare bench_before.json
+    python benchmarks/run_benchmarks.py --sizes 10,1000 --only run_once
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from decimal import Decimal
+from typing import Callable, Dict, List, Optional
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+import client_ids  # noqa: E402
+import config  # noqa: E402
+from backtest import load_bot_module  # noqa: E402
+from clock import VirtualClock  # noqa: E402
+from market_specs import MARKET_SPECS  # noqa: E402
+from rate_limiter import PriorityRateLimiter  # noqa: E402
+from sim_exchange import SimExchange, SimTradingClient  # noqa: E402
+from state_journal import StateJournal  # noqa: E402
+from x10.perpetual.orders import OrderSide, TimeInForce  # noqa: E402
+
+START = 1735689600.0  # 2025-01-01T00:00:00Z
+LAST = Decimal("100000")
+
+
+class Fixture:
+    """Бот с N активными ветками: состояние на диске, ноги SELL на симулированной бирже"""
+
+    def __init__(self, symbol: str, branches: int, tmp: str, seed: int = 1):
+        module = load_bot_module()
+        spec = MARKET_SPECS[symbol]
+        rnd = random.Random(seed)
+        self.symbol = symbol
+        self.clock = VirtualClock(START)
+        self.exchange = SimExchange(self.clock)
+        last = spec.rprice(LAST)
+        self.exchange.set_quote(symbol, float(last), float(last - spec.price_step), float(last + spec.price_step))
+
+        # Входы выше last: стопы ниже цены, ноги SELL выше ask - ничего не исполняется
+        expire = self.clock.now() + datetime.timedelta(seconds=config.SELL_TTL_SECONDS)
+        created = self.clock.now().isoformat()
+        records, total = {}, Decimal("0")
+        qty = spec.rsize(spec.buy_qty)
+        for branch_id in range(1, branches + 1):
+            price = spec.rprice(last * Decimal(repr(rnd.uniform(1.0, 1.01))))
+            sells = {}
+            for leg, pct, split in zip(("L1", "L2", "L3"), spec.sell_pcts, spec.split):
+                size = spec.rsize(qty * split)
+                target = spec.rprice(price * (1 + pct))
+                cid = client_ids.sell_id(symbol, branch_id, leg)
+                order = self.exchange.place(symbol, OrderSide.SELL, size, target, TimeInForce.GTT,
+                                            external_id=cid, expire_time=expire)
+                sells[leg] = {"leg": leg, "target_pct": str(pct), "size": str(size), "order_id": order.id,
+                              "client_id": cid, "price": str(target)}
+            records[str(branch_id)] = {
+                "branch_id": branch_id, "symbol": symbol, "buy_price": str(price), "size": str(qty),
+                "wap": str(price), "stop_price": str(spec.rprice(price * spec.sl_mult)), "active": True,
+                "created_at": created, "last_updated": created, "realized_pnl": "0", "sells": sells,
+            }
+            total += qty
+        self.exchange.size[symbol] = total
+        self.exchange.open_price[symbol] = last
+
+        self.state_file = os.path.join(tmp, f"bench_{symbol}_{branches}.json")
+        journal = StateJournal(self.state_file)
+        journal.compact({
+            "branches": {symbol: records},
+            "next_branch_id": {symbol: branches + 1},
+            "rise_anchor": {symbol: str(last)},
+        })
+        journal.close()
+        self.bot = module.Bot(SimTradingClient(self.exchange), limiter=PriorityRateLimiter(0, 0), clock=self.clock,
+                              state_file=self.state_file,
+                              archive_file=os.path.join(tmp, f"bench_{symbol}_{branches}_archive.jsonl"))
+        self.bot.log = lambda symbol, msg, **kw: None
+        self.bot._last_sell_check = {symbol: self.clock.monotonic()}
+
+    def close(self):
+        self.bot.journal.close()
+        self.bot.archive.close()
+        self.bot.tracer.close()
+
+
+def _measure(run: Callable[[int], None], min_time: float, repeat: int) -> dict:
+    """Подбирает число вызовов на замер (не меньше min_time / repeat) и возвращает время одного вызова"""
+    loops = 1
+    while True:
+        t = time.perf_counter()
+        run(loops)
+        elapsed = time.perf_counter() - t
+        if elapsed >= min_time / repeat or loops >= 1 << 20:
+            break
+        loops *= 10 if elapsed < min_time / (repeat * 20) else 2
+    samples = [elapsed / loops]
+    for _ in range(repeat - 1):
+        t = time.perf_counter()
+        run(loops)
+        samples.append((time.perf_counter() - t) / loops)
+    return {"median_us": statistics.median(samples) * 1e6, "best_us": min(samples) * 1e6, "loops": loops,
+            "repeat": repeat}
+
+
+def bench_sync(fn: Callable[[], object], min_time: float, repeat: int) -> dict:
+    def run(loops: int):
+        for _ in range(loops):
+            fn()
+    return _measure(run, min_time, repeat)
+
+
+def bench_async(loop: asyncio.AbstractEventLoop, fn: Callable[[], object], min_time: float, repeat: int) -> dict:
+    async def many(loops: int):
+        for _ in range(loops):
+            await fn()
+    return _measure(lambda loops: loop.run_until_complete(many(loops)), min_time, repeat)
+
+
+def bench_sweep(symbol: str, record: Callable[[str, dict], None], workers=(1, 2, 4), seconds: int = 3600,
+                combos: int = 8):
+    """Масштабирование sweep.run_sweep по числу процессов на синтетическом ряде (один прогон сетки на W)"""
+    import sweep
+    from backtest import synthetic_series, write_bin
+
+    with tempfile.TemporaryDirectory(prefix="bench_sweep_") as tmp:
+        path = os.path.join(tmp, "series.bin")
+        write_bin(synthetic_series(symbol, seconds, seed=1), path)
+        grid = {"rise_pct": [round(0.001 + 0.0005 * i, 4) for i in range(combos)]}
+        single = None
+        for w in workers:
+            started = time.perf_counter()
+            sweep.run_sweep(path, symbol, grid, w)
+            per_combo = (time.perf_counter() - started) / combos
+            single = single or per_combo
+            record(f"sweep[workers={w}]", {
+                "median_us": per_combo * 1e6, "best_us": per_combo * 1e6, "loops": combos, "repeat": 1,
+                "workers": w, "speedup": round(single / per_combo, 2), "cpu_count": os.cpu_count(),
+            })
+
+
+def run_suite(symbol: str, sizes: List[int], only: Optional[List[str]], min_time: float, repeat: int) -> Dict[str, dict]:
+    module = load_bot_module()
+    results: Dict[str, dict] = {}
+
+    def wanted(name: str) -> bool:
+        return not only or any(name.startswith(o) for o in only)
+
+    def record(name: str, res: dict):
+        results[name] = res
+        print(f"  {name:<44} {res['median_us']:>12.2f} us  (best {res['best_us']:.2f}, x{res['loops']})", flush=True)
+
+    price, size = Decimal("100000.4999"), Decimal("0.00123456")
+    if wanted("rprice"):
+        record("rprice", bench_sync(lambda: module.rprice(symbol, price), min_time, repeat))
+    if wanted("rsize"):
+        record("rsize", bench_sync(lambda: module.rsize(symbol, size), min_time, repeat))
+
+    if wanted("sweep"):
+        bench_sweep(symbol, record)
+
+    loop = asyncio.new_event_loop()
+    try:
+        for n in sizes:
+            with tempfile.TemporaryDirectory(prefix="bench_") as tmp:
+                started = time.perf_counter()
+                fx = Fixture(symbol, n, tmp)
+                print(f"🔧 {n} веток: состояние и {len(fx.exchange.orders)} SELL за {time.perf_counter() - started:.1f}s",
+                      flush=True)
+                bot, clock = fx.bot, fx.clock
+                branches = bot.branches[symbol]
+                middle = branches[max(1, n // 2)]
+                # Большие состояния меряются меньшим числом повторов
+                rep = repeat if n < 100000 else max(2, repeat // 2)
+
+                if wanted("save_state"):
+                    def save():
+                        clock.t += 1
+                        bot.update_branch_timestamp(symbol, middle.branch_id)
+                        bot._save_state()
+                    record(f"save_state[{n}]", bench_sync(save, min_time, rep))
+
+                if wanted("load_state"):
+                    def load():
+                        branches.clear()
+                        bot._dirty.clear()
+                        bot._load_state()
+                    record(f"load_state[{n}]", bench_sync(load, min_time, rep))
+                    # Загрузка создала новые объекты веток - индексы строятся заново, как при старте
+                    middle = branches[max(1, n // 2)]
+                    bot.aggs[symbol] = module.BranchAggregates.build(branches.values(), bot.specs[symbol])
+                    bot.stops[symbol] = module.StopIndex.build(branches.values(), bot.specs[symbol])
+
+                if wanted("get_branch_stats"):
+                    record(f"get_branch_stats[{n}]", bench_sync(lambda: bot.get_branch_stats(symbol), min_time, rep))
+
+                last = fx.exchange.stats(symbol).last_price
+                if wanted("check_branch_sl"):
+                    record(f"check_branch_sl[{n}]", bench_async(loop, lambda: bot.check_branch_sl(symbol, last),
+                                                                 min_time, rep))
+
+                if wanted("ensure_branch_sells_for_branch"):
+                    snap = loop.run_until_complete(bot.account_snapshot(symbol))
+                    open_by_cid = snap.sells_by_cid()
+                    open_by_leg = snap.sells_by_leg()
+                    record(f"ensure_branch_sells_for_branch[{n}]", bench_async(
+                        loop, lambda: bot._ensure_branch_sells_for_branch(symbol, middle, open_by_cid, snap,
+                                                                          open_by_leg=open_by_leg),
+                        min_time, rep))
+
+                if wanted("run_once"):
+                    def tick():
+                        bot._last_sell_check[symbol] = clock.monotonic()
+                        return bot.run_once(symbol)
+
+                    def tick_sell_check():
+                        bot._last_sell_check[symbol] = clock.monotonic() - module.SELL_CHECK_SECONDS
+                        return bot.run_once(symbol)
+                    record(f"run_once[{n}]", bench_async(loop, tick, min_time, rep))
+                    record(f"run_once_sell_check[{n}]", bench_async(loop, tick_sell_check, min_time, rep))
+                fx.close()
+    finally:
+        loop.close()
+    return results
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def compare(results: Dict[str, dict], baseline_path: str, threshold: float) -> List[str]:
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    base = baseline.get("results", {})
+    regressions = []
+    print(f"\nСравнение с {baseline_path} (коммит {baseline.get('meta', {}).get('commit')}):")
+    print(f"  {'бенчмарк':<44} {'было, us':>12} {'стало, us':>12} {'x':>7}")
+    for name, res in results.items():
+        if name not in base:
+            continue
+        ratio = res["median_us"] / base[name]["median_us"] if base[name]["median_us"] else float("inf")
+        mark = "⚠️" if ratio > threshold else ("🚀" if ratio < 1 / threshold else "")
+        print(f"  {name:<44} {base[name]['median_us']:>12.2f} {res['median_us']:>12.2f} {ratio:>7.2f} {mark}")
+        if ratio > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Бенчмарки горячих путей бота (офлайн, симулированная биржа)")
+    ap.add_argument("--symbol", default=config.MARKETS[0])
+    ap.add_argument("--sizes", default="10,1000,100000", help="число веток через запятую")
+    ap.add_argument("--only", help="префиксы бенчмарков через запятую (например run_once,save_state)")
+    ap.add_argument("--min-time", type=float, default=0.5, help="сек. на бенчмарк (на все повторы)")
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--out", default="benchmark_results.json")
+    ap.add_argument("--compare", metavar="BASELINE_JSON", help="сравнить с прошлым результатом")
+    ap.add_argument("--threshold", type=float, default=1.25, help="замедление, считающееся регрессией")
+    ap.add_argument("--fail-on-regression", action="store_true")
+    args = ap.parse_args()
+
+    sizes = [int(x) for x in args.sizes.split(",") if x]
+    only = [x for x in args.only.split(",") if x] if args.only else None
+    print(f"⏱️ {args.symbol}: ветки {sizes}", flush=True)
+    started = time.perf_counter()
+    results = run_suite(args.symbol, sizes, only, args.min_time, args.repeat)
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "symbol": args.symbol,
+            "sizes": sizes,
+            "wall_seconds": round(time.perf_counter() - started, 1),
+        },
+        "results": results,
+    }
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"✅ {len(results)} замеров за {report['meta']['wall_seconds']}s -> {args.out}")
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold)
+        if regressions:
+            print(f"⚠️ Замедление больше x{args.threshold}: {', '.join(regressions)}")
+            if args.fail_on_regression:
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
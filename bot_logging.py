@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+Non-blocking structured logging for Extended Trading Bot v2
+
+Bot.log не пишет в stdout сам: запись (время, уровень, пара, текст) кладётся в очередь,
+а фоновый поток-писатель забирает всё накопившееся, форматирует и пишет одним write + flush.
+Поток цикла событий не ждёт stdout / journald.
+
+Уровни: DEBUG < INFO < WARNING < ERROR; записи ниже LOG_LEVEL отбрасываются до очереди.
+Форматы (LOG_FORMAT):
+    text  - "[BTC-USD] 🟢 BUY размещён ..." (как раньше)
+    json  - {"ts": "...", "level": "INFO", "market": "BTC-USD", "msg": "...", "repeated": 3}
+
+Повторы:
+    - WARNING / ERROR без key: одинаковый текст той же пары в пределах LOG_DEDUP_SECONDS
+      подавляется (ошибка, повторяющаяся на каждом тике);
+    - с key: сообщения пары с этим ключом (например, статус тика) пишутся не чаще раза
+      в LOG_RATE_LIMIT_SECONDS, текст может меняться.
+События DEBUG / INFO без key (исполнения, размещения) не подавляются: одинаковый текст
+у них - это разные события.
+Число подавленных записей выводится со следующей записью того же ключа ("подавлено повторов: N")
+или при очистке устаревших ключей.
+"""
+
+import atexit
+import collections
+import datetime
+import json
+import sys
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+DEBUG, INFO, WARNING, ERROR = 10, 20, 30, 40
+LEVEL_NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARNING", ERROR: "ERROR"}
+LEVELS = {name: level for level, name in LEVEL_NAMES.items()}
+
+
+class AsyncLogger:
+    def __init__(self, level: int = INFO, fmt: str = "text", dedup_seconds: float = 10.0,
+                 rate_limit_seconds: float = 60.0, queue_size: int = 10000, stream=None, max_keys: int = 4096):
+        if fmt not in ("text", "json"):
+            raise ValueError(f"неизвестный формат логов: {fmt}")
+        self.level = level
+        self.fmt = fmt
+        self.dedup_seconds = dedup_seconds
+        self.rate_limit_seconds = rate_limit_seconds
+        self.stream = stream  # None - текущий sys.stdout
+        self.max_keys = max_keys
+        # Очередь записей: deque.append атомарен и дешевле queue.Queue; писатель будится событием
+        self.queue_size = queue_size
+        self._buf: collections.deque = collections.deque()
+        self._wake = threading.Event()
+        self._busy = False
+        self._stopping = False
+        # (пара, ключ или текст) -> [время последней записи, подавлено, уровень, текст, метка времени]
+        self._recent: Dict[Tuple[Optional[str], str], list] = {}
+        self._lock = threading.RLock()
+        self._thread: Optional[threading.Thread] = None
+        self.written: Dict[str, int] = {name: 0 for name in LEVEL_NAMES.values()}
+        self.suppressed = 0
+        self.dropped = 0
+
+    # ---------- hot path ----------
+    def log(self, level: int, symbol: Optional[str], msg: str, key: Optional[str] = None,
+            now: float = 0.0, ts: float = 0.0):
+        """Ставит запись в очередь. now - секунды монотонных часов бота (окна повторов), ts - Unix-время записи"""
+        if level < self.level:
+            return
+        if key is None and level < WARNING:
+            self._put((ts, level, symbol, msg, 0))
+            return
+        k = (symbol, msg if key is None else "\0" + key)
+        window = self.dedup_seconds if key is None else self.rate_limit_seconds
+        with self._lock:
+            st = self._recent.get(k)
+            if st is not None and now - st[0] < window:
+                st[1] += 1
+                st[3], st[4] = msg, ts
+                self.suppressed += 1
+                return
+            repeated = st[1] if st is not None else 0
+            self._recent[k] = [now, 0, level, msg, ts]
+            if len(self._recent) > self.max_keys:
+                self._prune(now)
+        self._put((ts, level, symbol, msg, repeated))
+
+    # Для модулей без часов бота (журнал состояния, потоки, служебные сообщения): время процесса
+    def info(self, msg: str, symbol: Optional[str] = None, key: Optional[str] = None):
+        self.log(INFO, symbol, msg, key, time.monotonic(), time.time())
+
+    def warning(self, msg: str, symbol: Optional[str] = None, key: Optional[str] = None):
+        self.log(WARNING, symbol, msg, key, time.monotonic(), time.time())
+
+    def error(self, msg: str, symbol: Optional[str] = None, key: Optional[str] = None):
+        self.log(ERROR, symbol, msg, key, time.monotonic(), time.time())
+
+    def _prune(self, now: float):
+        """Убирает ключи, окно которых истекло; подавленные повторы выводятся итоговой записью"""
+        window = max(self.dedup_seconds, self.rate_limit_seconds)
+        for k, (last, suppressed, level, msg, ts) in list(self._recent.items()):
+            if now - last >= window:
+                del self._recent[k]
+                if suppressed:
+                    self._put((ts, level, k[0], msg, suppressed))
+
+    def _put(self, record: tuple):
+        if self._thread is None:
+            self._start()
+        if len(self._buf) >= self.queue_size:
+            self.dropped += 1
+            return
+        self._buf.append(record)
+        if not self._wake.is_set():
+            self._wake.set()
+
+    # ---------- writer ----------
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._stopping = False
+                self._thread = threading.Thread(target=self._run, name="bot-log-writer", daemon=True)
+                self._thread.start()
+
+    def _format(self, record: tuple) -> str:
+        ts, level, symbol, msg, repeated = record
+        if self.fmt == "json":
+            out = {"ts": datetime.datetime.fromtimestamp(ts, datetime.timezone.utc).isoformat(),
+                   "level": LEVEL_NAMES.get(level, str(level)), "market": symbol, "msg": msg}
+            if repeated:
+                out["repeated"] = repeated
+            return json.dumps(out, ensure_ascii=False, default=str)
+        line = f"[{symbol}] {msg}" if symbol else msg
+        return f"{line} (подавлено повторов: {repeated})" if repeated else line
+
+    def _run(self):
+        buf = self._buf
+        while True:
+            self._wake.wait()
+            self._busy = True
+            self._wake.clear()
+            records = []
+            while buf:
+                records.append(buf.popleft())
+            if records:
+                try:
+                    stream = self.stream or sys.stdout
+                    stream.write("\n".join(self._format(r) for r in records) + "\n")
+                    stream.flush()
+                except Exception:
+                    pass
+                for r in records:
+                    name = LEVEL_NAMES.get(r[1])
+                    if name:
+                        self.written[name] += 1
+            self._busy = False
+            if self._stopping and not buf:
+                return
+
+    def flush(self, timeout: float = 5.0):
+        """Ждёт, пока писатель выведет всё, что уже в очереди"""
+        deadline = time.monotonic() + timeout
+        while (self._buf or self._busy) and self._thread is not None and self._thread.is_alive():
+            if time.monotonic() > deadline:
+                break
+            self._wake.set()
+            time.sleep(0.001)
+
+    def close(self):
+        """Выводит подавленные повторы и останавливает писателя (вызывается при выходе)"""
+        with self._lock:
+            self._prune(float("inf"))
+        if self._thread is not None and self._thread.is_alive():
+            self._stopping = True
+            self._wake.set()
+            self._thread.join(timeout=5)
+        self._thread = None
+
+
+_logger: Optional[AsyncLogger] = None
+
+
+def get_logger(**kwargs) -> AsyncLogger:
+    """Общий логгер процесса; параметры учитываются при первом вызове"""
+    global _logger
+    if _logger is None:
+        _logger = AsyncLogger(**kwargs)
+        atexit.register(_logger.close)
+    return _logger
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+Closed branch archive for Extended Trading Bot v2
+
+В памяти бота (Bot.branches) и в снимке состояния хранятся только активные ветки.
+Закрытая ветка дописывается одной JSON-строкой в архив (bot_state_archive.jsonl)
+и больше не участвует в тике. Архив читается только по запросу - для истории и PnL.
+
+Формат записи: состояние ветки (как в снимке) + поля
+    "closed_at"     - время закрытия (ISO)
+    "close_reason"  - причина (sold / sl / no-pos / ...)
+    "realized_pnl"  - реализованный PnL ветки в валюте котировки
+
+Пример:
+    archive = BranchArchive("bot_state_archive.jsonl")
+    archive.realized_pnl("BTC-USD", since=datetime.datetime(2025, 8, 1, tzinfo=datetime.timezone.utc))
+"""
+
+import datetime
+import json
+import os
+from decimal import Decimal
+from typing import Iterator, Optional
+
+
+class BranchArchive:
+    def __init__(self, path: str):
+        self.path = path
+        self._fh = None
+
+    def append(self, record: dict):
+        if self._fh is None:
+            self._fh = open(self.path, "a", encoding="utf-8")
+        self._fh.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+        self._fh.flush()
+
+    def iter_branches(self, symbol: Optional[str] = None,
+                      since: Optional[datetime.datetime] = None) -> Iterator[dict]:
+        """Закрытые ветки (последняя запись для каждой ветки), опционально по символу и времени закрытия"""
+        if not os.path.exists(self.path):
+            return
+        latest = {}
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue  # оборванная строка после падения
+                if symbol is not None and rec.get("symbol") != symbol:
+                    continue
+                # Ветка может попасть в архив дважды, если процесс упал до сжатия журнала
+                latest[(rec.get("symbol"), rec.get("branch_id"))] = rec
+        for rec in latest.values():
+            if since is not None:
+                closed_at = rec.get("closed_at")
+                if not closed_at or datetime.datetime.fromisoformat(closed_at) < since:
+                    continue
+            yield rec
+
+    def realized_pnl(self, symbol: Optional[str] = None, since: Optional[datetime.datetime] = None) -> Decimal:
+        return sum((Decimal(rec.get("realized_pnl") or "0") for rec in self.iter_branches(symbol, since)),
+                   Decimal("0"))
+
+    def close(self):
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental per-symbol branch aggregates and stop index for Extended Trading Bot v2
+
+BranchAggregates хранит по символу множество активных веток, суммарный размер и
+стоимость (size * buy_price), чтобы количество веток, общий размер и средняя цена
+читались за O(1), а не пересчитывались обходом всех веток несколько раз за тик.
+Размер и стоимость хранятся целыми числами (лоты и тики*лоты из MarketSpec), поэтому
+суммы точны и не копят ошибку округления. Цена этого - перевод нового размера в лоты
+в resize (benchmarks/bench_fixedpoint.py: вдвое медленнее Decimal-дельты); resize
+вызывается на исполнение, а чтения сумм - на каждом тике.
+
+Агрегаты обновляются только через методы add / resize / remove, которые Bot вызывает
+при создании, изменении размера и закрытии ветки. verify() сравнивает их с полным
+пересчётом (режим отладки BRANCH_AGG_VERIFY).
+
+StopIndex - отсортированный по stop_price (в тиках) список активных веток символа.
+Сработавшие при цене last ветки (last <= stop_price) - это хвост списка, который
+находится бинарным поиском, поэтому SL можно проверять на каждом обновлении цены.
+"""
+
+import bisect
+from decimal import ROUND_CEILING, Decimal
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+class BranchAggregates:
+    __slots__ = ("spec", "_entries", "lots", "cost")
+
+    def __init__(self, spec):
+        self.spec = spec
+        self._entries: Dict[int, Tuple[int, int]] = {}  # branch_id -> (размер в лотах, buy_price в тиках)
+        self.lots = 0   # сумма размеров в лотах
+        self.cost = 0   # сумма size * buy_price в лотах * тиках
+
+    @property
+    def active_ids(self):
+        return self._entries.keys()
+
+    @property
+    def count(self) -> int:
+        return len(self._entries)
+
+    @property
+    def total_size(self) -> Decimal:
+        return self.spec.from_lots(self.lots)
+
+    @property
+    def cost_sum(self) -> Decimal:
+        return Decimal(self.cost).scaleb(-(self.spec.size_prec + self.spec.price_prec))
+
+    @property
+    def wap(self) -> Decimal:
+        return self.cost_sum / self.total_size if self.lots > 0 else Decimal("0")
+
+    def add(self, b):
+        if b.branch_id in self._entries:
+            return
+        lots = self.spec.to_lots(b.size)
+        ticks = self.spec.to_ticks(b.buy_price)
+        self._entries[b.branch_id] = (lots, ticks)
+        self.lots += lots
+        self.cost += lots * ticks
+
+    def resize(self, b):
+        """Учитывает новое значение b.size (прежний размер берётся из агрегатов)"""
+        entry = self._entries.get(b.branch_id)
+        if entry is None:
+            return
+        old_lots, ticks = entry
+        lots = self.spec.to_lots(b.size)
+        self._entries[b.branch_id] = (lots, ticks)
+        self.lots += lots - old_lots
+        self.cost += (lots - old_lots) * ticks
+
+    def remove(self, b):
+        entry = self._entries.pop(b.branch_id, None)
+        if entry is None:
+            return
+        lots, ticks = entry
+        self.lots -= lots
+        self.cost -= lots * ticks
+
+    @classmethod
+    def build(cls, branches: Iterable, spec) -> "BranchAggregates":
+        agg = cls(spec)
+        for b in branches:
+            if b.active:
+                agg.add(b)
+        return agg
+
+    def verify(self, branches: Iterable) -> List[str]:
+        """Расхождения с полным пересчётом (пустой список - агрегаты верны)"""
+        full = self.build(branches, self.spec)
+        errors = []
+        if set(full.active_ids) != set(self.active_ids):
+            errors.append(f"active_ids: {sorted(self.active_ids)} != {sorted(full.active_ids)}")
+        if full.lots != self.lots:
+            errors.append(f"total_size: {self.total_size} != {full.total_size}")
+        if full.cost != self.cost:
+            errors.append(f"cost_sum: {self.cost_sum} != {full.cost_sum}")
+        return errors
+
+
+class StopIndex:
+    __slots__ = ("spec", "_keys", "_stops")
+
+    def __init__(self, spec):
+        self.spec = spec
+        self._keys: List[Tuple[int, int]] = []  # (stop_price в тиках, branch_id), по возрастанию
+        self._stops: Dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def add(self, b):
+        if b.branch_id in self._stops:
+            self.remove(b)
+        ticks = self.spec.to_ticks(b.stop_price)
+        self._stops[b.branch_id] = ticks
+        bisect.insort(self._keys, (ticks, b.branch_id))
+
+    def remove(self, b):
+        ticks = self._stops.pop(b.branch_id, None)
+        if ticks is None:
+            return
+        i = bisect.bisect_left(self._keys, (ticks, b.branch_id))
+        if i < len(self._keys) and self._keys[i] == (ticks, b.branch_id):
+            del self._keys[i]
+
+    def triggered(self, last: Decimal) -> List[int]:
+        """id веток, у которых last <= stop_price (одним срезом)"""
+        # Стоп кратен тику, поэтому last <= stop  <=>  ceil(last в тиках) <= stop в тиках
+        i = bisect.bisect_left(self._keys, (self.spec.to_ticks(last, ROUND_CEILING),))
+        return [branch_id for _, branch_id in self._keys[i:]]
+
+    def highest(self) -> Optional[Decimal]:
+        """Самый высокий стоп среди активных веток - ближайший к срабатыванию"""
+        return self.spec.from_ticks(self._keys[-1][0]) if self._keys else None
+
+    @classmethod
+    def build(cls, branches: Iterable, spec) -> "StopIndex":
+        idx = cls(spec)
+        idx._keys = sorted((spec.to_ticks(b.stop_price), b.branch_id) for b in branches if b.active)
+        idx._stops = {branch_id: ticks for ticks, branch_id in idx._keys}
+        return idx
+
+    def verify(self, branches: Iterable) -> List[str]:
+        full = self.build(branches, self.spec)
+        if full._keys != self._keys:
+            return [f"stop_index: {len(self._keys)} записей != {len(full._keys)} по пересчёту"]
+        return []
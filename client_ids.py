@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Client order id (external_id) codec for Extended Trading Bot v2
+
+Все external_id ордеров бота строятся и разбираются только здесь:
+    {symbol}:BR{branch_id}:S:{leg}:{nonce}   - SELL нога ветки
+    {symbol}:BR{branch_id}:SL:{nonce}        - market IOC стоп-лосса ветки
+    {symbol}:RISE:{nonce}                    - BUY покупки на росте
+
+index_sells() за один проход строит словарь (symbol, branch_id, leg) -> открытые
+ордера, чтобы сверка ветки с биржей не сканировала весь список ордеров на каждую ногу.
+"""
+
+import functools
+import uuid
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+SELL = "S"
+STOP_LOSS = "SL"
+RISE = "RISE"
+
+
+@dataclass(frozen=True)
+class ClientId:
+    symbol: str
+    kind: str
+    branch_id: Optional[int] = None
+    leg: Optional[str] = None
+    nonce: str = ""
+
+    def encode(self) -> str:
+        if self.kind == SELL:
+            return f"{self.symbol}:BR{self.branch_id}:{SELL}:{self.leg}:{self.nonce}"
+        if self.kind == STOP_LOSS:
+            return f"{self.symbol}:BR{self.branch_id}:{STOP_LOSS}:{self.nonce}"
+        return f"{self.symbol}:{self.kind}:{self.nonce}"
+
+
+def _nonce(n: int) -> str:
+    return uuid.uuid4().hex[:n]
+
+
+def sell_id(symbol: str, branch_id: int, leg: str) -> str:
+    return ClientId(symbol, SELL, branch_id, leg, _nonce(6)).encode()
+
+
+def stop_loss_id(symbol: str, branch_id: int) -> str:
+    return ClientId(symbol, STOP_LOSS, branch_id, None, _nonce(6)).encode()
+
+
+def rise_id(symbol: str) -> str:
+    return ClientId(symbol, RISE, None, None, _nonce(8)).encode()
+
+
+@functools.lru_cache(maxsize=8192)
+def decode(cid: Optional[str]) -> Optional[ClientId]:
+    """Разбирает external_id; None для чужих/неизвестных форматов"""
+    if not cid or not isinstance(cid, str):
+        return None
+    parts = cid.split(":")
+    if len(parts) == 3 and parts[1] == RISE:
+        return ClientId(parts[0], RISE, None, None, parts[2])
+    if len(parts) < 4 or not parts[1].startswith("BR") or not parts[1][2:].isdigit():
+        return None
+    branch_id = int(parts[1][2:])
+    if parts[2] == SELL and len(parts) == 5:
+        return ClientId(parts[0], SELL, branch_id, parts[3], parts[4])
+    if parts[2] == STOP_LOSS and len(parts) == 4:
+        return ClientId(parts[0], STOP_LOSS, branch_id, None, parts[3])
+    return None
+
+
+def renew(cid: str) -> str:
+    """Тот же ордер (символ, ветка, нога) с новым nonce - для переразмещения"""
+    parsed = decode(cid)
+    if parsed is None:
+        return ":".join(cid.split(":")[:-1] + [_nonce(8)])
+    return ClientId(parsed.symbol, parsed.kind, parsed.branch_id, parsed.leg, _nonce(len(parsed.nonce) or 8)).encode()
+
+
+def index_sells(orders: Iterable) -> Dict[Tuple[str, int, str], List]:
+    """(symbol, branch_id, leg) -> открытые SELL ордера ноги в исходном порядке"""
+    index: Dict[Tuple[str, int, str], List] = {}
+    for o in orders:
+        parsed = decode(getattr(o, "external_id", None))
+        if parsed is None or parsed.kind != SELL:
+            continue
+        index.setdefault((parsed.symbol, parsed.branch_id, parsed.leg), []).append(o)
+    return index
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+Wall and virtual clocks for Extended Trading Bot v2
+
+Бот берёт время только у часов (Bot.clock):
+    - now()        - текущее время UTC (время веток, expire_time ордеров, архив)
+    - monotonic()  - секунды для интервалов (TTL BUY, проверка SELL раз в 30 сек, период тика)
+    - sleep(s)     - ожидание внутри стратегии и планировщика
+
+SystemClock - реальное время и asyncio.sleep (по умолчанию). VirtualClock - время,
+которое двигает бэктест по меткам исторического ряда; sleep не ждёт, а только сдвигает
+виртуальное время, поэтому прогон идёт со скоростью CPU.
+"""
+
+import asyncio
+import datetime
+import time
+
+
+class SystemClock:
+    @property
+    def t(self) -> float:
+        """Секунды Unix-времени, как VirtualClock.t (по ним считает время симулированная биржа)"""
+        return time.time()
+
+    def now(self) -> datetime.datetime:
+        return datetime.datetime.now(datetime.timezone.utc)
+
+    def monotonic(self) -> float:
+        return asyncio.get_event_loop().time()
+
+    async def sleep(self, seconds: float):
+        await asyncio.sleep(seconds)
+
+
+class VirtualClock:
+    def __init__(self, start: float = 0.0):
+        self.t = float(start)  # секунды Unix-времени
+
+    def set(self, ts: float):
+        """Переводит часы на метку ряда; назад время не идёт (sleep мог уйти вперёд)"""
+        if ts > self.t:
+            self.t = ts
+
+    def now(self) -> datetime.datetime:
+        return datetime.datetime.fromtimestamp(self.t, datetime.timezone.utc)
+
+    def monotonic(self) -> float:
+        return self.t
+
+    async def sleep(self, seconds: float):
+        if seconds > 0:
+            self.t += seconds
+        await asyncio.sleep(0)
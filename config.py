@@ -60,12 +60,27 @@ PRICE_PRECISION = {
     "DOGE-USD": 5    # 0.00001 (5 знаков после запятой)
 }
 
+# Шаг лота по парам, если он крупнее шага точности размера (по умолчанию = 10^-SIZE_PRECISION)
+# Размеры ордеров округляются до кратного шагу лота
+LOT_STEP = {
+    # "ETH-USD": 0.05,
+}
+
 # Включенные рынки: временно только BTC
 MARKETS = ["BTC-USD", "HYPE-USD"]
 
 # Частота опроса (Tick)
 TICK_SECONDS = 3
 
+# Индивидуальная частота тика для пар (сек.); пары без записи используют TICK_SECONDS
+# Каждая пара работает в своей задаче: медленная пара не задерживает тики остальных
+MARKET_TICK_SECONDS = {
+    # "BTC-USD": 1,
+}
+
+# Окно (сек.), в котором пары делят один пакетный запрос позиций и ордеров
+ACCOUNT_BATCH_WINDOW_SECONDS = 1.0
+
 # Время жизни лимитного BUY ордера (сек.)
 BUY_TTL_SECONDS = 300
 
@@ -93,6 +108,18 @@ SELL_STEPS_PCT = {
     "DOGE-USD": [0.008, 0.016, 0.024],
 }
 
+# Максимум одновременных запросов при пакетном размещении SELL ног
+SELL_PLACE_CONCURRENCY = 5
+
+# Максимум одновременных отмен, если биржа/SDK не поддерживает массовую отмену
+CANCEL_CONCURRENCY = 10
+
+# Общий лимит REST-запросов к бирже на все пары (token bucket), 0 = без ограничения
+# При нехватке токенов первыми откладываются чтения, затем BUY, SELL и отмены; стоп-лосс не ждёт никогда
+RATE_LIMIT_PER_SECOND = 15
+# Запас токенов для коротких всплесков (например, переразмещение лестницы SELL)
+RATE_LIMIT_BURST = 30
+
 # Распределение размера позиции между тремя SELL ордерами
 SELL_SPLIT = [0.30, 0.30, 0.40]
 
@@ -103,6 +130,78 @@ PNL_MIN_PCT = 0.0005
 # Стоп-лосс на ветку (−2%)
 BRANCH_SL_PCT = -0.02
 
+# Потоковые рыночные данные (WebSocket) вместо опроса статистики рынка каждый тик
+# При включении цены берутся из памяти, а SL и триггер роста проверяются на каждом обновлении цены
+MARKET_STREAM_ENABLED = False
+# URL альтернативного JSON-потока (например, локальный LocalStreamServer); None = поток X10
+MARKET_STREAM_URL = None
+# Максимальный возраст цены из потока (сек.), после которого бот возвращается к REST;
+# last (сделки) и bid/ask (стакан) стареют независимо - обрыв одного потока не замораживает другой
+MARKET_STREAM_MAX_AGE = 5
+
+# Приватный поток аккаунта (исполнения и статусы ордеров) вместо вывода исполнений по дельте позиции
+# Пока поток подключен, ветки создаются и закрываются по событиям fill, а опрос отключается
+ACCOUNT_STREAM_ENABLED = False
+# URL альтернативного JSON-потока событий аккаунта (локальный LocalStreamServer); None = поток X10
+ACCOUNT_STREAM_URL = None
+
+# Биржа: "mainnet" - Extended (STARKNET_MAINNET_CONFIG);
+# "sim" - локальная симулированная биржа (sim_exchange.py) без реальных ордеров, для нагрузочных тестов.
+# В режиме sim потоки X10 не подключаются, состояние пишется в отдельный файл (<BOT_STATE_FILE>_sim.json)
+EXCHANGE_MODE = "mainnet"
+# Стартовые цены блуждания котировок симулированной биржи; пары без записи начинают со 100
+SIM_START_PRICES = {
+    "BTC-USD": 100000.0,
+    "ETH-USD": 3500.0,
+    "SOL-USD": 150.0,
+    "OP-USD": 1.5,
+    "HYPE-USD": 30.0,
+    "DOGE-USD": 0.15,
+}
+# Волатильность (СКО логарифма цены за секунду) и период обновления котировок (сек.)
+SIM_VOLATILITY = 0.0002
+SIM_QUOTE_SECONDS = 0.5
+# Задержки и сбои симулированной биржи (поля sim_exchange.FaultProfile)
+SIM_FAULTS = {
+    "latency_ms": 50,             # медиана задержки запроса
+    "latency_sigma": 0.5,         # разброс задержки (логнормальный)
+    "rate_limit_per_second": 20,  # лимит запросов биржи, сверх него - 429
+    "rate_limit_burst": 40,
+    "error_429_rate": 0.01,       # доля случайных 429
+    "partial_fill_rate": 0.1,     # доля частичных исполнений
+    "drop_rate": 0.005,           # доля ордеров, потерянных биржей
+}
+
+# Метрики тика (длительность фаз run_once по парам, перерасход тиков, ветки, висячие BUY, открытые ордера)
+# в формате Prometheus: http://METRICS_HOST:METRICS_PORT/metrics. Хост по умолчанию - только локальный
+METRICS_ENABLED = False
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9108
+# Отчёт в лог по запросам к бирже: вызовы на тик по фазам и методам API, повторные чтения в тике (сек.; 0 - выкл.)
+API_REPORT_SECONDS = 600
+
+# Логи бота (bot_logging.py): очередь и фоновый писатель вместо print на каждое сообщение
+# Уровень: "DEBUG" (в т.ч. пропуски проверок на каждом тике), "INFO", "WARNING", "ERROR"
+LOG_LEVEL = "INFO"
+# Формат: "text" - строки "[ПАРА] сообщение", "json" - JSON-строка на запись (ts, level, market, msg)
+LOG_FORMAT = "text"
+# Одинаковое предупреждение / ошибка пары повторно пишется не раньше чем через LOG_DEDUP_SECONDS сек.
+LOG_DEDUP_SECONDS = 10
+# Периодические сообщения (статус тика, лимит веток) - не чаще раза в LOG_RATE_LIMIT_SECONDS сек. на пару
+LOG_RATE_LIMIT_SECONDS = 60
+# Размер очереди записей; при переполнении новые записи отбрасываются (счётчик в /metrics)
+LOG_QUEUE_SIZE = 10000
+
+# Трассы ордеров (tracing.py): от сигнала роста до выставленных SELL и от срабатывания SL до исполнения IOC.
+# Длительности стадий всегда идут в /metrics; завершённые трассы дописываются в <BOT_STATE_FILE>_traces.jsonl
+TRACE_FILE_ENABLED = True
+
+# Сжатие журнала состояния (bot_state.json.journal) в снимок bot_state.json после N записей
+STATE_COMPACT_EVERY = 1000
+
+# Режим отладки: в конце каждого тика сверять счётчики веток (количество, размер, стоимость) с полным пересчётом
+BRANCH_AGG_VERIFY = False
+
 # Максимальное количество веток для пары (по умолчанию не ограничено)
 # Если установлено значение > 0, бот не будет создавать новые ветки при достижении лимита
 MAX_BRANCHES_PER_PAIR = 0  # 0 = не ограничено, > 0 = максимальное количество веток
@@ -1,9 +1,10 @@
 import asyncio
+import collections
+import functools
 import os
-import uuid
-import json
+import sys
 import datetime
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, fields
 from decimal import Decimal
 from typing import Dict, Optional
 
@@ -15,8 +16,28 @@ from x10.perpetual.accounts import StarkPerpetualAccount
 from x10.perpetual.orders import OrderSide, TimeInForce
 from x10.perpetual.positions import PositionSide
 
-from config import MARKETS, BUY_QTY, PRICE_PRECISION, SIZE_PRECISION, TICK_SECONDS, MIN_ORDER_SIZES
-from config import BUY_TTL_SECONDS, SELL_TTL_SECONDS, BUY6_STEP_PCT, SELL_STEPS_PCT, SELL_SPLIT, PNL_MIN_PCT, BRANCH_SL_PCT, MAX_BRANCHES_PER_PAIR
+from config import MARKETS, TICK_SECONDS
+from config import BUY_TTL_SECONDS, SELL_TTL_SECONDS, MAX_BRANCHES_PER_PAIR
+from config import MARKET_TICK_SECONDS, ACCOUNT_BATCH_WINDOW_SECONDS, SELL_PLACE_CONCURRENCY, CANCEL_CONCURRENCY
+from config import MARKET_STREAM_ENABLED, MARKET_STREAM_URL, MARKET_STREAM_MAX_AGE, ACCOUNT_STREAM_ENABLED, ACCOUNT_STREAM_URL
+from config import RATE_LIMIT_PER_SECOND, RATE_LIMIT_BURST, STATE_COMPACT_EVERY, BRANCH_AGG_VERIFY
+from config import EXCHANGE_MODE, SIM_START_PRICES, SIM_VOLATILITY, SIM_QUOTE_SECONDS, SIM_FAULTS
+from config import METRICS_ENABLED, METRICS_HOST, METRICS_PORT, API_REPORT_SECONDS
+from config import LOG_LEVEL, LOG_FORMAT, LOG_DEDUP_SECONDS, LOG_RATE_LIMIT_SECONDS, LOG_QUEUE_SIZE
+from config import TRACE_FILE_ENABLED
+from rate_limiter import Priority, PriorityRateLimiter
+from state_journal import StateJournal
+from branch_archive import BranchArchive
+from branch_index import BranchAggregates, StopIndex
+from clock import SystemClock
+import client_ids
+from market_specs import MARKET_SPECS, MarketSpec, compile_spec
+from streams import MarketDataFeed, AccountEventFeed, FillEvent, OrderEvent, Ticker
+from streams import json_ws_source, x10_account_source, x10_orderbook_source, x10_trades_source
+from sim_exchange import FaultProfile, SimExchange, SimTradingClient, random_walk_quotes
+from metrics import BotMetrics, MetricsServer
+from bot_logging import DEBUG, INFO, WARNING, ERROR, LEVELS, AsyncLogger, get_logger
+from tracing import Tracer
 
 load_dotenv()
 
@@ -26,35 +47,52 @@ STARK_PRIVATE_KEY = os.getenv("EXTENDED_STARK_PRIVATE")
 VAULT_ID = int(os.getenv("EXTENDED_VAULT_ID")) if os.getenv("EXTENDED_VAULT_ID") else None
 
 STATE_FILE = os.getenv("BOT_STATE_FILE", "bot_state.json")
+HALF = Decimal("0.5")
+SELL_CHECK_SECONDS = 30  # размещение SELL не чаще, чем раз в 30 сек
+ARCHIVE_FILE = os.getenv("BOT_ARCHIVE_FILE", os.path.splitext(STATE_FILE)[0] + "_archive.jsonl")
+TRACE_FILE = os.getenv("BOT_TRACE_FILE", os.path.splitext(STATE_FILE)[0] + "_traces.jsonl")
+
+
+def _spec(symbol: str) -> MarketSpec:
+    spec = MARKET_SPECS.get(symbol)
+    return spec if spec is not None else compile_spec(symbol)
+
+
+def bot_logger() -> AsyncLogger:
+    """Общий логгер процесса с параметрами LOG_* из config.py (бот, потоки, журнал состояния)"""
+    return get_logger(level=LEVELS[LOG_LEVEL], fmt=LOG_FORMAT, dedup_seconds=LOG_DEDUP_SECONDS,
+                      rate_limit_seconds=LOG_RATE_LIMIT_SECONDS, queue_size=LOG_QUEUE_SIZE)
 
 
 def rprice(symbol: str, v: Decimal) -> Decimal:
-    p = PRICE_PRECISION.get(symbol, 2)
-    q = Decimal(10) ** (-p)
-    return v.quantize(q)
+    return _spec(symbol).rprice(v)
 
 
 def rsize(symbol: str, v: Decimal) -> Decimal:
-    p = SIZE_PRECISION.get(symbol, 6)
-    q = Decimal(10) ** (-p)
-    vq = v.quantize(q)
-    if vq == 0 and v > 0:
-        return q
+    return _spec(symbol).rsize(v)
 
-    min_size = Decimal(str(MIN_ORDER_SIZES.get(symbol, "0.0001")))
 
-    if symbol == "BTC-USD":
-        if vq < min_size:
-            return min_size
-        rounded = (vq / Decimal("0.0001")).quantize(Decimal("1")) * Decimal("0.0001")
-        return max(rounded, min_size)
+def slotted(cls):
+    """dataclass с __slots__ (как dataclass(slots=True), который есть только с Python 3.10)
 
-    if vq < min_size:
-        return min_size
-    return vq
+    Без __dict__ у каждого объекта ветка и нога занимают в разы меньше памяти.
+    """
+    cls = dataclass(cls)
+    ns = dict(cls.__dict__)
+    names = tuple(f.name for f in fields(cls))
+    for name in names:
+        ns.pop(name, None)
+    ns.pop("__dict__", None)
+    ns.pop("__weakref__", None)
+    ns["__slots__"] = names
+    return type(cls)(cls.__name__, cls.__bases__, ns)
 
 
-@dataclass
+# Повторяющиеся значения (цели SELL, размеры, стопы) при загрузке состояния делят один объект
+_dec = functools.lru_cache(maxsize=4096)(Decimal)
+
+
+@slotted
 class SellLeg:
     leg: str
     target_pct: Decimal
@@ -64,7 +102,7 @@ class SellLeg:
     price: Optional[Decimal] = None
 
 
-@dataclass
+@slotted
 class Branch:
     branch_id: int
     symbol: str
@@ -76,11 +114,60 @@ class Branch:
     sells: Dict[str, SellLeg] = field(default_factory=dict)
     created_at: Optional[datetime.datetime] = None
     last_updated: Optional[datetime.datetime] = None
+    realized_pnl: Decimal = Decimal("0")
+
+
+@dataclass
+class AccountSnapshot:
+    """Снимок аккаунта по символу на один тик: позиция, WAP и открытые BUY/SELL ордера.
+
+    Снимок читается один раз в начале тика и передаётся во все фазы run_once.
+    После размещения ордеров ботом он помечается устаревшим (invalidate) и
+    перечитывается при следующем Bot.account_snapshot; отменённые ботом ордера
+    просто убираются из снимка (forget), т.к. результат отмены известен заранее.
+    """
+    symbol: str
+    size: Decimal = Decimal("0")
+    wap: Decimal = Decimal("0")
+    buys: list = field(default_factory=list)
+    sells: list = field(default_factory=list)
+    stale: bool = True
+
+    def invalidate(self):
+        self.stale = True
+
+    def forget(self, order_id: int):
+        self.buys = [o for o in self.buys if int(getattr(o, "id", 0) or 0) != order_id]
+        self.sells = [o for o in self.sells if int(getattr(o, "id", 0) or 0) != order_id]
+
+    def sells_by_cid(self) -> dict:
+        return {getattr(o, "external_id", ""): o for o in self.sells}
+
+    def sells_by_leg(self) -> dict:
+        return client_ids.index_sells(self.sells)
+
+    def buys_by_id(self) -> dict:
+        return {int(getattr(o, "id")): o for o in self.buys}
 
 
 class Bot:
-    def __init__(self, client: PerpetualTradingClient):
+    def __init__(self, client: PerpetualTradingClient, feed: Optional[MarketDataFeed] = None,
+                 account_feed: Optional[AccountEventFeed] = None,
+                 limiter: Optional[PriorityRateLimiter] = None,
+                 specs: Optional[Dict[str, MarketSpec]] = None,
+                 clock=None, state_file: str = STATE_FILE, archive_file: Optional[str] = None,
+                 logger: Optional[AsyncLogger] = None, trace_file: Optional[str] = None):
         self.c = client
+        # Источник времени: реальные часы или виртуальные часы бэктеста (clock.py)
+        self.clock = clock or SystemClock()
+        # Логи через очередь и фоновый писатель (bot_logging.py), с подавлением повторов
+        self.logger = logger or bot_logger()
+        # Параметры пар, заранее переведённые в Decimal (config.py -> MarketSpec)
+        self.specs: Dict[str, MarketSpec] = {m: (specs or MARKET_SPECS).get(m) or compile_spec(m) for m in MARKETS}
+        # Общий лимит запросов к бирже для всех пар (приоритеты: SL > отмены > SELL > BUY > чтения)
+        self.limiter = limiter or PriorityRateLimiter(RATE_LIMIT_PER_SECOND, RATE_LIMIT_BURST)
+        self.feed = feed
+        self.account_feed = account_feed
         self.branches: Dict[str, Dict[int, Branch]] = {m: {} for m in MARKETS}
         self.next_branch_id: Dict[str, int] = {m: 1 for m in MARKETS}
 
@@ -90,11 +177,74 @@ class Bot:
         # Висячие BUY ордера (переразмещение до полного fill)
         self.pending_buys: Dict[str, Dict[int, dict]] = {m: {} for m in MARKETS}
 
+        # Сериализация работы по символу: тик и реакция на поток цен не пересекаются
+        self._locks: Dict[str, asyncio.Lock] = {m: asyncio.Lock() for m in MARKETS}
+        # Счётчик размещённых ботом ордеров: снимок, прочитанный до размещения, устарел
+        self.order_epoch: Dict[str, int] = {m: 0 for m in MARKETS}
+        self._price_tasks: Dict[str, asyncio.Task] = {}
+
+        # Общий пакетный запрос аккаунта для независимых циклов пар
+        self._batch_task: Optional[asyncio.Task] = None
+        self._batch_started = 0.0
+        self._batch_epochs: Dict[str, int] = {}
+        self._batch_consumed: set = set()
+        # Перерасход времени тика по парам
+        self.tick_overruns: Dict[str, int] = {m: 0 for m in MARKETS}
+        # Длительность фаз тика и состояние пар для /metrics (metrics.py); счётчики бота читаются при запросе
+        self.metrics = BotMetrics()
+        self.metrics.gauge("tick_period_seconds", "Период тика пары", ("market",),
+                           lambda: [((m,), MARKET_TICK_SECONDS.get(m, TICK_SECONDS)) for m in MARKETS])
+        self.metrics.counter("tick_overruns_total", "Тики, не уложившиеся в период", ("market",),
+                             lambda: [((m,), n) for m, n in self.tick_overruns.items()])
+        self.metrics.gauge("active_branches", "Активные ветки пары", ("market",),
+                           lambda: [((m,), self.aggs[m].count) for m in MARKETS])
+        self.metrics.gauge("pending_buys", "Висячие BUY пары", ("market",),
+                           lambda: [((m,), len(self.pending_buys[m])) for m in MARKETS])
+        self.metrics.counter("log_records_total", "Записи лога, выведенные писателем", ("level",),
+                             lambda: [((name,), n) for name, n in self.logger.written.items()])
+        self.metrics.counter("log_suppressed_total", "Подавленные повторы сообщений", (),
+                             lambda: [((), self.logger.suppressed)])
+        self.metrics.counter("log_dropped_total", "Записи, отброшенные при переполнении очереди", (),
+                             lambda: [((), self.logger.dropped)])
+        # Отчёт по запросам к бирже (вызовы на тик, повторные чтения) раз в API_REPORT_SECONDS
+        self._api_report_at = self.clock.monotonic()
+        # Трассы ордеров по client id: задержки от сигнала до выставленных SELL и от SL до исполнения IOC
+        if trace_file is None:
+            trace_file = TRACE_FILE if state_file == STATE_FILE else os.path.splitext(state_file)[0] + "_traces.jsonl"
+        self.tracer = Tracer(self.metrics, self.clock, trace_file if TRACE_FILE_ENABLED else None)
+        # Ветки, созданные исполнением BUY в текущем тике: их SELL выставляются в том же тике
+        self._fresh_branches: Dict[str, set] = {m: set() for m in MARKETS}
+        if self.feed:
+            self.feed.add_listener(self._on_ticker)
+
+        # Исполнения из потока аккаунта; fill_polling=True - выводим исполнения опросом (поток недоступен)
+        self.fill_polling: Dict[str, bool] = {m: True for m in MARKETS}
+        self._account_generation: Dict[str, int] = {m: 0 for m in MARKETS}
+        self._account_events = collections.deque()
+        self._account_task: Optional[asyncio.Task] = None
+        if self.account_feed:
+            self.account_feed.add_listener(self._on_account_event)
+
+        # Журнал состояния: дописываются только ветки, изменённые с прошлой записи (помечаются в _mark_dirty)
+        self.journal = StateJournal(state_file, STATE_COMPACT_EVERY, logger=self.logger)
+        self._dirty: set = set()
+        self._journaled_meta: Optional[dict] = None
+        # Закрытые ветки живут только в архиве на диске
+        if archive_file is None:
+            archive_file = ARCHIVE_FILE if state_file == STATE_FILE else os.path.splitext(state_file)[0] + "_archive.jsonl"
+        self.archive = BranchArchive(archive_file)
         self._load_state()
+        # Счётчики активных веток по символу: количество, общий размер, стоимость (O(1) вместо обхода веток)
+        self.aggs: Dict[str, BranchAggregates] = {
+            m: BranchAggregates.build(self.branches[m].values(), self.specs[m]) for m in MARKETS
+        }
+        # Активные ветки, отсортированные по stop_price: SL проверяется бинарным поиском
+        self.stops: Dict[str, StopIndex] = {m: StopIndex.build(self.branches[m].values(), self.specs[m]) for m in MARKETS}
 
     # ---------- utils ----------
-    def log(self, s: str, msg: str):
-        print(f"[{s}] {msg}", flush=True)
+    def log(self, s: Optional[str], msg: str, level: int = INFO, key: Optional[str] = None):
+        """Запись в очередь логгера; key - периодическое сообщение, не чаще LOG_RATE_LIMIT_SECONDS"""
+        self.logger.log(level, s, msg, key, self.clock.monotonic(), self.clock.t)
 
     def new_branch_id(self, symbol: str) -> int:
         bid = self.next_branch_id[symbol]
@@ -102,62 +252,170 @@ class Bot:
         return bid
 
     def has_active(self, symbol: str) -> bool:
-        return any(b.active and b.size > 0 for b in self.branches[symbol].values())
+        return self.aggs[symbol].lots > 0
+
+    def _set_branch_size(self, symbol: str, b: Branch, size: Decimal):
+        """Все изменения размера ветки идут через этот метод, чтобы агрегаты оставались верными"""
+        b.size = size
+        self.aggs[symbol].resize(b)
+        self._dirty.add((symbol, b.branch_id))
+
+    def _mark_dirty(self, symbol: str, branch_id: int):
+        """Ветка изменилась: следующий _save_state допишет её в журнал"""
+        self._dirty.add((symbol, branch_id))
+
+    def _verify_aggregates(self, symbol: str):
+        branches = self.branches[symbol].values()
+        errors = self.aggs[symbol].verify(branches) + self.stops[symbol].verify(branches)
+        if errors:
+            self.log(symbol, f"❌ Агрегаты веток расходятся с пересчётом: {'; '.join(errors)}", level=ERROR)
+            self.aggs[symbol] = BranchAggregates.build(branches, self.specs[symbol])
+            self.stops[symbol] = StopIndex.build(branches, self.specs[symbol])
 
     def get_branch_stats(self, symbol: str) -> dict:
         """Возвращает статистику по веткам для символа"""
-        active_branches = [b for b in self.branches[symbol].values() if b.active]
-        total_size = sum(b.size for b in active_branches)
-        total_value = sum(b.size * b.buy_price for b in active_branches)
-        avg_price = total_value / total_size if total_size > 0 else Decimal("0")
-        
+        agg = self.aggs[symbol]
         return {
-            "active_count": len(active_branches),
-            "total_size": total_size,
-            "avg_price": avg_price,
+            "active_count": agg.count,
+            "total_size": agg.total_size,
+            "avg_price": agg.wap,
             "max_limit": MAX_BRANCHES_PER_PAIR if MAX_BRANCHES_PER_PAIR > 0 else None,
-            "can_create_new": MAX_BRANCHES_PER_PAIR == 0 or len(active_branches) < MAX_BRANCHES_PER_PAIR
+            "can_create_new": MAX_BRANCHES_PER_PAIR == 0 or agg.count < MAX_BRANCHES_PER_PAIR
         }
 
+    async def _api(self, priority: Priority, symbol: str, fn, **kwargs):
+        """Любой запрос к бирже идёт через общий лимитер и учитывается в metrics.api (вызывающий - фаза тика)"""
+        await self.limiter.acquire(priority, symbol)
+        endpoint = getattr(fn, "__name__", "call")
+        started = self.clock.monotonic()
+        try:
+            res = await fn(**kwargs)
+        except Exception as e:
+            self.metrics.api.record(endpoint, symbol, self.clock.monotonic() - started, type(e).__name__)
+            raise
+        # Повторы ищутся только среди чтений: размещение и отмену повторять незачем
+        self.metrics.api.record(endpoint, symbol, self.clock.monotonic() - started, "ok",
+                                (kwargs, res) if priority == Priority.READ else None)
+        return res
+
     async def stats(self, symbol: str):
-        return await self.c.markets_info.get_market_statistics(market_name=symbol)
+        return await self._api(Priority.READ, symbol, self.c.markets_info.get_market_statistics, market_name=symbol)
 
     async def best_bid_ask(self, symbol: str):
+        book = self.feed.book(symbol, MARKET_STREAM_MAX_AGE) if self.feed else None
+        if book is not None:
+            return book
         st = await self.stats(symbol)
         bid = getattr(st.data, "bid_price", None) or getattr(st.data, "best_bid", None)
         ask = getattr(st.data, "ask_price", None) or getattr(st.data, "best_ask", None)
         return Decimal(str(bid)), Decimal(str(ask))
 
     async def last_price(self, symbol: str) -> Decimal:
+        t = self.feed.get(symbol, MARKET_STREAM_MAX_AGE) if self.feed else None
+        if t and t.last is not None:
+            return t.last
         st = await self.stats(symbol)
         lp = getattr(st.data, "last_price", None) or getattr(st.data, "mark_price", None)
         return Decimal(str(lp))
 
-    async def position(self, symbol: str):
-        res = await self.c.account.get_positions(market_names=[symbol], position_side=PositionSide.LONG)
+    @staticmethod
+    def _parse_position(positions):
         size = Decimal("0"); wap = Decimal("0")
-        for p in (res.data or []):
+        for p in positions:
             sz = getattr(p, "size", Decimal(0))
             if sz and Decimal(str(sz)) > 0:
                 size = Decimal(str(sz)); wap = Decimal(str(getattr(p, "open_price", 0))); break
         return size, wap
 
+    async def position(self, symbol: str):
+        res = await self._api(Priority.READ, symbol, self.c.account.get_positions,
+                              market_names=[symbol], position_side=PositionSide.LONG)
+        return self._parse_position(res.data or [])
+
     async def open_orders(self, symbol: str, side: Optional[OrderSide] = None):
         kw = {"market_names": [symbol]}
         if side:
             kw["order_side"] = side
-        res = await self.c.account.get_open_orders(**kw)
+        res = await self._api(Priority.READ, symbol, self.c.account.get_open_orders, **kw)
         return res.data or []
 
-    async def cancel_order(self, order_id: int):
-        await self.c.orders.cancel_order(order_id=order_id)
+    async def account_snapshot(self, symbol: str, snap: Optional[AccountSnapshot] = None) -> AccountSnapshot:
+        """Возвращает актуальный снимок аккаунта; snap переиспользуется, если не устарел"""
+        if snap is None:
+            snap = AccountSnapshot(symbol=symbol)
+        if snap.stale:
+            (snap.size, snap.wap), opens = await asyncio.gather(self.position(symbol), self.open_orders(symbol))
+            snap.buys = [o for o in opens if getattr(o, "side", None) == OrderSide.BUY]
+            snap.sells = [o for o in opens if getattr(o, "side", None) == OrderSide.SELL]
+            snap.stale = False
+        return snap
+
+    async def account_snapshots(self, markets: list) -> Dict[str, AccountSnapshot]:
+        """Снимки по всем рынкам сразу: один get_positions и один get_open_orders на тик"""
+        pos_res, ord_res = await asyncio.gather(
+            self._api(Priority.READ, "*", self.c.account.get_positions,
+                      market_names=list(markets), position_side=PositionSide.LONG),
+            self._api(Priority.READ, "*", self.c.account.get_open_orders, market_names=list(markets)),
+        )
+        positions: Dict[str, list] = {m: [] for m in markets}
+        for p in (pos_res.data or []):
+            positions.setdefault(getattr(p, "market", None), []).append(p)
+        snaps = {m: AccountSnapshot(symbol=m, stale=False) for m in markets}
+        for m, snap in snaps.items():
+            snap.size, snap.wap = self._parse_position(positions[m])
+        for o in (ord_res.data or []):
+            snap = snaps.get(getattr(o, "market", None))
+            if snap is None:
+                continue
+            side = getattr(o, "side", None)
+            if side == OrderSide.BUY:
+                snap.buys.append(o)
+            elif side == OrderSide.SELL:
+                snap.sells.append(o)
+        return snaps
+
+    async def cancel_order(self, order_id: int, symbol: str = "*"):
+        await self._api(Priority.CANCEL, symbol, self.c.orders.cancel_order, order_id=order_id)
+
+    async def cancel_orders(self, symbol: str, order_ids: list) -> list:
+        """Отменяет набор ордеров одним mass_cancel, если SDK его поддерживает, иначе параллельно.
+
+        Возвращает id ордеров, отмена которых не завершилась ошибкой.
+        """
+        if not order_ids:
+            return []
+        mass_cancel = getattr(self.c.orders, "mass_cancel", None)
+        if mass_cancel is not None:
+            try:
+                await self._api(Priority.CANCEL, symbol, mass_cancel, order_ids=list(order_ids))
+                return list(order_ids)
+            except Exception as e:
+                self.log(symbol, f"❌ Ошибка массовой отмены, отменяем по одному: {e}", level=ERROR)
+
+        sem = asyncio.Semaphore(CANCEL_CONCURRENCY)
+
+        async def cancel(oid):
+            async with sem:
+                await self.cancel_order(oid, symbol)
+
+        results = await asyncio.gather(*(cancel(oid) for oid in order_ids), return_exceptions=True)
+        done = []
+        for oid, res in zip(order_ids, results):
+            if isinstance(res, Exception):
+                self.log(symbol, f"❌ Ошибка отмены ордера {oid}: {res}", level=ERROR)
+            else:
+                done.append(oid)
+        return done
 
     async def place_limit(self, symbol: str, side: OrderSide, price: Decimal, size: Decimal, client_id: str,
                           ttl_seconds: Optional[int] = None) -> Optional[int]:
+        self.order_epoch[symbol] += 1
         expire_time = None
         if ttl_seconds:
-            expire_time = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=ttl_seconds)
-        resp = await self.c.place_order(
+            expire_time = self.clock.now() + datetime.timedelta(seconds=ttl_seconds)
+        priority = Priority.SELL if side == OrderSide.SELL else Priority.BUY
+        resp = await self._api(
+            priority, symbol, self.c.place_order,
             market_name=symbol,
             amount_of_synthetic=size,
             price=price,
@@ -168,9 +426,15 @@ class Bot:
         )
         return int(resp.data.id) if resp and getattr(resp, "data", None) else None
 
-    async def place_market_sell_ioc(self, symbol: str, size: Decimal, client_id: str):
-        last = await self.last_price(symbol)
-        resp = await self.c.place_order(
+    async def place_market_sell_ioc(self, symbol: str, size: Decimal, client_id: str,
+                                    price: Optional[Decimal] = None):
+        self.order_epoch[symbol] += 1
+        last = price
+        if last is None:
+            with self.limiter.priority(Priority.STOP_LOSS):
+                last = await self.last_price(symbol)
+        resp = await self._api(
+            Priority.STOP_LOSS, symbol, self.c.place_order,
             market_name=symbol,
             amount_of_synthetic=size,
             price=last,
@@ -181,47 +445,106 @@ class Bot:
         return int(resp.data.id) if resp and getattr(resp, "data", None) else None
 
     # ---------- state ----------
-    def _save_state(self):
-        data = {
-            "branches": {},
-            "next_branch_id": self.next_branch_id,
+    @staticmethod
+    def _branch_record(branch: Branch) -> dict:
+        return {
+            "branch_id": branch.branch_id,
+            "symbol": branch.symbol,
+            "buy_price": str(branch.buy_price),
+            "size": str(branch.size),
+            "wap": str(branch.wap),
+            "stop_price": str(branch.stop_price),
+            "active": branch.active,
+            "created_at": branch.created_at.isoformat() if branch.created_at else None,
+            "last_updated": branch.last_updated.isoformat() if branch.last_updated else None,
+            "realized_pnl": str(branch.realized_pnl),
+            "sells": {
+                leg_name: {
+                    "leg": leg.leg,
+                    "target_pct": str(leg.target_pct),
+                    "size": str(leg.size),
+                    "order_id": leg.order_id,
+                    "client_id": leg.client_id,
+                    "price": str(leg.price) if leg.price else None,
+                }
+                for leg_name, leg in branch.sells.items()
+            },
+        }
+
+    @staticmethod
+    def _branch_from_record(branch_id: int, branch_data: dict) -> Branch:
+        created_at = branch_data["created_at"]
+        last_updated = branch_data["last_updated"]
+        b = Branch(
+            branch_id=branch_id,
+            symbol=sys.intern(branch_data["symbol"]),
+            buy_price=_dec(branch_data["buy_price"]),
+            size=_dec(branch_data["size"]),
+            wap=_dec(branch_data["wap"]),
+            stop_price=_dec(branch_data["stop_price"]),
+            active=branch_data["active"],
+            created_at=datetime.datetime.fromisoformat(created_at) if created_at else None,
+            last_updated=datetime.datetime.fromisoformat(last_updated) if last_updated else None,
+            realized_pnl=_dec(branch_data.get("realized_pnl") or "0"),
+        )
+        for leg_name, leg_data in branch_data.get("sells", {}).items():
+            leg_name = sys.intern(leg_name)
+            b.sells[leg_name] = SellLeg(
+                leg=leg_name,
+                target_pct=_dec(leg_data["target_pct"]),
+                size=_dec(leg_data["size"]),
+                order_id=leg_data.get("order_id"),
+                client_id=leg_data.get("client_id"),
+                price=_dec(leg_data["price"]) if leg_data.get("price") else None,
+            )
+        return b
+
+    def _meta_record(self) -> dict:
+        return {
+            "t": "meta",
+            "next_branch_id": dict(self.next_branch_id),
             "rise_anchor": {s: str(a) if a is not None else None for s, a in self.rise_anchor.items()},
         }
-        for symbol in MARKETS:
-            data["branches"][symbol] = {}
-            for branch_id, branch in self.branches[symbol].items():
-                data["branches"][symbol][branch_id] = {
-                    "branch_id": branch.branch_id,
-                    "symbol": branch.symbol,
-                    "buy_price": str(branch.buy_price),
-                    "size": str(branch.size),
-                    "wap": str(branch.wap),
-                    "stop_price": str(branch.stop_price),
-                    "active": branch.active,
-                    "created_at": branch.created_at.isoformat() if branch.created_at else None,
-                    "last_updated": branch.last_updated.isoformat() if branch.last_updated else None,
-                    "sells": {},
-                }
-                for leg_name, leg in branch.sells.items():
-                    data["branches"][symbol][branch_id]["sells"][leg_name] = {
-                        "leg": leg.leg,
-                        "target_pct": str(leg.target_pct),
-                        "size": str(leg.size),
-                        "order_id": leg.order_id,
-                        "client_id": leg.client_id,
-                        "price": str(leg.price) if leg.price else None,
-                    }
+
+    def _state_data(self) -> dict:
+        meta = self._meta_record()
+        return {
+            "branches": {
+                symbol: {branch_id: self._branch_record(b) for branch_id, b in self.branches[symbol].items()}
+                for symbol in MARKETS
+            },
+            "next_branch_id": meta["next_branch_id"],
+            "rise_anchor": meta["rise_anchor"],
+        }
+
+    def _save_state(self):
+        """Дописывает в журнал ветки, помеченные изменёнными (_mark_dirty); периодически сжимает журнал в снимок.
+
+        Стоимость - по числу изменённых веток, а не активных: одно изменение - одна запись.
+        """
+        records = []
+        meta = self._meta_record()
+        if meta != self._journaled_meta:
+            records.append(meta)
+            self._journaled_meta = meta
+        if self._dirty:
+            for symbol, branch_id in self._dirty:
+                # Ушедшая в архив ветка записана в журнал как "closed"; неактивная, но не архивированная - пишется
+                branch = self.branches[symbol].get(branch_id)
+                if branch is not None:
+                    records.append({"t": "branch", "m": symbol, "data": self._branch_record(branch)})
+            self._dirty.clear()
 
         try:
-            with open(STATE_FILE, "w", encoding="utf-8") as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            self.journal.append(records)
+            if self.journal.needs_compaction():
+                self.journal.compact(self._state_data())
         except Exception as e:
-            print(f"Ошибка сохранения состояния: {e}")
+            self.log(None, f"❌ Ошибка сохранения состояния: {e}", level=ERROR)
 
     def _load_state(self):
         try:
-            with open(STATE_FILE, "r", encoding="utf-8") as f:
-                data = json.load(f)
+            data = self.journal.load()
 
             if "rise_anchor" in data:
                 for m in MARKETS:
@@ -233,40 +556,72 @@ class Bot:
                     if symbol in data["branches"]:
                         for branch_id, branch_data in data["branches"][symbol].items():
                             branch_id = int(branch_id)
-                            b = Branch(
-                                branch_id=branch_id,
-                                symbol=branch_data["symbol"],
-                                buy_price=Decimal(branch_data["buy_price"]),
-                                size=Decimal(branch_data["size"]),
-                                wap=Decimal(branch_data["wap"]),
-                                stop_price=Decimal(branch_data["stop_price"]),
-                                active=branch_data["active"],
-                                created_at=datetime.datetime.fromisoformat(branch_data["created_at"]) if branch_data["created_at"] else None,
-                                last_updated=datetime.datetime.fromisoformat(branch_data["last_updated"]) if branch_data["last_updated"] else None,
-                            )
-                            if "sells" in branch_data:
-                                for leg_name, leg_data in branch_data["sells"].items():
-                                    b.sells[leg_name] = SellLeg(
-                                        leg=leg_name,
-                                        target_pct=Decimal(leg_data["target_pct"]),
-                                        size=Decimal(leg_data["size"]),
-                                        order_id=leg_data.get("order_id"),
-                                        client_id=leg_data.get("client_id"),
-                                        price=Decimal(leg_data["price"]) if leg_data.get("price") else None,
-                                    )
-                            self.branches[symbol][branch_id] = b
+                            self.branches[symbol][branch_id] = self._branch_from_record(branch_id, branch_data)
 
             if "next_branch_id" in data:
                 for symbol in MARKETS:
                     if symbol in data["next_branch_id"]:
                         self.next_branch_id[symbol] = data["next_branch_id"][symbol]
         except Exception as e:
-            print(f"Ошибка загрузки состояния: {e}")
+            self.log(None, f"❌ Ошибка загрузки состояния: {e}", level=ERROR)
+            return
+
+        # Закрытые ветки из старого состояния переносим в архив - в памяти остаются только активные
+        migrated = 0
+        for symbol in MARKETS:
+            for branch_id, branch in list(self.branches[symbol].items()):
+                if not branch.active:
+                    self._archive_branch(symbol, branch, reason="migrated", journal=False)
+                    migrated += 1
+        if migrated:
+            self.log(None, f"📦 Перенесено в архив закрытых веток: {migrated}")
+
+        # Базовая линия для журнала: при старте журнал сворачивается в свежий снимок
+        self._journaled_meta = self._meta_record()
+        self._dirty.clear()
+        try:
+            self.journal.compact(self._state_data())
+        except Exception as e:
+            self.log(None, f"❌ Ошибка сжатия журнала состояния: {e}", level=ERROR)
+
+    # ---------- archive ----------
+    def _archive_branch(self, symbol: str, b: Branch, reason: str, journal: bool = True):
+        record = self._branch_record(b)
+        record["closed_at"] = (b.last_updated or self.clock.now()).isoformat()
+        record["close_reason"] = reason
+        self.archive.append(record)
+        self.branches[symbol].pop(b.branch_id, None)
+        self._dirty.discard((symbol, b.branch_id))
+        if journal:
+            self.journal.append([{"t": "closed", "m": symbol, "id": b.branch_id}])
+
+    def deactivate_branch(self, symbol: str, b: Branch, reason: str):
+        """Закрывает ветку и переносит её из памяти в архив (PnL и история - через self.archive)"""
+        self.aggs[symbol].remove(b)
+        self.stops[symbol].remove(b)
+        b.active = False
+        self._fresh_branches[symbol].discard(b.branch_id)
+        # Ветка закрыта раньше, чем выставились все её SELL
+        self.tracer.finish(self.tracer.branch_key(symbol, b.branch_id), "branch_closed")
+        self.update_branch_timestamp(symbol, b.branch_id)
+        try:
+            self._archive_branch(symbol, b, reason)
+        except Exception as e:
+            # Без записи в архив ветка остаётся в памяти неактивной и попадёт в архив при следующем старте
+            self.log(symbol, f"❌ Ошибка архивации ветки {b.branch_id}: {e}", level=ERROR)
+
+    def realized_pnl(self, symbol: Optional[str] = None, since: Optional[datetime.datetime] = None) -> Decimal:
+        """Реализованный PnL: закрытые ветки из архива + частичные продажи активных веток"""
+        total = self.archive.realized_pnl(symbol, since)
+        for m in ([symbol] if symbol else MARKETS):
+            total += sum((b.realized_pnl for b in self.branches[m].values()), Decimal("0"))
+        return total
 
     def update_branch_timestamp(self, symbol: str, branch_id: int):
         if symbol in self.branches and branch_id in self.branches[symbol]:
-            self.branches[symbol][branch_id].last_updated = datetime.datetime.now(datetime.timezone.utc)
-            self.log(symbol, f"🕒 Обновлено время ветки {branch_id}")
+            self.branches[symbol][branch_id].last_updated = self.clock.now()
+            self._dirty.add((symbol, branch_id))
+            self.log(symbol, f"🕒 Обновлено время ветки {branch_id}", level=DEBUG)
 
     # ---------- logging helpers ----------
     def log_branch_state(self, symbol: str, b: Branch, note: str = ""):
@@ -277,27 +632,32 @@ class Bot:
         )
 
     # ИСПРАВЛЕНИЕ 2: Добавить детальное логирование расхождений
-    async def log_position_mismatch(self, symbol: str):
+    async def log_position_mismatch(self, symbol: str, snap: Optional[AccountSnapshot] = None):
         """Логирование расхождений между позицией и ветками"""
-        total_branches = sum(b.size for b in self.branches[symbol].values() if b.active)
-        real_pos, real_wap = await self.position(symbol)
+        agg = self.aggs[symbol]
+        total_branches = agg.total_size
+        snap = await self.account_snapshot(symbol, snap)
+        real_pos = snap.size
         
-        if abs(total_branches - real_pos) > Decimal("0.0001"):
-            self.log(symbol, f"⚠️ РАСХОЖДЕНИЕ: ветки={total_branches}, позиция={real_pos}, разница={total_branches - real_pos}")
+        # Сравнение в целых лотах: расхождение - это хотя бы один шаг размера, без ошибок округления
+        if agg.lots != self.specs[symbol].to_lots(real_pos):
+            self.log(symbol, f"⚠️ РАСХОЖДЕНИЕ: ветки={total_branches}, позиция={real_pos}, разница={total_branches - real_pos}", level=WARNING)
             
             # Детализация по веткам
             for b_id, b in self.branches[symbol].items():
                 if b.active:
-                    self.log(symbol, f"   Ветка {b_id}: size={b.size}, active={b.active}")
+                    self.log(symbol, f"   Ветка {b_id}: size={b.size}, active={b.active}", level=WARNING)
             
             return True
         return False
 
     # ИСПРАВЛЕНИЕ 2: Отслеживание исполнений селл ордеров
-    async def track_sell_executions(self, symbol: str):
+    async def track_sell_executions(self, symbol: str, snap: Optional[AccountSnapshot] = None):
         """Отслеживание исполненных селл ордеров и корректировка размеров веток"""
-        opens = await self.open_orders(symbol, side=OrderSide.SELL)
-        open_by_cid = {getattr(o, "external_id", ""): o for o in opens}
+        if not self.fill_polling[symbol]:
+            return  # исполнения SELL приходят событиями (on_fill_event)
+        snap = await self.account_snapshot(symbol, snap)
+        open_by_cid = snap.sells_by_cid()
         
         state_changed = False
         for b_id, b in list(self.branches[symbol].items()):
@@ -316,30 +676,32 @@ class Bot:
                         # Ордер исполнен или отменен - считаем полностью исполненным
                         if leg.order_id:  # Если был размещен
                             total_executed += leg.size
+                            if leg.price:
+                                b.realized_pnl += (leg.price - (b.wap or b.buy_price)) * leg.size
                             leg.order_id = None
                             leg.client_id = None
+                            self._mark_dirty(symbol, b_id)
                             state_changed = True
             
             # Корректируем размер ветки на основе исполненных селлов
             if total_executed > 0 and total_executed < b.size:
                 old_size = b.size
-                b.size = rsize(symbol, b.size - total_executed)
+                self._set_branch_size(symbol, b, self.specs[symbol].rsize(b.size - total_executed))
                 if b.size != old_size:
                     self.log(symbol, f"📉 Ветка {b_id}: размер {old_size} → {b.size} (исполнено SELL: {total_executed})")
                     self.update_branch_timestamp(symbol, b_id)
                     state_changed = True
             elif total_executed >= b.size:
                 # Ветка полностью продана
-                b.active = False
                 self.log(symbol, f"✅ Ветка {b_id}: полностью продана ({total_executed})")
-                self.update_branch_timestamp(symbol, b_id)
+                self.deactivate_branch(symbol, b, "sold")
                 state_changed = True
         
         if state_changed:
             self._save_state()
 
     # ---------- core: buy on rise ----------
-    async def maybe_buy_on_rise(self, symbol: str, last: Decimal):
+    async def maybe_buy_on_rise(self, symbol: str, last: Decimal, snap: Optional[AccountSnapshot] = None):
         anchor = self.rise_anchor[symbol]
         if anchor is None:
             self.rise_anchor[symbol] = last
@@ -348,50 +710,72 @@ class Bot:
 
         if last < anchor:
             self.rise_anchor[symbol] = last
-            self.log(symbol, f"📉 Новый минимум: {last}")
+            self.log(symbol, f"📉 Новый минимум: {last}", level=DEBUG)
             return
 
-        trigger = anchor * (Decimal("1") + Decimal(str(BUY6_STEP_PCT[symbol])))
-        self.log(symbol, f"🎯 Проверка роста: last={last}, anchor={anchor}, trigger={trigger}")
+        trigger = anchor * self.specs[symbol].rise_mult
+        self.log(symbol, f"🎯 Проверка роста: last={last}, anchor={anchor}, trigger={trigger}", level=DEBUG)
         if last < trigger:
             return
 
         # Не дублируем buy, если уже есть pending BUY
         if any(meta.get("kind") == "BUY" for meta in self.pending_buys[symbol].values()):
-            self.log(symbol, "🔒 BUY уже размещён, ждём исполнения")
+            self.log(symbol, "🔒 BUY уже размещён, ждём исполнения", level=DEBUG)
             return
 
         # Проверяем лимит веток для пары
-        active_branches = len([b for b in self.branches[symbol].values() if b.active])
+        active_branches = self.aggs[symbol].count
         if MAX_BRANCHES_PER_PAIR > 0 and active_branches >= MAX_BRANCHES_PER_PAIR:
-            self.log(symbol, f"🚫 Достигнут лимит веток: {active_branches}/{MAX_BRANCHES_PER_PAIR}")
+            self.log(symbol, f"🚫 Достигнут лимит веток: {active_branches}/{MAX_BRANCHES_PER_PAIR}", key="branch_limit")
             return
 
+        triggered_at = self.clock.monotonic()
         bid, _ = await self.best_bid_ask(symbol)
-        price = rprice(symbol, bid)
-        size = rsize(symbol, Decimal(str(BUY_QTY[symbol])))
-        cid = f"{symbol}:RISE:{uuid.uuid4().hex[:8]}"
-        pos_before, _ = await self.position(symbol)
+        price = self.specs[symbol].rprice(bid)
+        size = self.specs[symbol].rsize(self.specs[symbol].buy_qty)
+        cid = client_ids.rise_id(symbol)
+        snap = await self.account_snapshot(symbol, snap)
+        pos_before = snap.size
         oid = await self.place_limit(symbol, OrderSide.BUY, price, size, cid, ttl_seconds=BUY_TTL_SECONDS)
         if oid:
+            snap.invalidate()
+            self.tracer.start("buy", symbol, cid, t=triggered_at)
+            self.tracer.mark(cid, "buy_ack")
             self.pending_buys[symbol][oid] = {
                 "price": price,
                 "size": size,
                 "client_id": cid,
-                "ts": asyncio.get_event_loop().time(),
+                "ts": self.clock.monotonic(),
                 "kind": "BUY",
                 "pos_before": pos_before,
+                "trace": cid,  # трасса ведётся по client id первого BUY и переживает переразмещения
             }
             # Сразу сдвигаем якорь на текущую цену, чтобы ждать нового минимума
             self.rise_anchor[symbol] = last
             self.log(symbol, f"🟢 BUY размещён {size}@{price}; anchor→{last}")
 
-    async def enforce_buy_ttls(self, symbol: str):
+    async def enforce_buy_ttls(self, symbol: str, snap: Optional[AccountSnapshot] = None):
         if not self.pending_buys[symbol]:
             return
-        opens = await self.open_orders(symbol, side=OrderSide.BUY)
-        open_map = {int(getattr(o, "id")): o for o in opens}
-        now = asyncio.get_event_loop().time()
+        if not self.fill_polling[symbol]:
+            # Исполнения и отмены приходят из потока: здесь только отменяем BUY по TTL,
+            # итог (ветка на исполненное + переразмещение остатка) подводит on_order_event
+            now = self.clock.monotonic()
+            for oid, meta in list(self.pending_buys[symbol].items()):
+                if meta.get("cancelling") or now - meta["ts"] < BUY_TTL_SECONDS:
+                    continue
+                try:
+                    await self.cancel_order(int(oid), symbol)
+                    meta["cancelling"] = True
+                    if snap is not None:
+                        snap.forget(int(oid))
+                    self.log(symbol, f"🟡 Отменяем BUY (TTL {BUY_TTL_SECONDS}s) {meta['size']}@{meta['price']}")
+                except Exception as e:
+                    self.log(symbol, f"❌ Ошибка отмены BUY {oid}: {e}", level=ERROR)
+            return
+        snap = await self.account_snapshot(symbol, snap)
+        open_map = snap.buys_by_id()
+        now = self.clock.monotonic()
         to_delete = []
 
         for oid, meta in list(self.pending_buys[symbol].items()):
@@ -400,27 +784,32 @@ class Bot:
             ttl_seconds = BUY_TTL_SECONDS
 
             if o is None:
-                # Ордер исчез - проверяем, что произошло
-                pos_after, _ = await self.position(symbol)
+                # Ордер исчез - проверяем, что произошло (позиция из снимка тика)
+                pos_after = snap.size
                 pos_before = Decimal(str(meta.get("pos_before", "0")))
-                delta = pos_after - pos_before
+                spec = self.specs[symbol]
+                delta_lots = spec.to_lots(pos_after) - spec.to_lots(pos_before)
+                delta = spec.from_lots(delta_lots)
                 
-                if delta >= meta["size"]:
+                if delta_lots >= spec.to_lots(meta["size"]):
                     # Полное исполнение: создаем ветку
-                    await self.on_buy_filled(symbol, price=meta["price"], size=meta["size"])
+                    self.tracer.mark(meta.get("trace"), "fill_detected")
+                    await self.on_buy_filled(symbol, price=meta["price"], size=meta["size"], trace=meta.get("trace"))
                     self.log(symbol, f"✅ BUY полностью исполнен: +{meta['size']}")
-                elif delta > 0:
+                elif delta_lots > 0:
                     # Частичное исполнение: НЕ создаем ветку, только переразмещаем остаток
                     self.log(symbol, f"⚡ BUY частично исполнен: +{delta} из {meta['size']}, ждем полного исполнения")
-                    remaining = rsize(symbol, meta["size"] - delta)
+                    remaining = self.specs[symbol].rsize(meta["size"] - delta)
                     bid, _ = await self.best_bid_ask(symbol)
-                    new_price = rprice(symbol, bid)
-                    new_cid = ":".join(meta["client_id"].split(":")[:-1] + [uuid.uuid4().hex[:8]])
+                    new_price = self.specs[symbol].rprice(bid)
+                    new_cid = client_ids.renew(meta["client_id"])
                     try:
                         new_oid = await self.place_limit(symbol, OrderSide.BUY, new_price, remaining, new_cid, ttl_seconds=ttl_seconds)
                     except Exception:
                         new_oid = None
                     if new_oid:
+                        snap.invalidate()
+                        self.tracer.mark(meta.get("trace"), "buy_repost")
                         self.pending_buys[symbol][new_oid] = {
                             "price": new_price,
                             "size": remaining,
@@ -428,18 +817,21 @@ class Bot:
                             "ts": now,
                             "kind": "BUY",
                             "pos_before": pos_after,  # Продолжаем отслеживать с текущей позиции
+                            "trace": meta.get("trace"),
                         }
                         self.log(symbol, f"🔁 Переразмещаем BUY остаток {remaining}@{new_price}")
                 else:
                     # Ордер пропал без исполнения - переразмещаем полный размер
                     bid, _ = await self.best_bid_ask(symbol)
-                    new_price = rprice(symbol, bid)
-                    new_cid = ":".join(meta["client_id"].split(":")[:-1] + [uuid.uuid4().hex[:8]])
+                    new_price = self.specs[symbol].rprice(bid)
+                    new_cid = client_ids.renew(meta["client_id"])
                     try:
-                        new_oid = await self.place_limit(symbol, OrderSide.BUY, new_price, rsize(symbol, meta["size"]), new_cid, ttl_seconds=ttl_seconds)
+                        new_oid = await self.place_limit(symbol, OrderSide.BUY, new_price, self.specs[symbol].rsize(meta["size"]), new_cid, ttl_seconds=ttl_seconds)
                     except Exception:
                         new_oid = None
                     if new_oid:
+                        snap.invalidate()
+                        self.tracer.mark(meta.get("trace"), "buy_repost")
                         self.pending_buys[symbol][new_oid] = {
                             "price": new_price,
                             "size": meta["size"],
@@ -447,6 +839,7 @@ class Bot:
                             "ts": now,
                             "kind": "BUY",
                             "pos_before": pos_after,
+                            "trace": meta.get("trace"),
                         }
                         self.log(symbol, f"🔁 Переразместили BUY {meta['size']}@{new_price}")
                 to_delete.append(oid)
@@ -456,37 +849,44 @@ class Bot:
             qty = Decimal(str(getattr(o, "qty", 0) or 0))
             if qty > 0 and filled >= qty:
                 # Полное исполнение: создаем ветку
-                await self.on_buy_filled(symbol, price=meta["price"], size=meta["size"])
+                self.tracer.mark(meta.get("trace"), "fill_detected")
+                await self.on_buy_filled(symbol, price=meta["price"], size=meta["size"], trace=meta.get("trace"))
                 to_delete.append(oid)
             elif age >= ttl_seconds:
                 # TTL истек - отменяем и проверяем частичное исполнение
                 try:
-                    await self.cancel_order(int(oid))
+                    await self.cancel_order(int(oid), symbol)
                     self.log(symbol, f"🟡 Отменяем BUY (TTL {ttl_seconds}s) {meta['size']}@{meta['price']}")
                 except Exception as e:
-                    self.log(symbol, f"❌ Ошибка отмены BUY {oid}: {e}")
+                    self.log(symbol, f"❌ Ошибка отмены BUY {oid}: {e}", level=ERROR)
 
-                # Проверяем, была ли частичная покупка
-                current_pos, _ = await self.position(symbol)
+                # Проверяем, была ли частичная покупка: после отмены перечитываем снимок
+                snap.invalidate()
+                snap = await self.account_snapshot(symbol, snap)
+                current_pos = snap.size
                 pos_before = Decimal(str(meta.get("pos_before", "0")))
-                delta = current_pos - pos_before
+                spec = self.specs[symbol]
+                delta_lots = spec.to_lots(current_pos) - spec.to_lots(pos_before)
+                delta = spec.from_lots(delta_lots)
                 
-                if delta > 0:
-                    # Была частичная покупка - создаем ветку на реально купленное
-                    await self.on_buy_filled(symbol, price=meta["price"], size=delta)
+                if delta_lots > 0:
+                    # Была частичная покупка - создаем ветку на реально купленное (трасса BUY продолжается веткой)
+                    self.tracer.mark(meta.get("trace"), "fill_detected")
+                    await self.on_buy_filled(symbol, price=meta["price"], size=delta, trace=meta.get("trace"))
                     self.log(symbol, f"🆕 Создаем ветку на частично исполненный BUY: +{delta}")
                     
                     # Переразмещаем остаток, если он достаточно большой
                     remaining = meta["size"] - delta
-                    if remaining >= MIN_ORDER_SIZES[symbol]:
+                    if remaining >= self.specs[symbol].min_size:
                         bid, _ = await self.best_bid_ask(symbol)
-                        new_price = rprice(symbol, bid)
-                        new_cid = ":".join(meta["client_id"].split(":")[:-1] + [uuid.uuid4().hex[:8]])
+                        new_price = self.specs[symbol].rprice(bid)
+                        new_cid = client_ids.renew(meta["client_id"])
                         try:
-                            new_oid = await self.place_limit(symbol, OrderSide.BUY, new_price, rsize(symbol, remaining), new_cid, ttl_seconds=ttl_seconds)
+                            new_oid = await self.place_limit(symbol, OrderSide.BUY, new_price, self.specs[symbol].rsize(remaining), new_cid, ttl_seconds=ttl_seconds)
                         except Exception:
                             new_oid = None
                         if new_oid:
+                            snap.invalidate()
                             self.pending_buys[symbol][new_oid] = {
                                 "price": new_price,
                                 "size": remaining,
@@ -499,13 +899,15 @@ class Bot:
                 else:
                     # Не было покупки - переразмещаем полный размер
                     bid, _ = await self.best_bid_ask(symbol)
-                    new_price = rprice(symbol, bid)
-                    new_cid = ":".join(meta["client_id"].split(":")[:-1] + [uuid.uuid4().hex[:8]])
+                    new_price = self.specs[symbol].rprice(bid)
+                    new_cid = client_ids.renew(meta["client_id"])
                     try:
                         new_oid = await self.place_limit(symbol, OrderSide.BUY, new_price, meta["size"], new_cid, ttl_seconds=ttl_seconds)
                     except Exception:
                         new_oid = None
                     if new_oid:
+                        snap.invalidate()
+                        self.tracer.mark(meta.get("trace"), "buy_repost")
                         self.pending_buys[symbol][new_oid] = {
                             "price": new_price,
                             "size": meta["size"],
@@ -513,6 +915,7 @@ class Bot:
                             "ts": now,
                             "kind": "BUY",
                             "pos_before": current_pos,
+                            "trace": meta.get("trace"),
                         }
                         self.log(symbol, f"🔁 Переразмещаем BUY ближе к рынку: {meta['size']}@{new_price}")
                 to_delete.append(oid)
@@ -520,29 +923,30 @@ class Bot:
         for oid in to_delete:
             self.pending_buys[symbol].pop(oid, None)
 
-    async def on_buy_filled(self, symbol: str, price: Decimal, size: Decimal):
+    async def on_buy_filled(self, symbol: str, price: Decimal, size: Decimal, trace: Optional[str] = None):
         b_id = self.new_branch_id(symbol)
-        initial_stop = rprice(symbol, price * (Decimal("1") + Decimal(str(BRANCH_SL_PCT))))
+        spec = self.specs[symbol]
+        initial_stop = spec.rprice(price * spec.sl_mult)
         
         # Определяем количество SELL ордеров в зависимости от размера позиции
-        min_size = MIN_ORDER_SIZES[symbol]
+        min_size = spec.min_size
         legs = {}
         
         if size >= min_size * 3:
             # Достаточно для 3 SELL ордеров
-            for leg_name, tp, split in zip(("L1", "L2", "L3"), SELL_STEPS_PCT[symbol], SELL_SPLIT):
-                legs[leg_name] = SellLeg(leg=leg_name, target_pct=Decimal(str(tp)), size=rsize(symbol, size * Decimal(str(split))))
+            for leg_name, tp, split in zip(("L1", "L2", "L3"), spec.sell_pcts, spec.split):
+                legs[leg_name] = SellLeg(leg=leg_name, target_pct=tp, size=spec.rsize(size * split))
         elif size >= min_size * 2:
             # Достаточно для 2 SELL ордеров
-            for i, (tp, split) in enumerate(zip(SELL_STEPS_PCT[symbol][:2], [0.5, 0.5])):
+            for i, tp in enumerate(spec.sell_pcts[:2]):
                 leg_name = f"L{i+1}"
-                legs[leg_name] = SellLeg(leg=leg_name, target_pct=Decimal(str(tp)), size=rsize(symbol, size * Decimal(str(split))))
+                legs[leg_name] = SellLeg(leg=leg_name, target_pct=tp, size=spec.rsize(size * HALF))
         elif size >= min_size:
             # Достаточно для 1 SELL ордера
-            legs["L1"] = SellLeg(leg="L1", target_pct=Decimal(str(SELL_STEPS_PCT[symbol][0])), size=rsize(symbol, size))
+            legs["L1"] = SellLeg(leg="L1", target_pct=spec.sell_pcts[0], size=spec.rsize(size))
         else:
             # Позиция слишком маленькая - создаем ветку без SELL ордеров
-            self.log(symbol, f"⚠️ Позиция {size} слишком маленькая для SELL ордеров (мин: {min_size})")
+            self.log(symbol, f"⚠️ Позиция {size} слишком маленькая для SELL ордеров (мин: {min_size})", level=WARNING)
 
         self.branches[symbol][b_id] = Branch(
             branch_id=b_id,
@@ -553,28 +957,182 @@ class Bot:
             stop_price=initial_stop,
             active=True,
             sells=legs,
-            created_at=datetime.datetime.now(datetime.timezone.utc),
-            last_updated=datetime.datetime.now(datetime.timezone.utc),
+            created_at=self.clock.now(),
+            last_updated=self.clock.now(),
         )
         
         sell_count = len(legs)
+        self._mark_dirty(symbol, b_id)
+        self.aggs[symbol].add(self.branches[symbol][b_id])
+        self.stops[symbol].add(self.branches[symbol][b_id])
         self.log(symbol, f"🆕 Ветка {b_id}: buy={price}, size={size}, SL={initial_stop}, SELL ордеров: {sell_count}")
         self.log_branch_state(symbol, self.branches[symbol][b_id], note="created")
         self._save_state()
+        self.tracer.mark(trace, "branch_created")
+        if legs:
+            self.tracer.link_branch(trace, symbol, b_id)
+            self._fresh_branches[symbol].add(b_id)
+        else:
+            self.tracer.finish(trace, "no_legs")
+        return self.branches[symbol][b_id]
+
+    # ---------- fill events ----------
+    def _on_account_event(self, ev):
+        """Колбэк потока аккаунта: события обрабатываются строго по порядку одной задачей"""
+        if ev.market not in self._locks:
+            return
+        self._account_events.append(ev)
+        if self._account_task is None or self._account_task.done():
+            self._account_task = asyncio.get_running_loop().create_task(self._process_account_events())
+
+    async def _process_account_events(self):
+        while self._account_events:
+            ev = self._account_events.popleft()
+            try:
+                async with self._locks[ev.market]:
+                    with self.metrics.api.caller("account_events"):
+                        if isinstance(ev, FillEvent):
+                            await self.on_fill_event(ev)
+                        elif isinstance(ev, OrderEvent):
+                            await self.on_order_event(ev)
+            except Exception as e:
+                self.log(ev.market, f"❌ Ошибка обработки события аккаунта: {e}", level=ERROR)
+
+    def _update_fill_polling(self, symbol: str):
+        """Опрос исполнений нужен, пока поток не подключен, и один тик после каждого (пере)подключения"""
+        feed = self.account_feed
+        if not feed or not feed.connected:
+            self.fill_polling[symbol] = True
+        elif feed.generation != self._account_generation[symbol]:
+            # События за время разрыва потеряны - один раз сверяемся опросом
+            self._account_generation[symbol] = feed.generation
+            self.fill_polling[symbol] = True
+        else:
+            self.fill_polling[symbol] = False
+
+    def _find_leg_by_order(self, symbol: str, order_id: int):
+        for b in self.branches[symbol].values():
+            if not b.active:
+                continue
+            for leg in b.sells.values():
+                if leg.order_id == order_id:
+                    return b, leg
+        return None, None
+
+    async def _branch_from_fill(self, symbol: str, price: Decimal, size: Decimal, trace: Optional[str] = None):
+        # Размер ветки известен из события - сразу выставляем её SELL, не дожидаясь проверки раз в 30 сек
+        b = await self.on_buy_filled(symbol, price=price, size=size, trace=trace)
+        self._fresh_branches[symbol].discard(b.branch_id)
+        await self._ensure_branch_sells_for_branch(symbol, b, {}, reconcile=False)
+
+    async def on_fill_event(self, ev: FillEvent):
+        symbol = ev.market
+        if ev.side == OrderSide.BUY.value:
+            meta = self.pending_buys[symbol].get(ev.order_id)
+            if meta is None:
+                return
+            meta["filled"] = meta.get("filled", Decimal("0")) + ev.qty
+            if meta["filled"] >= meta["size"]:
+                self.pending_buys[symbol].pop(ev.order_id, None)
+                self.log(symbol, f"✅ BUY исполнен (поток): +{meta['size']}")
+                self.tracer.mark(meta.get("trace"), "fill_detected")
+                await self._branch_from_fill(symbol, meta["price"], meta["size"], meta.get("trace"))
+            else:
+                self.log(symbol, f"⚡ BUY частично исполнен (поток): +{ev.qty}, всего {meta['filled']} из {meta['size']}")
+            return
+
+        b, leg = self._find_leg_by_order(symbol, ev.order_id)
+        if b is None:
+            return
+        old_size = b.size
+        b.realized_pnl += (ev.price - (b.wap or b.buy_price)) * min(ev.qty, b.size)
+        self._set_branch_size(symbol, b, max(b.size - ev.qty, Decimal("0")))
+        leg.size = max(leg.size - ev.qty, Decimal("0"))
+        if leg.size <= 0:
+            leg.order_id = None
+            leg.client_id = None
+        if b.size <= 0:
+            self.log(symbol, f"✅ Ветка {b.branch_id}: полностью продана (поток, SELL {leg.leg} @{ev.price})")
+            self.deactivate_branch(symbol, b, "sold")
+        else:
+            self.update_branch_timestamp(symbol, b.branch_id)
+            self.log(symbol, f"📉 Ветка {b.branch_id}: размер {old_size} → {b.size} (SELL {leg.leg} {ev.qty}@{ev.price})")
+        self._save_state()
+
+    async def on_order_event(self, ev: OrderEvent):
+        if ev.status not in ("CANCELLED", "EXPIRED", "REJECTED"):
+            return  # исполнения учитываются по сделкам (FillEvent)
+        symbol = ev.market
+        meta = self.pending_buys[symbol].pop(ev.order_id, None)
+        if meta is not None:
+            await self._finalize_buy(symbol, meta)
+            return
+        # SELL снят не нами (истёк/отклонён) - нога будет переразмещена при следующей проверке SELL
+        b, leg = self._find_leg_by_order(symbol, ev.order_id)
+        if b is not None:
+            leg.order_id = None
+            leg.client_id = None
+            leg.price = None
+            self._mark_dirty(symbol, b.branch_id)
+            self.log(symbol, f"⚠️ SELL {leg.leg} ветки {b.branch_id} снят биржей ({ev.status})", level=WARNING)
+            self._save_state()
+
+    async def _finalize_buy(self, symbol: str, meta: dict):
+        """BUY снят (TTL/биржа): ветка на исполненную часть, остаток переразмещаем у bid"""
+        filled = meta.get("filled", Decimal("0"))
+        if filled > 0:
+            self.log(symbol, f"🆕 Создаем ветку на частично исполненный BUY: +{filled}")
+            self.tracer.mark(meta.get("trace"), "fill_detected")
+            await self._branch_from_fill(symbol, meta["price"], self.specs[symbol].rsize(filled), meta.get("trace"))
+        remaining = meta["size"] - filled
+        if remaining < self.specs[symbol].min_size:
+            return
+        bid, _ = await self.best_bid_ask(symbol)
+        new_price = self.specs[symbol].rprice(bid)
+        new_size = self.specs[symbol].rsize(remaining)
+        new_cid = client_ids.renew(meta["client_id"])
+        try:
+            new_oid = await self.place_limit(symbol, OrderSide.BUY, new_price, new_size, new_cid, ttl_seconds=BUY_TTL_SECONDS)
+        except Exception as e:
+            self.log(symbol, f"❌ Ошибка переразмещения BUY: {e}", level=ERROR)
+            return
+        if new_oid:
+            # Если из исполненной части создана ветка, трасса продолжается веткой, а остаток идёт без трассы
+            trace = None if filled > 0 else meta.get("trace")
+            self.tracer.mark(trace, "buy_repost")
+            self.pending_buys[symbol][new_oid] = {
+                "price": new_price,
+                "size": new_size,
+                "client_id": new_cid,
+                "ts": self.clock.monotonic(),
+                "kind": "BUY",
+                "pos_before": meta.get("pos_before", Decimal("0")) + filled,
+                "trace": trace,
+            }
+            self.log(symbol, f"🔁 Переразмещаем BUY {new_size}@{new_price}")
 
     # ---------- sells ----------
-    async def _ensure_branch_sells_for_branch(self, symbol: str, b: Branch, open_by_cid: dict):
-        real_pos_size, _ = await self.position(symbol)
+    async def _reconcile_branch_sells(self, symbol: str, b: Branch, open_by_cid: dict, snap: AccountSnapshot,
+                                      open_by_leg: Optional[dict] = None):
+        """Сверка ветки с биржей перед размещением SELL.
+
+        open_by_leg - индекс client_ids.index_sells по тем же ордерам (snap.sells_by_leg());
+        строится один раз на весь список, без него индекс строится на каждый вызов. Возвращает (можно_размещать, состояние_изменено);
+        состояние сохраняет вызывающий.
+        """
+        real_pos_size = snap.size
         if real_pos_size <= 0:
             self.log(symbol, f"🚫 Нет позиции для SELL ветки {b.branch_id}")
-            return
+            return False, False
 
         # Привязываем уже существующие SELL ордера (например, после рестарта), и дедуплицируем лишние
+        if open_by_leg is None:
+            open_by_leg = client_ids.index_sells(open_by_cid.values())
         state_changed = False
         for leg_name, leg in b.sells.items():
-            leg_prefix = f"{symbol}:BR{b.branch_id}:S:{leg_name}:"
-            # Находим все открытые ордера для этой ноги по префиксу external_id
-            matching_cids = [cid for cid in open_by_cid.keys() if isinstance(cid, str) and cid.startswith(leg_prefix)]
+            # Все открытые ордера этой ноги (по разобранному external_id)
+            matching = open_by_leg.get((symbol, b.branch_id, leg_name), [])
+            matching_cids = [getattr(o, "external_id") for o in matching]
             if matching_cids:
                 # Если у ноги ещё нет client_id в состоянии – привязываем первый найденный ордер
                 if not leg.client_id:
@@ -593,27 +1151,31 @@ class Bot:
                         o = open_by_cid.get(extra_cid)
                         try:
                             if o is not None:
-                                await self.cancel_order(int(getattr(o, "id")))
+                                await self.cancel_order(int(getattr(o, "id")), symbol)
+                                snap.forget(int(getattr(o, "id")))
                                 self.log(symbol, f"🧹 Дедуп SELL {leg_name} ветки {b.branch_id}: отменяем лишний {getattr(o,'qty',None)}@{getattr(o,'price',None)}")
                         except Exception as e:
-                            self.log(symbol, f"❌ Ошибка дедупликации SELL {leg_name} ветки {b.branch_id}: {e}")
+                            self.log(symbol, f"❌ Ошибка дедупликации SELL {leg_name} ветки {b.branch_id}: {e}", level=ERROR)
         if state_changed:
             self.update_branch_timestamp(symbol, b.branch_id)
-            self._save_state()
 
         # Если суммарный размер активных веток превышает позицию — масштабируем ветки пропорционально
-        total_active = sum(x.size for x in self.branches[symbol].values() if x.active)
+        total_active = self.aggs[symbol].total_size
         if total_active > real_pos_size and total_active > 0:
             scale = (real_pos_size / total_active)
-            new_size = rsize(symbol, b.size * Decimal(str(scale)))
+            new_size = self.specs[symbol].rsize(b.size * scale)
             if new_size != b.size:
-                b.size = new_size
+                self._set_branch_size(symbol, b, new_size)
                 for i, (leg_name, leg) in enumerate(b.sells.items()):
-                    leg.size = rsize(symbol, b.size * Decimal(str(SELL_SPLIT[i])))
+                    leg.size = self.specs[symbol].rsize(b.size * self.specs[symbol].split[i])
                 self.log(symbol, f"🔧 Масштабируем ветку {b.branch_id} до {b.size} (scale={scale:.4f})")
                 self.update_branch_timestamp(symbol, b.branch_id)
                 self.log_branch_state(symbol, b, note="scaled")
+                state_changed = True
+        return True, state_changed
 
+    def _plan_branch_sells(self, symbol: str, b: Branch, open_by_cid: dict) -> list:
+        """Недостающие SELL ноги ветки: список (leg, цена, размер, client_id) без обращений к API"""
         # Сколько уже размещено в SELL для ветки
         placed_total = Decimal("0")
         for leg in b.sells.values():
@@ -621,8 +1183,9 @@ class Bot:
                 placed_total += Decimal(str(getattr(open_by_cid[leg.client_id], "qty", 0) or 0))
 
         branch_wap = b.wap if b.wap else b.buy_price
-        pnl_floor = branch_wap * (Decimal("1") + Decimal(str(PNL_MIN_PCT)))
+        pnl_floor = branch_wap * self.specs[symbol].pnl_floor_mult
 
+        plans = []
         for leg_name, leg in b.sells.items():
             existing_order = open_by_cid.get(leg.client_id) if leg.client_id else None
             if existing_order:
@@ -632,193 +1195,305 @@ class Bot:
             target = b.buy_price * (Decimal("1") + leg.target_pct)
             if target <= branch_wap:
                 # Вместо пропуска, выставляем по цене PnL защиты
-                min_price = rprice(symbol, pnl_floor)
+                min_price = self.specs[symbol].rprice(pnl_floor)
                 self.log(symbol, f"🛡️ PnL защита для {leg_name}: target {target} <= WAP {branch_wap}, выставляем по {min_price}")
             else:
                 # Обычная логика - target выше WAP
-                min_price = rprice(symbol, target)
+                min_price = self.specs[symbol].rprice(target)
             remaining = b.size - placed_total
             if remaining <= 0:
                 continue
             place_size = min(leg.size, remaining)
             if place_size <= 0:
                 continue
-            cid = f"{symbol}:BR{b.branch_id}:S:{leg_name}:{uuid.uuid4().hex[:6]}"
-            oid = await self.place_limit(symbol, OrderSide.SELL, min_price, rsize(symbol, place_size), cid, ttl_seconds=SELL_TTL_SECONDS)
+            cid = client_ids.sell_id(symbol, b.branch_id, leg_name)
+            plans.append((b, leg, min_price, place_size, cid))
+            placed_total += place_size
+        return plans
+
+    async def _place_sell_plans(self, symbol: str, plans: list, snap: AccountSnapshot) -> int:
+        """Размещает SELL ноги параллельно (не более SELL_PLACE_CONCURRENCY запросов одновременно)"""
+        if not plans:
+            return 0
+        sem = asyncio.Semaphore(SELL_PLACE_CONCURRENCY)
+
+        async def place(plan):
+            _, _, price, size, cid = plan
+            async with sem:
+                return await self.place_limit(symbol, OrderSide.SELL, price, self.specs[symbol].rsize(size), cid, ttl_seconds=SELL_TTL_SECONDS)
+
+        results = await asyncio.gather(*(place(p) for p in plans), return_exceptions=True)
+        snap.invalidate()
+        placed = 0
+        for (b, leg, price, size, cid), oid in zip(plans, results):
+            if isinstance(oid, Exception):
+                self.log(symbol, f"❌ Ошибка размещения SELL {leg.leg} ветки {b.branch_id}: {oid}", level=ERROR)
+                continue
             if oid:
                 leg.client_id = cid
                 leg.order_id = oid
-                leg.price = min_price
-                placed_total += place_size
-                self.log(symbol, f"🟠 SELL {leg_name} ветки {b.branch_id} {place_size}@{min_price}")
+                leg.price = price
+                placed += 1
+                self.log(symbol, f"🟠 SELL {leg.leg} ветки {b.branch_id} {size}@{price}")
                 self.update_branch_timestamp(symbol, b.branch_id)
-                # Сохраняем client_id, чтобы не потерять связь после рестартов
-                self._save_state()
+        if self.tracer.by_branch:
+            # Трасса BUY завершается, когда у её ветки выставлены все ноги SELL
+            for b in {p[0].branch_id: p[0] for p in plans}.values():
+                key = self.tracer.branch_key(symbol, b.branch_id)
+                if key and all(leg.order_id for leg in b.sells.values()):
+                    self.tracer.finish(key, "legs_live")
+        return placed
+
+    async def _ensure_branch_sells_for_branch(self, symbol: str, b: Branch, open_by_cid: dict,
+                                              snap: Optional[AccountSnapshot] = None, reconcile: bool = True,
+                                              open_by_leg: Optional[dict] = None):
+        """Размещает недостающие SELL ноги одной ветки.
+
+        reconcile=False - для только что созданной по событию исполнения ветки: её размер
+        известен точно, поэтому сверка с позицией (которая по REST может запаздывать) пропускается.
+        open_by_leg - индекс по тем же ордерам, что open_by_cid (snap.sells_by_leg()); вызывающий
+        строит его один раз, а не на каждую ветку.
+        """
+        if snap is None:
+            snap = await self.account_snapshot(symbol) if reconcile else AccountSnapshot(symbol=symbol)
+        changed = False
+        if reconcile:
+            ok, changed = await self._reconcile_branch_sells(symbol, b, open_by_cid, snap, open_by_leg)
+            if not ok:
+                return
+        placed = await self._place_sell_plans(symbol, self._plan_branch_sells(symbol, b, open_by_cid), snap)
+        if changed or placed:
+            # Сохраняем client_id, чтобы не потерять связь после рестартов
+            self._save_state()
 
-    async def ensure_branch_sells(self, symbol: str):
-        real_pos_size, _ = await self.position(symbol)
-        if real_pos_size <= 0:
-            self.log(symbol, f"🚫 Нет позиции для размещения SELL")
+    async def ensure_branch_sells(self, symbol: str, snap: Optional[AccountSnapshot] = None,
+                                  branch_ids: Optional[set] = None):
+        """Сверяет активные ветки (branch_ids - только эти), затем выставляет все недостающие ноги
+        одной пачкой и пишет состояние один раз"""
+        snap = await self.account_snapshot(symbol, snap)
+        if snap.size <= 0:
+            self.log(symbol, f"🚫 Нет позиции для размещения SELL", key="no_position")
             return
-        opens = await self.open_orders(symbol, side=OrderSide.SELL)
-        open_by_cid = {getattr(o, "external_id", ""): o for o in opens}
-        for b in self.branches[symbol].values():
-            if b.active:
-                await self._ensure_branch_sells_for_branch(symbol, b, open_by_cid)
+        # Список ордеров берём один раз: размещения лишь помечают снимок устаревшим
+        open_by_cid = snap.sells_by_cid()
+        open_by_leg = snap.sells_by_leg()
+        changed = False
+        plans = []
+        branches = self.branches[symbol]
+        targets = branches.values() if branch_ids is None else [branches[i] for i in branch_ids if i in branches]
+        for b in list(targets):
+            if not b.active:
+                continue
+            ok, branch_changed = await self._reconcile_branch_sells(symbol, b, open_by_cid, snap, open_by_leg)
+            changed = changed or branch_changed
+            if ok:
+                plans.extend(self._plan_branch_sells(symbol, b, open_by_cid))
+        placed = await self._place_sell_plans(symbol, plans, snap)
+        if changed or placed:
+            self._save_state()
 
     # ---------- stop-loss ----------
-    async def _cancel_branch_sells(self, symbol: str, branch_id: int):
-        opens = await self.open_orders(symbol, side=OrderSide.SELL)
-        cancelled = 0
-        for o in opens:
-            client_id = str(getattr(o, "external_id", "") or "")
-            if f":BR{branch_id}:S:" in client_id:
-                try:
-                    await self.cancel_order(int(getattr(o, "id")))
-                    cancelled += 1
-                except Exception as e:
-                    self.log(symbol, f"❌ Ошибка отмены SELL ветки {branch_id}: {e}")
+    async def _cancel_sells(self, symbol: str, branch_ids: Optional[set] = None,
+                            snap: Optional[AccountSnapshot] = None) -> int:
+        """Отменяет SELL ордера веток branch_ids (None - всех веток символа) по одному списку ордеров"""
+        snap = await self.account_snapshot(symbol, snap)
+        targets = []
+        for o in snap.sells:
+            parsed = client_ids.decode(getattr(o, "external_id", None))
+            if parsed is None or parsed.kind != client_ids.SELL:
+                continue
+            if branch_ids is None or parsed.branch_id in branch_ids:
+                targets.append(int(getattr(o, "id")))
+        cancelled = await self.cancel_orders(symbol, targets)
+        for oid in cancelled:
+            snap.forget(oid)
         if cancelled:
-            self.log(symbol, f"🧹 Отменено {cancelled} SELL для ветки {branch_id}")
-
-    async def _market_close_branch(self, symbol: str, b: Branch):
-        pre_pos, _ = await self.position(symbol)
-        rem = rsize(symbol, min(b.size, pre_pos))
+            scope = ",".join(str(x) for x in sorted(branch_ids)) if branch_ids is not None else "все"
+            self.log(symbol, f"🧹 Отменено {len(cancelled)} SELL для веток [{scope}]")
+        return len(cancelled)
+
+    async def _cancel_branch_sells(self, symbol: str, branch_id: int, snap: Optional[AccountSnapshot] = None):
+        await self._cancel_sells(symbol, {branch_id}, snap)
+
+    async def _market_close_branch(self, symbol: str, b: Branch, snap: Optional[AccountSnapshot] = None,
+                                   triggered_at: Optional[float] = None):
+        snap = await self.account_snapshot(symbol, snap)
+        pre_pos = snap.size
+        rem = self.specs[symbol].rsize(min(b.size, pre_pos))
         if rem <= 0:
-            await self._cancel_branch_sells(symbol, b.branch_id)
-            b.active = False
-            self.update_branch_timestamp(symbol, b.branch_id)
+            await self._cancel_branch_sells(symbol, b.branch_id, snap)
             self.log_branch_state(symbol, b, note="deactivated-no-pos")
+            self.deactivate_branch(symbol, b, "sl-no-pos")
+            self._save_state()
             return
 
-        cid = f"{symbol}:BR{b.branch_id}:SL:{uuid.uuid4().hex[:6]}"
+        cid = client_ids.stop_loss_id(symbol, b.branch_id)
+        self.tracer.start("sl", symbol, cid, t=triggered_at).branch_id = b.branch_id
         try:
-            await self.place_market_sell_ioc(symbol, rem, cid)
+            exit_price = await self.last_price(symbol)
+            await self.place_market_sell_ioc(symbol, rem, cid, price=exit_price)
+            self.tracer.mark(cid, "ioc_ack")
             self.log(symbol, f"🛑 SL ветки {b.branch_id}: market IOC {rem}")
         except Exception as e:
-            self.log(symbol, f"❌ Ошибка SL market ветки {b.branch_id}: {e}")
+            self.tracer.finish(cid, "ioc_error")
+            self.log(symbol, f"❌ Ошибка SL market ветки {b.branch_id}: {e}", level=ERROR)
             return
+        finally:
+            snap.invalidate()
 
         # Проверяем позицию спустя короткое ожидание
-        await asyncio.sleep(1.0)
-        cur_pos, _ = await self.position(symbol)
+        await self.clock.sleep(1.0)
+        snap = await self.account_snapshot(symbol, snap)
+        cur_pos = snap.size
+        # Оценка результата SL: исполненный объём по дельте позиции, цена - лимит IOC
+        sold = min(rem, max(pre_pos - cur_pos, Decimal("0")))
+        b.realized_pnl += (exit_price - (b.wap or b.buy_price)) * sold
+        # Исполнение IOC видно по позиции после ожидания - стадия включает эту секунду
+        self.tracer.finish(cid, "ioc_filled" if sold > 0 else "ioc_unfilled", size=str(rem), sold=str(sold))
         if cur_pos <= Decimal("0"):
-            await self._cancel_branch_sells(symbol, b.branch_id)
-            b.active = False
-            self.update_branch_timestamp(symbol, b.branch_id)
+            await self._cancel_branch_sells(symbol, b.branch_id, snap)
             self.log_branch_state(symbol, b, note="deactivated-after-sl")
+            self.deactivate_branch(symbol, b, "sl")
         else:
             # Деактивируем ветку и отменяем её SELL, остаток позиции оставляем другим веткам
-            await self._cancel_branch_sells(symbol, b.branch_id)
-            b.active = False
-            self.update_branch_timestamp(symbol, b.branch_id)
+            await self._cancel_branch_sells(symbol, b.branch_id, snap)
             self.log_branch_state(symbol, b, note="deactivated-force")
+            self.deactivate_branch(symbol, b, "sl-force")
+        self._save_state()
 
-    async def check_sell_ttls(self, symbol: str):
+    async def check_sell_ttls(self, symbol: str, snap: Optional[AccountSnapshot] = None):
         """Проверяет TTL селл ордеров и переразмещает их если нужно"""
         if not self.has_active(symbol):
             return
             
-        opens = await self.open_orders(symbol, side=OrderSide.SELL)
-        current_time = asyncio.get_event_loop().time()
+        snap = await self.account_snapshot(symbol, snap)
+        current_time = self.clock.monotonic()
         
-        for o in opens:
-            client_id = str(getattr(o, "external_id", "") or "")
-            if ":BR" in client_id and ":S:" in client_id:
-                # Извлекаем branch_id и leg_name из client_id
-                parts = client_id.split(":")
-                if len(parts) >= 4:
-                    branch_id = int(parts[1][2:])  # BR{branch_id}
-                    leg_name = parts[3]  # L1, L2, L3
-                    
-                    if branch_id in self.branches[symbol] and self.branches[symbol][branch_id].active:
-                        branch = self.branches[symbol][branch_id]
-                        if leg_name in branch.sells:
-                            leg = branch.sells[leg_name]
-                            
-                            # Проверяем TTL
-                            if hasattr(o, 'created_at') and o.created_at:
-                                order_age = current_time - o.created_at.timestamp()
-                                if order_age > SELL_TTL_SECONDS:
-                                    self.log(symbol, f"⏰ TTL истек для SELL {leg_name} ветки {branch_id}, переразмещаем")
-                                    
-                                    # Отменяем старый ордер
-                                    try:
-                                        await self.cancel_order(int(getattr(o, "id")))
-                                        leg.client_id = None
-                                        leg.order_id = None
-                                        leg.price = None
-                                    except Exception as e:
-                                        self.log(symbol, f"❌ Ошибка отмены TTL SELL: {e}")
-                                        continue
-                                    
-                                    # Переразмещаем с новым TTL
-                                    await self._ensure_branch_sells_for_branch(symbol, branch, {})
-                                    break  # Обрабатываем по одному за раз
-
-    async def check_branch_sl(self, symbol: str, last: Decimal):
+        for o in list(snap.sells):
+            parsed = client_ids.decode(getattr(o, "external_id", None))
+            if parsed is not None and parsed.kind == client_ids.SELL:
+                branch_id = parsed.branch_id
+                leg_name = parsed.leg  # L1, L2, L3
+                
+                if branch_id in self.branches[symbol] and self.branches[symbol][branch_id].active:
+                    branch = self.branches[symbol][branch_id]
+                    if leg_name in branch.sells:
+                        leg = branch.sells[leg_name]
+                        
+                        # Проверяем TTL
+                        if hasattr(o, 'created_at') and o.created_at:
+                            order_age = current_time - o.created_at.timestamp()
+                            if order_age > SELL_TTL_SECONDS:
+                                self.log(symbol, f"⏰ TTL истек для SELL {leg_name} ветки {branch_id}, переразмещаем")
+                                
+                                # Отменяем старый ордер
+                                try:
+                                    await self.cancel_order(int(getattr(o, "id")), symbol)
+                                    snap.forget(int(getattr(o, "id")))
+                                    leg.client_id = None
+                                    leg.order_id = None
+                                    leg.price = None
+                                    self._mark_dirty(symbol, branch_id)
+                                except Exception as e:
+                                    self.log(symbol, f"❌ Ошибка отмены TTL SELL: {e}", level=ERROR)
+                                    continue
+                                
+                                # Переразмещаем с новым TTL
+                                await self._ensure_branch_sells_for_branch(symbol, branch, {}, snap, open_by_leg={})
+                                break  # Обрабатываем по одному за раз
+
+    async def check_branch_sl(self, symbol: str, last: Decimal, snap: Optional[AccountSnapshot] = None):
         if not self.has_active(symbol):
             return
-        to_close = []
-        for b in self.branches[symbol].values():
-            if b.active and last <= b.stop_price:
-                to_close.append(b)
-        if not to_close:
+        stops = self.stops[symbol]
+        highest = stops.highest()
+        if highest is None or last > highest:
             return
+        branches = self.branches[symbol]
+        triggered_at = self.clock.monotonic()
+        to_close = [branches[branch_id] for branch_id in stops.triggered(last) if branch_id in branches]
         ids = ",".join(str(x.branch_id) for x in to_close)
-        self.log(symbol, f"🚨 SL: сработал у {len(to_close)} веток [{ids}]")
-        for b in to_close:
-            await self._market_close_branch(symbol, b)
+        self.log(symbol, f"🚨 SL: сработал у {len(to_close)} веток [{ids}]", level=WARNING)
+        # Все запросы закрытия (снимок, IOC, отмена SELL) идут вне очереди лимитера
+        with self.limiter.priority(Priority.STOP_LOSS):
+            for b in to_close:
+                await self._market_close_branch(symbol, b, snap, triggered_at)
 
     # ---------- main loop ----------
-    async def run_once(self, symbol: str):
-        last = await self.last_price(symbol)
-        size, wap = await self.position(symbol)
-        active_cnt = sum(1 for b in self.branches[symbol].values() if b.active)
+    async def run_once(self, symbol: str, snap: Optional[AccountSnapshot] = None):
+        phase = self.metrics.phase
+        with phase(symbol, "last_price"):
+            last = await self.last_price(symbol)
+        # Один снимок аккаунта на весь тик: фазы ниже не ходят в API за позицией и ордерами
+        with phase(symbol, "position"):
+            snap = await self.account_snapshot(symbol, snap)
+        size, wap = snap.size, snap.wap
+        self._update_fill_polling(symbol)
+        active_cnt = self.aggs[symbol].count
         limit_info = f"/{MAX_BRANCHES_PER_PAIR}" if MAX_BRANCHES_PER_PAIR > 0 else ""
-        self.log(symbol, f"📈 last={last} | pos={size} WAP={wap} | branches={active_cnt}{limit_info}")
+        self.log(symbol, f"📈 last={last} | pos={size} WAP={wap} | branches={active_cnt}{limit_info}", key="status")
 
         # ИСПРАВЛЕНИЕ 5: При отсутствии позиции деактивируем ветки и сбрасываем их размер
         if size <= 0:
-            for b in list(self.branches[symbol].values()):
-                if b.active:
-                    await self._cancel_branch_sells(symbol, b.branch_id)
-                    b.active = False
-                    b.size = Decimal("0")  # ИСПРАВЛЕНИЕ 5: Сбрасываем размер ветки
-                    self.update_branch_timestamp(symbol, b.branch_id)
-                    self.log(symbol, f"🔄 Ветка {b.branch_id}: деактивирована и сброшена (нет позиции)")
+            stale = [b for b in self.branches[symbol].values() if b.active]
+            if stale:
+                # Все SELL этих веток снимаем одной пачкой по одному списку ордеров
+                with phase(symbol, "deactivate_no_pos"):
+                    await self._cancel_sells(symbol, {b.branch_id for b in stale}, snap)
+            for b in stale:
+                self._set_branch_size(symbol, b, Decimal("0"))  # ИСПРАВЛЕНИЕ 5: Сбрасываем размер ветки
+                self.deactivate_branch(symbol, b, "no-pos")
+                self.log(symbol, f"🔄 Ветка {b.branch_id}: деактивирована и сброшена (нет позиции)")
+            if stale:
+                self._save_state()
 
         # Покупка на росте
-        await self.maybe_buy_on_rise(symbol, last)
+        with phase(symbol, "maybe_buy_on_rise"):
+            await self.maybe_buy_on_rise(symbol, last, snap)
 
         # ИСПРАВЛЕНИЕ 2: Отслеживание исполнений селл ордеров
-        await self.track_sell_executions(symbol)
+        with phase(symbol, "track_sell_executions"):
+            await self.track_sell_executions(symbol, snap)
         
         # ИСПРАВЛЕНИЕ 2: Проверка расхождений
-        await self.log_position_mismatch(symbol)
+        with phase(symbol, "log_position_mismatch"):
+            await self.log_position_mismatch(symbol, snap)
 
         # Размещение SELL не чаще, чем раз в 30 сек
         if not hasattr(self, "_last_sell_check"):
             self._last_sell_check = {}
         if symbol not in self._last_sell_check:
             self._last_sell_check[symbol] = 0
-        now = asyncio.get_event_loop().time()
-        if now - self._last_sell_check[symbol] >= 30:
-            await self.ensure_branch_sells(symbol)
+        now = self.clock.monotonic()
+        if now - self._last_sell_check[symbol] >= SELL_CHECK_SECONDS:
+            with phase(symbol, "ensure_branch_sells"):
+                await self.ensure_branch_sells(symbol, snap)
             self._last_sell_check[symbol] = now
-            self.log(symbol, f"⏰ Проверка SELL ордеров (интервал: 30 сек)")
+            self.log(symbol, f"⏰ Проверка SELL ордеров (интервал: 30 сек)", level=DEBUG)
         else:
-            remain = 30 - (now - self._last_sell_check[symbol])
-            self.log(symbol, f"⏳ Пропускаем проверку SELL (осталось {remain:.1f} сек)")
+            remain = SELL_CHECK_SECONDS - (now - self._last_sell_check[symbol])
+            self.log(symbol, f"⏳ Пропускаем проверку SELL (осталось {remain:.1f} сек)", level=DEBUG)
 
         # SL проверка
-        await self.check_branch_sl(symbol, last)
+        with phase(symbol, "check_branch_sl"):
+            await self.check_branch_sl(symbol, last, snap)
 
         # TTL SELL проверка
-        await self.check_sell_ttls(symbol)
+        with phase(symbol, "check_sell_ttls"):
+            await self.check_sell_ttls(symbol, snap)
 
         # TTL BUY
-        await self.enforce_buy_ttls(symbol)
+        with phase(symbol, "enforce_buy_ttls"):
+            await self.enforce_buy_ttls(symbol, snap)
+
+        # Ветки, созданные исполнением BUY в этом тике: SELL выставляем сразу, не дожидаясь проверки раз в 30 сек
+        fresh = self._fresh_branches[symbol]
+        if fresh:
+            self._fresh_branches[symbol] = set()
+            with phase(symbol, "fresh_branch_sells"):
+                await self.ensure_branch_sells(symbol, snap, branch_ids=fresh)
+        self.metrics.open_orders.set((symbol, "buy"), len(snap.buys))
+        self.metrics.open_orders.set((symbol, "sell"), len(snap.sells))
 
         # Логируем статистику веток каждые 10 минут
         if not hasattr(self, "_last_stats_log"):
@@ -832,16 +1507,154 @@ class Bot:
             self.log(symbol, f"📊 Статистика веток: {stats['active_count']} активных{limit_info}, общий размер: {stats['total_size']}, средняя цена: {stats['avg_price']:.6f}")
             self._last_stats_log[symbol] = now
 
-    async def run(self):
+        if BRANCH_AGG_VERIFY:
+            self._verify_aggregates(symbol)
+
+    def tick_is_idle(self, symbol: str, last) -> bool:
+        """True, если run_once при цене last ничего не изменит (только логи).
+
+        Так бывает, когда с прошлого тика на бирже ничего не исполнилось и не истекло
+        (это проверяет вызывающий), нет висячих BUY, проверка SELL ещё не подошла, цена
+        не ниже якоря, не дошла до триггера роста и выше всех стопов. Бэктест пропускает
+        такие тики; при изменении run_once условие нужно поддерживать вместе с ним.
+        """
+        anchor = self.rise_anchor[symbol]
+        if anchor is None or last < anchor or last >= anchor * self.specs[symbol].rise_mult:
+            return False
+        if self.pending_buys[symbol]:
+            return False
+        highest = self.stops[symbol].highest()
+        if highest is not None and last <= highest:
+            return False
+        last_check = getattr(self, "_last_sell_check", {}).get(symbol)
+        return last_check is not None and self.clock.monotonic() - last_check < SELL_CHECK_SECONDS
+
+    # ---------- streaming reaction ----------
+    def _on_ticker(self, t: Ticker):
+        """Колбэк фида: на каждое обновление цены запускаем (одну на символ) проверку SL и роста"""
+        if t.market not in self._locks or t.last is None:
+            return
+        task = self._price_tasks.get(t.market)
+        if task is None or task.done():
+            self._price_tasks[t.market] = asyncio.get_running_loop().create_task(self._react_to_price(t.market))
+
+    async def _react_to_price(self, symbol: str):
+        handled_ts = 0.0
         while True:
+            # Реагируем только на новую цену сделки: обновления стакана last не освежают
+            t = self.feed.get(symbol, MARKET_STREAM_MAX_AGE)
+            if t is None or t.last_ts <= handled_ts:
+                return
+            handled_ts = t.last_ts
             try:
-                await asyncio.gather(*(self.run_once(m) for m in MARKETS))
+                async with self._locks[symbol]:
+                    with self.metrics.api.caller("react_to_price"):
+                        await self.check_branch_sl(symbol, t.last)
+                        await self.maybe_buy_on_rise(symbol, t.last)
             except Exception as e:
-                print("Loop error:", e, flush=True)
-            await asyncio.sleep(TICK_SECONDS)
+                self.log(symbol, f"❌ Ошибка реакции на цену: {e}", level=ERROR)
+
+    async def _run_market(self, symbol: str, snap: AccountSnapshot, epoch: int):
+        async with self._locks[symbol]:
+            # Пока ждали блокировку, реакция на поток цен могла разместить ордера
+            if self.order_epoch[symbol] != epoch:
+                snap.invalidate()
+            await self.run_once(symbol, snap)
+
+    # ---------- scheduler ----------
+    async def _batched_snapshot(self, symbol: str):
+        """Снимок символа из общего пакетного запроса по всем рынкам.
+
+        Пары, пришедшие за снимком в пределах ACCOUNT_BATCH_WINDOW_SECONDS от начала
+        запроса, делят его; каждая пара берёт из одного пакета не более одного снимка.
+        Возвращает (снимок, order_epoch символа на момент запроса).
+        """
+        now = self.clock.monotonic()
+        task = self._batch_task
+        if (task is None or symbol in self._batch_consumed or now - self._batch_started > ACCOUNT_BATCH_WINDOW_SECONDS
+                or (task.done() and task.exception() is not None)):
+            self._batch_epochs = dict(self.order_epoch)
+            self._batch_started = now
+            self._batch_consumed = set()
+            task = self._batch_task = asyncio.get_running_loop().create_task(self.account_snapshots(MARKETS))
+        self._batch_consumed.add(symbol)
+        epoch = self._batch_epochs[symbol]
+        snaps = await asyncio.shield(task)
+        return snaps[symbol], epoch
+
+    async def _market_loop(self, symbol: str):
+        """Собственный цикл пары: свой период, дедлайн и учёт перерасхода"""
+        period = MARKET_TICK_SECONDS.get(symbol, TICK_SECONDS)
+        while True:
+            started = self.clock.monotonic()
+            try:
+                with self.metrics.api.tick(symbol):
+                    with self.metrics.phase(symbol, "account_batch"):
+                        snap, epoch = await self._batched_snapshot(symbol)
+                    await self._run_market(symbol, snap, epoch)
+            except Exception as e:
+                self.metrics.loop_errors.inc((symbol,))
+                self.log(symbol, f"❌ Loop error: {e}", level=ERROR)
+            finished = self.clock.monotonic()
+            self.metrics.tick_seconds.observe((symbol,), finished - started)
+            if API_REPORT_SECONDS and finished - self._api_report_at >= API_REPORT_SECONDS:
+                self._api_report_at = finished
+                for line in self.metrics.api.report():
+                    self.log(None, line)
+            deadline = started + period
+            if finished > deadline:
+                self.tick_overruns[symbol] += 1
+                self.log(symbol, f"⏱️ Перерасход тика: {finished - started:.2f}s при периоде {period}s (всего {self.tick_overruns[symbol]})", level=WARNING)
+                deadline = finished  # пропущенные тики не догоняем
+            await self.clock.sleep(deadline - finished)
+
+    async def run(self):
+        """Запускает цикл каждой пары отдельной задачей и перезапускает упавшие"""
+        tasks = {asyncio.ensure_future(self._market_loop(m)): m for m in MARKETS}
+        while tasks:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                symbol = tasks.pop(task)
+                err = task.exception() if not task.cancelled() else "cancelled"
+                self.log(symbol, f"❌ Цикл пары остановился ({err}), перезапуск", level=ERROR)
+                tasks[asyncio.ensure_future(self._market_loop(symbol))] = symbol
+
+
+async def start_metrics_server(bot: Bot) -> Optional[MetricsServer]:
+    """METRICS_ENABLED: /metrics в формате Prometheus на METRICS_HOST:METRICS_PORT"""
+    if not METRICS_ENABLED:
+        return None
+    server = MetricsServer(bot.metrics, METRICS_HOST, METRICS_PORT)
+    await server.start()
+    bot.log(None, f"📊 Метрики: {server.url}")
+    return server
+
+
+async def run_sim():
+    """EXCHANGE_MODE = "sim": бот против локальной симулированной биржи со сбоями SIM_FAULTS"""
+    clock = SystemClock()
+    exchange = SimExchange(clock, faults=FaultProfile(**SIM_FAULTS))
+    quotes = asyncio.create_task(random_walk_quotes(exchange, MARKETS, SIM_START_PRICES, SIM_VOLATILITY, SIM_QUOTE_SECONDS))
+    await asyncio.sleep(0)  # первые котировки до первого тика
+    bot = Bot(SimTradingClient(exchange), clock=clock, state_file=os.path.splitext(STATE_FILE)[0] + "_sim.json")
+    bot.log(None, f"🧪 EXCHANGE_MODE=sim: симулированная биржа, рынки {', '.join(MARKETS)}, сбои {SIM_FAULTS}")
+    server = await start_metrics_server(bot)
+    try:
+        await bot.run()
+    finally:
+        quotes.cancel()
+        if server:
+            await server.stop()
+        bot.log(None, f"🧪 Вызовы API: {dict(bot.c.calls)} | сбои: {dict(exchange.injected)}")
+        bot.logger.flush()
 
 
 async def main():
+    if EXCHANGE_MODE == "sim":
+        await run_sim()
+        return
+    if EXCHANGE_MODE != "mainnet":
+        raise ValueError(f"неизвестный EXCHANGE_MODE: {EXCHANGE_MODE}")
     account = StarkPerpetualAccount(
         vault=VAULT_ID,
         private_key=STARK_PRIVATE_KEY,
@@ -849,7 +1662,26 @@ async def main():
         api_key=API_KEY,
     )
     client = PerpetualTradingClient(STARKNET_MAINNET_CONFIG, account)
-    bot = Bot(client)
+    logger = bot_logger()
+    account_feed = None
+    if ACCOUNT_STREAM_ENABLED:
+        account_feed = AccountEventFeed(MARKETS, logger=logger)
+        if ACCOUNT_STREAM_URL:
+            account_feed.start(lambda: json_ws_source(ACCOUNT_STREAM_URL, ("connected", "trade", "order")))
+        else:
+            account_feed.start(lambda: x10_account_source(STARKNET_MAINNET_CONFIG.stream_url, API_KEY))
+    feed = None
+    if MARKET_STREAM_ENABLED:
+        feed = MarketDataFeed(MARKETS, logger=logger)
+        if MARKET_STREAM_URL:
+            feed.start(lambda: json_ws_source(MARKET_STREAM_URL))
+        else:
+            feed.start(
+                lambda: x10_orderbook_source(STARKNET_MAINNET_CONFIG.stream_url),
+                lambda: x10_trades_source(STARKNET_MAINNET_CONFIG.stream_url),
+            )
+    bot = Bot(client, feed=feed, account_feed=account_feed, logger=logger)
+    await start_metrics_server(bot)
     await bot.run()
 
 
@@ -0,0 +1,647 @@
+# -*- coding: utf-8 -*-
+"""
+Vectorised fast-path simulator of the buy-on-rise strategy (NumPy)
+
+Первичный отбор параметров по миллионам комбинаций, до проверки лучших полным бэктестом
+(backtest.py). Модель повторяет поведение Bot + SimExchange, но считается массивами:
+
+    - тики - первая строка ряда в каждом окне TICK_SECONDS
+    - вход: на тике last >= якорь * (1 + rise_pct), якорь - минимум last по тикам с прошлого BUY;
+      BUY по bid исполняется, когда ask <= его цены, иначе через BUY_TTL_SECONDS переразмещается
+      по новому bid; ветка появляется на тике, когда бот видит исполнение
+    - выход: ноги SELL выставляются в тике создания ветки (Bot.run_once, fresh_branch_sells) и исполняются,
+      когда bid >= цены ноги; стоп - первый тик после создания, где last <= stop_price;
+      IOC по last исполняется, только если bid >= last, иначе позиция остаётся (как sl-force)
+    - equity = денежный поток по исполнениям + остаток позиции по последней цене - комиссии
+
+Две модели:
+    evaluate          - векторная. Входы зависят только от rise_pct и кэшируются; исполнение ног
+                        и стопы всех веток сразу ищутся по иерархии блочных максимумов (FirstPassage)
+                        и кэшируются по уровню ноги / стопа, так что комбинация - несколько векторных
+                        операций. Распознавание BUY по позиции учтено первым порядком: продажи других
+                        веток в окне BUY уменьшают ветку и добавляют докупку, но входы не сдвигаются
+    evaluate_coupled  - последовательная по BUY: бот распознаёт исполнение BUY по приросту позиции,
+                        и продажи других веток в этом окне принимает за частичное исполнение
+                        (докупает, ветка меньше, остаток позиции без ветки); следующие входы
+                        считаются от фактического времени докупки
+
+Допуск относительно backtest.py (FAST_TOLERANCE, проверяется --validate): equity - в долях
+оборота BUY, т.к. equity около нуля сравнивать в процентах бессмысленно. Образцы - ряды
+backtest.py --synthetic (BTC-USD, seed 1-3 по 6 ч, сетка rise_pct 0.1-0.3% x sl_pct -0.5..-2%;
+сутки и неделя с комиссиями 0.02% / 0.05%): coupled совпадает по числу веток и расходится по
+equity не больше чем на 0.004% оборота, векторная модель - на 0.12% оборота и 4% веток.
+Допуск: векторная 0.2% и 5%, coupled 0.01% и 0. Не моделируются MAX_BRANCHES_PER_PAIR, сдвиг
+фазы тиков после дыр в ряду и довыставление остатка округления ног (раз в SELL_CHECK_SECONDS,
+только у веток нестандартного размера после докупки) - отсюда остаток расхождения coupled.
+
+Пример:
+    python fastsim.py btc_1s.bin --symbol BTC-USD --grid grid.json --top 20 --validate 5
+    python backtest.py sample_1.bin --synthetic 21600 --seed 1
+    python fastsim.py sample_1.bin --grid '{"rise_pct": [0.001, 0.002, 0.003], "sl_pct": [-0.005, -0.01, -0.02]}' --validate 9
+"""
+
+import argparse
+import heapq
+import json
+import os
+import time
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+import config
+from market_specs import MarketSpec, compile_spec
+from sweep import combo_overrides, expand_grid
+
+BLOCK = 256                 # ширина блока в FirstPassage
+QUERY_CHUNK = 4096          # запросов за один проход (память Q x BLOCK)
+# Допуск моделей относительно полного бэктеста: доля числа веток и equity в долях оборота BUY
+FAST_TOLERANCE = {
+    "vectorised": {"branches": 0.05, "equity_of_turnover": 0.002},
+    "coupled": {"branches": 0.0, "equity_of_turnover": 1e-4},
+}
+
+
+class FirstPassage:
+    """Первый индекс i >= start, где values[i] >= threshold, сразу для массива запросов.
+
+    Над значениями строится иерархия максимумов по блокам BLOCK; запрос поднимается по
+    уровням до блока, где максимум дотягивает до порога, и спускается внутри него. Для
+    условия values[i] <= x достаточно передать -values и -x.
+    """
+
+    def __init__(self, values: np.ndarray):
+        self.n = len(values)
+        self.levels = [np.ascontiguousarray(values, dtype=np.float64)]
+        while len(self.levels[-1]) > BLOCK:
+            v = self.levels[-1]
+            pad = (-len(v)) % BLOCK
+            if pad:
+                v = np.concatenate([v, np.full(pad, -np.inf)])
+            self.levels.append(v.reshape(-1, BLOCK).max(axis=1))
+
+    def _scan(self, level: int, pos: np.ndarray, stop: np.ndarray, thr: np.ndarray) -> np.ndarray:
+        """Первый индекс в [pos, stop) уровня со значением >= thr, -1 если нет (stop - pos <= BLOCK)"""
+        arr = self.levels[level]
+        idx = pos[:, None] + np.arange(BLOCK)
+        hit = (idx < stop[:, None]) & (arr[np.minimum(idx, len(arr) - 1)] >= thr[:, None])
+        return np.where(hit.any(axis=1), pos + hit.argmax(axis=1), -1)
+
+    def first_ge(self, starts, thresholds) -> np.ndarray:
+        """Индексы первого достижения порога; self.n - если порог не достигнут до конца ряда"""
+        starts = np.asarray(starts, dtype=np.int64)
+        thresholds = np.asarray(thresholds, dtype=np.float64)
+        out = np.full(len(starts), self.n, dtype=np.int64)
+        for a in range(0, len(starts), QUERY_CHUNK):
+            out[a:a + QUERY_CHUNK] = self._first_ge(starts[a:a + QUERY_CHUNK], thresholds[a:a + QUERY_CHUNK])
+        return out
+
+    def _first_ge(self, starts: np.ndarray, thr: np.ndarray) -> np.ndarray:
+        res = np.full(len(starts), self.n, dtype=np.int64)
+        active = np.flatnonzero(starts < self.n)
+        pos = starts[active]
+        top = len(self.levels) - 1
+        for level in range(top + 1):
+            if not active.size:
+                break
+            size = len(self.levels[level])
+            stop = np.full(len(pos), size) if level == top else np.minimum((pos // BLOCK + 1) * BLOCK, size)
+            first = self._scan(level, pos, stop, thr[active])
+            hit = first >= 0
+            q, sel = first[hit], active[hit]
+            for lv in range(level, 0, -1):
+                start = q * BLOCK
+                q = self._scan(lv - 1, start, np.minimum(start + BLOCK, len(self.levels[lv - 1])), thr[sel])
+            res[sel] = q
+            # Не нашли до конца блока - следующий блок на уровень выше
+            active, pos = active[~hit], pos[~hit] // BLOCK + 1
+            if level < top:
+                keep = pos < len(self.levels[level + 1])
+                active, pos = active[keep], pos[keep]
+        return res
+
+
+@dataclass
+class Entries:
+    tick: np.ndarray        # тик, на котором бот создаёт ветку
+    price: np.ndarray       # цена BUY ветки (цена лимитного ордера)
+    buy_price: np.ndarray   # все исполненные BUY, включая исполненный, но не замеченный к концу ряда
+    buy_taker: np.ndarray   # BUY исполнился сразу при размещении
+    window: np.ndarray      # ключ события, с которого бот считает прирост позиции для BUY ветки (см. _run_buys)
+
+
+@dataclass
+class Exits:
+    """Продажи веток по одной: выручка за вычетом комиссий, продано, исполнено ног, стоп, IOC стопа без исполнения"""
+    cash: np.ndarray
+    sold: np.ndarray
+    legs: np.ndarray
+    stopped: np.ndarray
+    unfilled: np.ndarray
+    keys: np.ndarray        # события продаж (ключи как в _run_buys) и их объёмы - для окон распознавания BUY
+    sizes: np.ndarray
+    instant: np.ndarray     # объём ног, исполненных сразу при выставлении (в тике создания ветки)
+
+    def take(self, idx: np.ndarray, other: "Exits"):
+        """Заменяет ветки idx результатами other (посчитанными для тех же веток в том же порядке)"""
+        for name in ("cash", "sold", "legs", "stopped", "unfilled"):
+            getattr(self, name)[idx] = getattr(other, name)
+
+
+@dataclass
+class FastResult:
+    params: dict
+    equity: float
+    branches: int
+    legs_filled: int
+    stops: int
+    stops_unfilled: int
+    final_position: float
+    turnover: float
+
+
+def _first_hit(arr: np.ndarray, start: int, threshold: float, below: bool = False, stop: Optional[int] = None) -> int:
+    """Первый индекс в [start, stop), где arr >= threshold (arr <= threshold при below); stop - если нет"""
+    stop = len(arr) if stop is None else stop
+    width = 256
+    while start < stop:
+        seg = arr[start:min(start + width, stop)]
+        hit = seg <= threshold if below else seg >= threshold
+        if hit.any():
+            return start + int(hit.argmax())
+        start += len(seg)
+        width = min(width * 4, 1 << 20)
+    return stop
+
+
+class FastSim:
+    def __init__(self, series: np.ndarray, symbol: str, tick_seconds: Optional[float] = None,
+                 buy_ttl: float = config.BUY_TTL_SECONDS, maker_fee: float = 0.0, taker_fee: float = 0.0):
+        rows = np.asarray(series, dtype=np.float64).reshape(-1, 4)
+        self.symbol = symbol
+        self.ts, self.last, self.bid, self.ask = (np.ascontiguousarray(rows[:, c]) for c in range(4))
+        self.n = len(self.ts)
+        self.buy_ttl = buy_ttl
+        self.maker_fee = maker_fee
+        self.taker_fee = taker_fee
+        period = tick_seconds or config.MARKET_TICK_SECONDS.get(symbol, config.TICK_SECONDS)
+        self.tick_rows = self._window_starts(self.ts, period)
+        self.tick_ts = self.ts[self.tick_rows]
+        self.last_t = self.last[self.tick_rows]
+        self.nt = len(self.tick_rows)
+        self._bid_fp = FirstPassage(self.bid)
+        self._neg_last_t_fp = FirstPassage(-self.last_t)
+        self._entries: Dict[float, Entries] = {}
+        self._stops: Dict[Tuple[float, float], tuple] = {}
+        self._legs: Dict[Tuple[float, float, float], tuple] = {}
+
+    @staticmethod
+    def _window_starts(ts: np.ndarray, period: float) -> np.ndarray:
+        if not len(ts):
+            return np.zeros(0, dtype=np.int64)
+        k = np.floor((ts - ts[0]) / period)
+        return np.flatnonzero(np.r_[True, k[1:] != k[:-1]])
+
+    def _tick_at_or_after(self, row: int) -> int:
+        return int(np.searchsorted(self.tick_rows, row, "left"))
+
+    # ---------- BUY ----------
+    def _next_trigger(self, t: int, anchor: float, mult: float) -> int:
+        """Первый тик >= t, где last >= якорь * mult (якорь - минимум last до этого тика); -1 если нет"""
+        last_t, width = self.last_t, 512
+        while t < self.nt:
+            seg = last_t[t:t + width]
+            before = np.minimum.accumulate(np.concatenate(([anchor], seg[:-1])))
+            hit = seg >= before * mult
+            if hit.any():
+                return t + int(hit.argmax())
+            anchor = min(anchor, float(seg.min()))
+            t += width
+            width = min(width * 2, 1 << 20)
+        return -1
+
+    def _run_buys(self, spec: MarketSpec, qty: float, exits=None):
+        """Цепочка BUY бота: срабатывания, переразмещения по TTL и создание веток.
+
+        exits(price, size, tick) -> события продаж ветки [(ключ, размер), ...] включает учёт
+        позиции: бот узнаёт об исполнении BUY по приросту позиции с момента размещения, и
+        продажи других веток в этом окне он принимает за частичное исполнение или его отсутствие
+        (переразмещает остаток / весь размер, ветку создаёт позже и меньше). Ключ события -
+        2 * строка для исполнения по котировке и 2 * строка + 1 для действий бота внутри тика.
+        """
+        mult, prec = float(spec.rise_mult), spec.price_prec
+        eps = float(spec.lot_step) / 2
+        branches, buys, events = [], [], []
+        if not self.nt:
+            return branches, buys
+        anchor, t = float(self.last_t[0]), 1
+        while True:
+            j = self._next_trigger(t, anchor, mult)
+            if j < 0:
+                break
+            row_p, placed_ts, first, size = self.tick_rows[j], self.tick_ts[j], True, qty
+            key_before = 2 * row_p
+            price = round(float(self.bid[row_p]), prec)
+            while True:
+                filled = True
+                if price >= self.ask[row_p]:
+                    # Пересёк рынок: исполнен сразу; первичный BUY бот видит в том же тике
+                    d, taker = (j if first else self._tick_at_or_after(row_p) + 1), True
+                else:
+                    row_exp = int(np.searchsorted(self.ts, placed_ts + self.buy_ttl, "right"))
+                    f = _first_hit(self.ask, row_p + 1, price, below=True, stop=row_exp)
+                    if f < row_exp:
+                        d, taker = self._tick_at_or_after(f), False
+                    else:
+                        d, filled = int(np.searchsorted(self.tick_ts, placed_ts + self.buy_ttl, "left")), False
+                if filled:
+                    buys.append((price, size, taker))
+                if d >= self.nt:
+                    d = -1
+                    break
+                key_after = 2 * self.tick_rows[d] + 1
+                sold = 0.0
+                while events and events[0][0] <= key_after:
+                    key, q = heapq.heappop(events)
+                    if key > key_before:
+                        sold += q
+                got = (size if filled else 0.0) - sold
+                if filled and got >= size - eps:
+                    branches.append((d, price, size, key_before))
+                    if exits is not None:
+                        for ev in exits(price, size, d):
+                            heapq.heappush(events, ev)
+                    break
+                # Исчез без (полного, по позиции) исполнения - переразмещение по текущему bid
+                if got > eps:
+                    size = self._rsize(spec, size - got)
+                row_p, placed_ts, first, key_before = self.tick_rows[d], self.tick_ts[d], False, key_after
+                price = round(float(self.bid[row_p]), prec)
+            if d < 0:
+                break
+            anchor, t = float(self.last_t[j:d + 1].min()), d + 1
+        return branches, buys
+
+    @staticmethod
+    def _rsize(spec: MarketSpec, v: float) -> float:
+        return float(spec.rsize(Decimal(repr(v))))
+
+    def entries(self, spec: MarketSpec) -> Entries:
+        """Входы без учёта позиции: зависят только от rise_pct, размер BUY их не меняет"""
+        mult = float(spec.rise_mult)
+        cached = self._entries.get(mult)
+        if cached is None:
+            branches, buys = self._run_buys(spec, 1.0)
+            cached = self._entries[mult] = Entries(
+                np.array([b[0] for b in branches], dtype=np.int64),
+                np.array([b[1] for b in branches], dtype=np.float64),
+                np.array([b[0] for b in buys], dtype=np.float64),
+                np.array([b[2] for b in buys], dtype=bool),
+                np.array([b[3] for b in branches], dtype=np.int64),
+            )
+        return cached
+
+    # ---------- SELL / SL ----------
+    @staticmethod
+    def _legs_for(spec: MarketSpec, qty: Decimal) -> List[Tuple[Decimal, float]]:
+        """(уровень, размер) ног ветки - раскладка Bot.on_buy_filled, урезанная до размера ветки,
+        как при выставлении (Bot._plan_branch_sells: нога не больше нераспределённого остатка)"""
+        if qty >= spec.min_size * 3:
+            legs = [(p, spec.rsize(qty * s)) for p, s in zip(spec.sell_pcts, spec.split)]
+        elif qty >= spec.min_size * 2:
+            legs = [(p, spec.rsize(qty * Decimal("0.5"))) for p in spec.sell_pcts[:2]]
+        elif qty >= spec.min_size:
+            legs = [(spec.sell_pcts[0], spec.rsize(qty))]
+        else:
+            legs = []
+        out, left = [], qty
+        for p, size in legs:
+            size = min(size, left)
+            if size > 0:
+                out.append((p, float(size)))
+                left -= size
+        return out
+
+    def _leg_sizes(self, spec: MarketSpec, size: np.ndarray) -> np.ndarray:
+        """Размеры ног по уровням spec.sell_pcts (строки) для веток размера size (столбцы); 0 - ноги нет"""
+        if (size == size[0]).all():
+            values, inverse = size[:1], np.zeros(len(size), dtype=np.int64)
+        else:
+            values, inverse = np.unique(size, return_inverse=True)
+        table = np.zeros((len(spec.sell_pcts), len(values)))
+        for i, v in enumerate(values):
+            # Ноги _legs_for - префикс уровней: урезание обнуляет только последние
+            for j, (_, leg_size) in enumerate(self._legs_for(spec, Decimal(repr(float(v))))):
+                table[j, i] = leg_size
+        return table[:, inverse]
+
+    @staticmethod
+    def _scaled(spec: MarketSpec, price, mult: Decimal):
+        """spec.rprice(price * mult) для цен на шаге цены: точно в целых шагах, половина - к чётному (как quantize)"""
+        num, den = mult.as_integer_ratio()
+        x = np.rint(np.asarray(price) * float(spec.price_scale)).astype(np.int64) * num
+        q, r = np.divmod(x, den)
+        q = q + ((2 * r > den) | ((2 * r == den) & (q % 2 == 1)))
+        return q / float(spec.price_scale)
+
+    def _target(self, spec: MarketSpec, price, pct: Decimal):
+        """Цена ноги: buy_price * (1 + pct), не выше buy_price - по PnL защите (Bot._plan_branch_sells)"""
+        return self._scaled(spec, price, Decimal("1") + pct if pct > 0 else spec.pnl_floor_mult)
+
+    def _remainder(self, spec: MarketSpec, rem):
+        """Остаток ветки к стопу (b.size после track_sell_executions), округлённый как rsize"""
+        return np.where(rem > 1e-12, np.maximum(np.round(rem, spec.size_prec), float(spec.min_size)), 0.0)
+
+    def _stop(self, spec: MarketSpec, ent: Entries):
+        """(тик стопа, строка, цена исполнения IOC или nan) для каждой ветки"""
+        key = (float(spec.rise_mult), float(spec.sl_mult))
+        cached = self._stops.get(key)
+        if cached is None:
+            stop = self._scaled(spec, ent.price, spec.sl_mult)
+            k = self._neg_last_t_fp.first_ge(ent.tick + 1, -stop)
+            row_k = np.where(k < self.nt, self.tick_rows[np.minimum(k, self.nt - 1)], self.n)
+            last_k = self.last_t[np.minimum(k, self.nt - 1)]
+            bid_k = self.bid[np.minimum(row_k, self.n - 1)]
+            fill = np.where((k < self.nt) & (bid_k >= last_k), bid_k, np.nan)
+            cached = self._stops[key] = (k, row_k, fill)
+        return cached
+
+    def _placement(self, ent: Entries):
+        """Строка, где бот выставляет SELL ветки: тик её создания (стоп проверяется только со следующего)"""
+        return np.where(ent.tick < self.nt, self.tick_rows[np.minimum(ent.tick, self.nt - 1)], self.n)
+
+    def _leg(self, spec: MarketSpec, ent: Entries, pct: Decimal, row_s: np.ndarray):
+        """(строка исполнения ноги или n, цена, taker) для ноги с уровнем pct"""
+        key = (float(spec.rise_mult), float(pct), float(spec.pnl_floor_mult))
+        cached = self._legs.get(key)
+        if cached is None:
+            target = self._target(spec, ent.price, pct)
+            placed = row_s < self.n
+            bid_s = self.bid[np.minimum(row_s, self.n - 1)]
+            taker = placed & (target <= bid_s)
+            rows = np.full(len(target), self.n, dtype=np.int64)
+            maker = placed & ~taker
+            rows[maker] = self._bid_fp.first_ge(row_s[maker] + 1, target[maker])
+            rows[taker] = row_s[taker]
+            cached = self._legs[key] = (rows, np.where(taker, bid_s, target), taker)
+        return cached
+
+    def _exits(self, spec: MarketSpec, ent: Entries, row_s: np.ndarray, idx: np.ndarray, size: np.ndarray) -> Exits:
+        """Продажи веток idx размеров size: ноги до стопа и IOC стопа на остаток"""
+        k, row_k, sl_fill = (a[idx] for a in self._stop(spec, ent))
+        count = len(idx)
+        cash, sold, seen, instant = np.zeros(count), np.zeros(count), np.zeros(count), np.zeros(count)
+        legs = np.zeros(count, dtype=np.int64)
+        keys, sizes = [], []
+        for pct, leg_size in zip(spec.sell_pcts, self._leg_sizes(spec, size)):
+            if not leg_size.any():
+                continue
+            rows, price, taker = (a[idx] for a in self._leg(spec, ent, pct, row_s))
+            filled = (leg_size > 0) & (rows < self.n) & (rows <= row_k)
+            fee = np.where(taker, self.taker_fee, self.maker_fee)
+            cash += filled * price * leg_size * (1.0 - fee)
+            sold += filled * leg_size
+            seen += (filled & ~(taker & (rows == row_k))) * leg_size
+            instant += (filled & taker) * leg_size
+            legs += filled
+            keys.append(np.where(taker, 2 * rows + 1, 2 * rows)[filled])
+            sizes.append(leg_size[filled])
+
+        rem = self._remainder(spec, size - seen)
+        stopped = (k < self.nt) & (size - sold > 1e-12)
+        ioc = stopped & ~np.isnan(sl_fill)
+        cash += np.where(ioc, sl_fill * rem, 0.0) * (1.0 - self.taker_fee)
+        sold += np.where(ioc, rem, 0.0)
+        keys.append(2 * row_k[ioc] + 1)
+        sizes.append(rem[ioc])
+        return Exits(cash, sold, legs, stopped, stopped & ~ioc, np.concatenate(keys), np.concatenate(sizes), instant)
+
+    def evaluate(self, spec: MarketSpec, params: Optional[dict] = None) -> FastResult:
+        """Векторная оценка комбинации: ветки независимы, распознавание BUY по позиции - первым порядком.
+
+        Продажи всех веток считаются для полного размера; если в окне распознавания BUY ветки
+        (от размещения до тика, где бот видит исполнение) продали другие ветки, ветка получает
+        размер и докупку, как в _run_buys, а её BUY остаётся в позиции без ветки. Сдвиг
+        следующих входов из-за докупки не учитывается (это делает evaluate_coupled).
+        """
+        ent = self.entries(spec)
+        qty = float(spec.rsize(spec.buy_qty))
+        count = len(ent.price)
+        last_end = float(self.last[-1]) if self.n else 0.0
+        buy_fee = np.where(ent.buy_taker, self.taker_fee, self.maker_fee)
+        cash = -float((ent.buy_price * qty * (1.0 + buy_fee)).sum())
+        bought = len(ent.buy_price) * qty
+        turnover = float(ent.buy_price.sum() * qty)
+        if not count:
+            return FastResult(params or {}, cash + bought * last_end, 0, 0, 0, 0, bought, turnover)
+
+        row_s = self._placement(ent)
+        out = self._exits(spec, ent, row_s, np.arange(count), np.full(count, qty))
+        order = np.argsort(out.keys, kind="stable")
+        keys, total = out.keys[order], np.r_[0.0, np.cumsum(out.sizes[order])]
+        row_d = self.tick_rows[ent.tick]
+        # Продажи в окне (ключ размещения BUY, ключ тика распознавания]; свои ноги-taker того же тика - не в счёт
+        window = (total[np.searchsorted(keys, 2 * row_d + 1, "right")]
+                  - total[np.searchsorted(keys, ent.window, "right")]) - out.instant
+        eps = float(spec.lot_step) / 2
+        short = np.flatnonzero(window > eps)
+        if short.size:
+            # Бот видит прирост qty - window и переразмещает недостающее (всё, если прироста нет)
+            short_by = np.where(window[short] < qty - eps, np.round(window[short], spec.size_prec), qty)
+            values, inverse = np.unique(short_by, return_inverse=True)
+            size = np.array([self._rsize(spec, v) for v in values])[inverse]
+            # Докупка по bid тика распознавания; исходный BUY ветки остаётся в позиции без ветки
+            price = np.round(self.bid[row_d[short]], spec.price_prec)
+            taker = price >= self.ask[row_d[short]]
+            cash -= float((price * size * (1.0 + np.where(taker, self.taker_fee, self.maker_fee))).sum())
+            bought += float(size.sum())
+            turnover += float((price * size).sum())
+            resized = size != qty
+            if resized.any():
+                idx = short[resized]
+                out.take(idx, self._exits(spec, ent, row_s, idx, size[resized]))
+
+        position = bought - float(out.sold.sum())
+        return FastResult(
+            params=params or {},
+            equity=float(cash + out.cash.sum() + position * last_end),
+            branches=count,
+            legs_filled=int(out.legs.sum()),
+            stops=int(out.stopped.sum()),
+            stops_unfilled=int(out.unfilled.sum()),
+            final_position=position,
+            turnover=turnover,
+        )
+
+    def evaluate_coupled(self, spec: MarketSpec, params: Optional[dict] = None) -> FastResult:
+        """Последовательная оценка с учётом позиции при распознавании BUY (медленнее, ближе к Bot)"""
+        qty = float(spec.rsize(spec.buy_qty))
+        legs_cache: Dict[float, list] = {}
+        fills: List[Tuple[float, float, bool]] = []   # продажи: цена, размер, taker
+        counts = {"legs": 0, "stops": 0, "unfilled": 0}
+
+        def exits(price: float, size: float, d: int) -> list:
+            legs = legs_cache.get(size)
+            if legs is None:
+                legs = legs_cache[size] = self._legs_for(spec, Decimal(repr(size)))
+            k = _first_hit(self.last_t, d + 1, float(self._scaled(spec, price, spec.sl_mult)), below=True)
+            row_k = self.tick_rows[k] if k < self.nt else self.n
+            events, sold, seen = [], 0.0, 0.0
+            if d < self.nt:
+                row_s = self.tick_rows[d]
+                bid_s = float(self.bid[row_s])
+                for pct, leg_size in legs:
+                    target = float(self._target(spec, price, pct))
+                    if target <= bid_s:
+                        events.append((2 * row_s + 1, leg_size))
+                        fills.append((bid_s, leg_size, True))
+                        if row_s < row_k:
+                            seen += leg_size
+                    else:
+                        f = _first_hit(self.bid, row_s + 1, target, stop=min(row_k + 1, self.n))
+                        if f > row_k or f >= self.n:
+                            continue
+                        events.append((2 * f, leg_size))
+                        fills.append((target, leg_size, False))
+                        seen += leg_size
+                    sold += leg_size
+                    counts["legs"] += 1
+            if k < self.nt and size - sold > 1e-12:
+                counts["stops"] += 1
+                if self.bid[row_k] >= self.last_t[k]:
+                    rem = float(self._remainder(spec, size - seen))
+                    events.append((2 * row_k + 1, rem))
+                    fills.append((float(self.bid[row_k]), rem, True))
+                else:
+                    counts["unfilled"] += 1
+            return events
+
+        branches, buys = self._run_buys(spec, qty, exits)
+        last_end = float(self.last[-1]) if self.n else 0.0
+        cash = -sum(p * q * (1.0 + (self.taker_fee if taker else self.maker_fee)) for p, q, taker in buys)
+        cash += sum(p * q * (1.0 - (self.taker_fee if taker else self.maker_fee)) for p, q, taker in fills)
+        position = sum(q for _, q, _ in buys) - sum(q for _, q, _ in fills)
+        return FastResult(
+            params=params or {},
+            equity=float(cash + position * last_end),
+            branches=len(branches),
+            legs_filled=counts["legs"],
+            stops=counts["stops"],
+            stops_unfilled=counts["unfilled"],
+            final_position=position,
+            turnover=float(sum(p * q for p, q, _ in buys)),
+        )
+
+
+def load_array(path: str) -> np.ndarray:
+    """.bin отображается в память без копирования; CSV читается через backtest.read_csv"""
+    if path.endswith(".bin"):
+        return np.memmap(path, dtype="<f8", mode="r")
+    from backtest import read_csv
+    return np.frombuffer(read_csv(path), dtype=np.float64)
+
+
+def run_grid(sim: FastSim, symbol: str, grid: Dict[str, list], coupled: bool = False) -> List[FastResult]:
+    combos = expand_grid(grid)
+    # Комбинации с одним rise_pct подряд - входы считаются один раз
+    combos.sort(key=lambda c: json.dumps(c.get("rise_pct")))
+    evaluate = sim.evaluate_coupled if coupled else sim.evaluate
+    results = [evaluate(compile_spec(symbol, **combo_overrides(symbol, c)), c) for c in combos]
+    results.sort(key=lambda r: r.equity, reverse=True)
+    return results
+
+
+def validate(sim: FastSim, series_path: str, symbol: str, results: List[FastResult], count: int,
+             options: dict) -> bool:
+    """Прогоняет лучшие комбинации полным бэктестом и сравнивает с обеими моделями FastSim"""
+    import asyncio
+    import tempfile
+
+    from backtest import Backtest, load_series
+    from market_specs import MARKET_SPECS
+
+    def within(model: str, r: FastResult, branches: int, equity: float) -> Tuple[float, bool]:
+        tol = FAST_TOLERANCE[model]
+        d_equity = abs(r.equity - equity) / max(r.turnover, 1e-9)
+        d_branches = abs(r.branches - branches) / max(branches, 1)
+        return d_equity, d_branches <= tol["branches"] and d_equity <= tol["equity_of_turnover"]
+
+    series = load_series(series_path)
+    ok = True
+    print(f"{'#':>3}  {'ветки vec/coupled/full':>22}  {'equity vec':>11}  {'coupled':>11}  {'full':>11}  "
+          f"{'Δvec':>8}  {'Δcoupled':>8}")
+    with tempfile.TemporaryDirectory(prefix="fastsim_") as tmp:
+        for i, r in enumerate(results[:count], 1):
+            spec = compile_spec(symbol, **combo_overrides(symbol, r.params))
+            vec, coupled = sim.evaluate(spec, r.params), sim.evaluate_coupled(spec, r.params)
+            specs = dict(MARKET_SPECS)
+            specs[symbol] = spec
+            bt = Backtest(symbol, series, tmp, specs=specs, **options)
+            asyncio.run(bt.run())
+            full = bt.summary(0)
+            bt.bot.journal.close()
+            bt.bot.archive.close()
+            bt.bot.tracer.close()
+            branches, equity = full["branches_opened"], float(full["equity"])
+            d_vec, good_vec = within("vectorised", vec, branches, equity)
+            d_coupled, good_coupled = within("coupled", coupled, branches, equity)
+            good = good_vec and good_coupled
+            ok = ok and good
+            print(f"{i:>3}  {f'{vec.branches}/{coupled.branches}/{branches}':>22}  {vec.equity:>11.2f}  "
+                  f"{coupled.equity:>11.2f}  {equity:>11.2f}  {d_vec:>8.5f}  {d_coupled:>8.5f}  {'✅' if good else '⚠️'}")
+    return ok
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Быстрый векторный отбор параметров стратегии")
+    ap.add_argument("series", help="ряд цен: .bin (mmap) или CSV")
+    ap.add_argument("--symbol", default=config.MARKETS[0])
+    ap.add_argument("--grid", required=True, help="JSON-файл или JSON-строка с сеткой (как в sweep.py)")
+    ap.add_argument("--top", type=int, default=20)
+    ap.add_argument("--out", default="fastsim_results.csv")
+    ap.add_argument("--tick", type=float, default=None)
+    ap.add_argument("--maker-fee", type=float, default=0.0)
+    ap.add_argument("--taker-fee", type=float, default=0.0)
+    ap.add_argument("--coupled", action="store_true", help="последовательная модель с учётом позиции (медленнее)")
+    ap.add_argument("--validate", type=int, default=0, metavar="N", help="проверить N лучших полным бэктестом")
+    args = ap.parse_args()
+
+    if os.path.exists(args.grid):
+        with open(args.grid, "r", encoding="utf-8") as f:
+            grid = json.load(f)
+    else:
+        grid = json.loads(args.grid)
+
+    started = time.perf_counter()
+    sim = FastSim(load_array(args.series), args.symbol, tick_seconds=args.tick,
+                  maker_fee=args.maker_fee, taker_fee=args.taker_fee)
+    prepared = time.perf_counter() - started
+    results = run_grid(sim, args.symbol, grid, args.coupled)
+    elapsed = time.perf_counter() - started
+
+    param_keys = sorted({k for r in results for k in r.params})
+    with open(args.out, "w", encoding="utf-8") as f:
+        f.write(",".join(["rank", *param_keys, "equity", "branches", "legs_filled", "stops", "stops_unfilled",
+                          "final_position"]) + "\n")
+        for i, r in enumerate(results, 1):
+            values = [json.dumps(r.params.get(k)).replace(",", ";") for k in param_keys]
+            f.write(",".join(map(str, [i, *values, round(r.equity, 6), r.branches, r.legs_filled, r.stops,
+                                       r.stops_unfilled, round(r.final_position, 8)])) + "\n")
+
+    print(f"{'#':>3}  {'equity':>12}  {'branches':>8}  {'SL':>6}  параметры")
+    for i, r in enumerate(results[:args.top], 1):
+        params = ", ".join(f"{k}={json.dumps(v)}" for k, v in r.params.items())
+        print(f"{i:>3}  {r.equity:>12.2f}  {r.branches:>8}  {r.stops:>6}  {params}")
+    print(f"✅ {len(results)} комбинаций за {elapsed:.1f}s (подготовка ряда {prepared:.1f}s) -> {args.out}")
+
+    if args.validate:
+        options = {"tick_seconds": args.tick, "maker_fee": Decimal(str(args.maker_fee)),
+                   "taker_fee": Decimal(str(args.taker_fee))}
+        if not validate(sim, args.series, args.symbol, results, args.validate, options):
+            print("⚠️ Расхождение с полным бэктестом больше допуска FAST_TOLERANCE")
+
+
+if __name__ == "__main__":
+    main()
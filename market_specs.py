@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Precompiled per-market specs for Extended Trading Bot v2
+
+Параметры пары из config.py один раз переводятся в Decimal и собираются в неизменяемый
+MarketSpec: шаги цены и размера, минимальный размер, шаг лота, множители триггера роста,
+SELL-ступеней, PnL-защиты и стоп-лосса, доли SELL. Бот берёт всё из спецификации и не
+строит Decimal из float на каждом вызове.
+
+Округление размера обобщено через шаг лота (LOT_STEP в config.py, по умолчанию равен
+шагу точности размера) вместо частного случая BTC-USD.
+
+Целочисленное представление: цена - число тиков (шагов цены), размер - число лотов
+(шагов размера). to_ticks / to_lots переводят Decimal в int, from_ticks / from_lots -
+обратно; Decimal нужен только на границе с SDK и в файле состояния.
+
+Для перебора параметров спецификацию можно собрать с переопределениями:
+    compile_spec("BTC-USD", rise_pct=0.003, sl_pct=-0.015)
+"""
+
+from dataclasses import dataclass, field
+from decimal import ROUND_HALF_EVEN, Decimal
+from typing import Dict, Iterable, Optional, Tuple
+
+import config
+
+
+def _d(v) -> Decimal:
+    return v if isinstance(v, Decimal) else Decimal(str(v))
+
+
+@dataclass(frozen=True)
+class MarketSpec:
+    symbol: str
+    price_prec: int
+    size_prec: int
+    price_step: Decimal
+    size_step: Decimal
+    lot_step: Decimal
+    min_size: Decimal
+    buy_qty: Decimal
+    rise_mult: Decimal                 # 1 + BUY6_STEP_PCT
+    sell_pcts: Tuple[Decimal, ...]     # SELL_STEPS_PCT
+    split: Tuple[Decimal, ...]         # SELL_SPLIT
+    pnl_floor_mult: Decimal            # 1 + PNL_MIN_PCT
+    sl_mult: Decimal                   # 1 + BRANCH_SL_PCT
+    price_scale: Decimal = field(init=False, repr=False)   # 10^price_prec
+    size_scale: Decimal = field(init=False, repr=False)    # 10^size_prec
+
+    def __post_init__(self):
+        object.__setattr__(self, "price_scale", Decimal(10) ** self.price_prec)
+        object.__setattr__(self, "size_scale", Decimal(10) ** self.size_prec)
+
+    def rprice(self, v: Decimal) -> Decimal:
+        return v.quantize(self.price_step)
+
+    def rsize(self, v: Decimal) -> Decimal:
+        step = self.lot_step
+        if step == self.size_step:
+            vq = v.quantize(step)
+        else:
+            vq = ((v / step).quantize(Decimal("1")) * step).quantize(self.size_step)
+        if vq == 0 and v > 0:
+            # Как и раньше - один шаг размера; при LOT_STEP - один лот (размер не кратный лоту биржа не примет)
+            return step
+        if vq < self.min_size:
+            return self.min_size
+        return vq
+
+    def to_ticks(self, price: Decimal, rounding: str = ROUND_HALF_EVEN) -> int:
+        if rounding == ROUND_HALF_EVEN:
+            # round() у Decimal округляет половину к чётному и сразу даёт int - вдвое дешевле int(to_integral_value)
+            return round(price * self.price_scale)
+        return int((price * self.price_scale).to_integral_value(rounding))
+
+    def from_ticks(self, ticks: int) -> Decimal:
+        return Decimal(ticks).scaleb(-self.price_prec)
+
+    def to_lots(self, size: Decimal, rounding: str = ROUND_HALF_EVEN) -> int:
+        if rounding == ROUND_HALF_EVEN:
+            return round(size * self.size_scale)
+        return int((size * self.size_scale).to_integral_value(rounding))
+
+    def from_lots(self, lots: int) -> Decimal:
+        return Decimal(lots).scaleb(-self.size_prec)
+
+
+def compile_spec(symbol: str, rise_pct=None, sell_pcts=None, split=None, pnl_min_pct=None,
+                 sl_pct=None, buy_qty=None, lot_step=None) -> MarketSpec:
+    """Собирает спецификацию пары из config.py; аргументы переопределяют значения конфига"""
+    price_prec = config.PRICE_PRECISION.get(symbol, 2)
+    size_prec = config.SIZE_PRECISION.get(symbol, 6)
+    size_step = Decimal(10) ** (-size_prec)
+    lot = lot_step if lot_step is not None else config.LOT_STEP.get(symbol)
+    return MarketSpec(
+        symbol=symbol,
+        price_prec=price_prec,
+        size_prec=size_prec,
+        price_step=Decimal(10) ** (-price_prec),
+        size_step=size_step,
+        lot_step=_d(lot) if lot is not None else size_step,
+        min_size=_d(config.MIN_ORDER_SIZES.get(symbol, "0.0001")),
+        buy_qty=_d(buy_qty if buy_qty is not None else config.BUY_QTY.get(symbol, 0)),
+        rise_mult=Decimal("1") + _d(rise_pct if rise_pct is not None else config.BUY6_STEP_PCT.get(symbol, 0)),
+        sell_pcts=tuple(_d(p) for p in (sell_pcts if sell_pcts is not None else config.SELL_STEPS_PCT.get(symbol, ()))),
+        split=tuple(_d(x) for x in (split if split is not None else config.SELL_SPLIT)),
+        pnl_floor_mult=Decimal("1") + _d(pnl_min_pct if pnl_min_pct is not None else config.PNL_MIN_PCT),
+        sl_mult=Decimal("1") + _d(sl_pct if sl_pct is not None else config.BRANCH_SL_PCT),
+    )
+
+
+def compile_specs(symbols: Optional[Iterable[str]] = None) -> Dict[str, MarketSpec]:
+    if symbols is None:
+        symbols = set(config.MIN_ORDER_SIZES) | set(config.MARKETS)
+    return {s: compile_spec(s) for s in symbols}
+
+
+MARKET_SPECS: Dict[str, MarketSpec] = compile_specs()
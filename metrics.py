@@ -0,0 +1,357 @@
+# -*- coding: utf-8 -*-
+"""
+Tick latency metrics and Prometheus text endpoint for Extended Trading Bot v2
+
+Метрики живут в памяти процесса (MetricsRegistry) и отдаются локальным HTTP-сервером
+(MetricsServer) в текстовом формате Prometheus по адресу http://METRICS_HOST:METRICS_PORT/metrics.
+
+Типы:
+    Histogram - распределение длительностей по фиксированным корзинам (секунды)
+    Counter   - монотонный счётчик
+    Gauge     - текущее значение
+
+Counter и Gauge могут не хранить значения сами, а читать их при каждом запросе /metrics
+из функции (fn), возвращающей пары (значения меток, число) - так счётчики бота
+(активные ветки, висячие BUY, перерасход тиков) не дублируются.
+
+Фаза тика замеряется контекстом:
+    with metrics.phase("BTC-USD", "check_branch_sl"):
+        await self.check_branch_sl(...)
+
+Фаза (или caller(...) вне тика) заодно помечает все запросы к бирже внутри неё: ApiStats
+считает вызовы и задержку по (метод API, вызывающий, рынок) и в пределах одного тика пары
+находит чтения, вернувшие те же данные на тот же запрос, что и раньше в этом тике, - их
+можно было не делать (кэш / пакетный запрос).
+"""
+
+import abc
+import bisect
+import contextvars
+import math
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from aiohttp import web
+
+# Корзины длительностей фаз тика (сек.): от 1 мс до периода тика и выше
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = Tuple[str, ...]
+Samples = Callable[[], Iterable[Tuple[Labels, float]]]
+
+# Кто делает запросы к бирже: фаза run_once или задача вне тика (поток цен, события аккаунта)
+_caller: contextvars.ContextVar = contextvars.ContextVar("api_caller", default="other")
+# Чтения текущего тика пары: (метод, аргументы, отпечаток ответа); None - вне тика
+_tick_reads: contextvars.ContextVar = contextvars.ContextVar("api_tick_reads", default=None)
+
+
+def _escape(v) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Tuple[str, ...], values: Labels, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _fingerprint(v) -> int:
+    """Хэш содержимого ответа API: списки и объекты (dataclass / модели SDK) по значениям полей.
+
+    В разы дешевле hash(repr(...)) на списке ордеров; поля без хэша разбираются рекурсивно.
+    """
+    if isinstance(v, (list, tuple)):
+        try:
+            return hash(tuple(tuple(x.__dict__.values()) for x in v))
+        except (AttributeError, TypeError):
+            return hash(tuple(_fingerprint(x) for x in v))
+    fields = getattr(v, "__dict__", None)
+    if fields is not None:
+        try:
+            return hash(tuple(fields.values()))
+        except TypeError:
+            return hash(tuple(_fingerprint(x) for x in fields.values()))
+    try:
+        return hash(v)
+    except TypeError:
+        return hash(repr(v))
+
+
+def _num(v: float) -> str:
+    if v == math.inf:
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class _Metric(abc.ABC):
+    kind = ""
+
+    def __init__(self, name: str, help: str, label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+    @abc.abstractmethod
+    def render(self) -> List[str]:
+        """Строки метрики в текстовом формате Prometheus, начиная с header()"""
+
+
+class _Value(_Metric):
+    """Counter / Gauge: значения по меткам или функция fn, читаемая при запросе"""
+
+    def __init__(self, name: str, help: str, label_names: Tuple[str, ...] = (), fn: Optional[Samples] = None):
+        super().__init__(name, help, label_names)
+        self.fn = fn
+        self.values: Dict[Labels, float] = {}
+
+    def samples(self) -> Iterable[Tuple[Labels, float]]:
+        return self.fn() if self.fn is not None else list(self.values.items())
+
+    def render(self) -> List[str]:
+        return self.header() + [f"{self.name}{_labels(self.label_names, k)} {_num(v)}" for k, v in self.samples()]
+
+
+class Counter(_Value):
+    kind = "counter"
+
+    def inc(self, labels: Labels = (), n: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + n
+
+
+class Gauge(_Value):
+    kind = "gauge"
+
+    def set(self, labels: Labels, v: float):
+        self.values[labels] = v
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, label_names: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, label_names)
+        self.buckets = tuple(sorted(buckets))
+        # метки -> [счётчики корзин (не накопительные, последняя - +Inf), сумма, количество]
+        self.series: Dict[Labels, list] = {}
+
+    def observe(self, labels: Labels, v: float):
+        s = self.series.get(labels)
+        if s is None:
+            s = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        s[0][bisect.bisect_left(self.buckets, v)] += 1
+        s[1] += v
+        s[2] += 1
+
+    def render(self) -> List[str]:
+        out = self.header()
+        for labels, (counts, total, n) in self.series.items():
+            acc = 0
+            for bound, c in zip(self.buckets + (math.inf,), counts):
+                acc += c
+                le = 'le="%s"' % _num(bound)
+                out.append(f"{self.name}_bucket{_labels(self.label_names, labels, le)} {acc}")
+            out.append(f"{self.name}_sum{_labels(self.label_names, labels)} {_num(total)}")
+            out.append(f"{self.name}_count{_labels(self.label_names, labels)} {n}")
+        return out
+
+
+class _PhaseTimer:
+    __slots__ = ("hist", "labels", "started", "token")
+
+    def __init__(self, hist: Histogram, labels: Labels):
+        self.hist = hist
+        self.labels = labels
+
+    def __enter__(self):
+        self.token = _caller.set(self.labels[1])
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe(self.labels, time.perf_counter() - self.started)
+        _caller.reset(self.token)
+        return False
+
+
+class _Scope:
+    """Контекст, задающий переменную на время блока; value=None - переменная не меняется"""
+    __slots__ = ("var", "value", "on_enter", "token")
+
+    def __init__(self, var: contextvars.ContextVar, value, on_enter: Optional[Callable] = None):
+        self.var = var
+        self.value = value
+        self.on_enter = on_enter
+
+    def __enter__(self):
+        self.token = self.var.set(self.value) if self.value is not None else None
+        if self.token is not None and self.on_enter:
+            self.on_enter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.token is not None:
+            self.var.reset(self.token)
+        return False
+
+
+class MetricsRegistry:
+    def __init__(self, prefix: str = ""):
+        self.prefix = prefix
+        self.metrics: List[_Metric] = []
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, label_names: Tuple[str, ...] = (), fn: Optional[Samples] = None) -> Counter:
+        return self._add(Counter(self.prefix + name, help, label_names, fn))
+
+    def gauge(self, name: str, help: str, label_names: Tuple[str, ...] = (), fn: Optional[Samples] = None) -> Gauge:
+        return self._add(Gauge(self.prefix + name, help, label_names, fn))
+
+    def histogram(self, name: str, help: str, label_names: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(self.prefix + name, help, label_names, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for m in self.metrics:
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+
+class BotMetrics(MetricsRegistry):
+    """Метрики тика бота: фазы run_once по рынкам, длительность и перерасход тика, ошибки циклов"""
+
+    def __init__(self, prefix: str = "volume_bot_"):
+        super().__init__(prefix)
+        self.phase_seconds = self.histogram("tick_phase_seconds", "Длительность фазы run_once", ("market", "phase"))
+        self.tick_seconds = self.histogram("tick_seconds", "Длительность тика пары (снимок аккаунта + run_once)",
+                                           ("market",))
+        self.loop_errors = self.counter("loop_errors_total", "Ошибки цикла пары", ("market",))
+        self.open_orders = self.gauge("open_orders", "Открытые ордера пары по снимку конца тика", ("market", "side"))
+        self.api = ApiStats(self)
+
+    def phase(self, market: str, phase: str) -> _PhaseTimer:
+        return _PhaseTimer(self.phase_seconds, (market, phase))
+
+
+class ApiStats:
+    """Учёт запросов к бирже: вызовы, ошибки, задержка и повторные чтения в пределах тика.
+
+    Кроме счётчиков Prometheus ведёт окно для периодического отчёта (report): с последнего
+    отчёта по каждой паре (вызывающий, метод) - вызовы, вызовы на тик, повторы, ошибки, задержка.
+    """
+
+    def __init__(self, registry: MetricsRegistry):
+        self.calls = registry.counter("api_calls_total", "Запросы к бирже",
+                                      ("endpoint", "caller", "market", "outcome"))
+        self.latency = registry.histogram("api_call_seconds", "Задержка запроса к бирже (без ожидания лимитера)",
+                                          ("endpoint", "caller", "market"))
+        self.duplicates = registry.counter("api_duplicate_reads_total",
+                                           "Чтения, повторившие запрос и ответ ранее в том же тике",
+                                           ("endpoint", "caller", "market"))
+        self.ticks = registry.counter("api_ticks_total", "Тики пар, в которых учитываются запросы", ("market",))
+        # (вызывающий, метод) -> [вызовы, повторы, ошибки, секунды]; сбрасывается отчётом
+        self.window: Dict[Tuple[str, str], list] = {}
+        self.window_ticks = 0
+        self.total: Dict[Tuple[str, str], list] = {}
+        self.total_ticks = 0
+        # Поиск повторных чтений хэширует ответы; перебор параметров (sweep.py) его отключает
+        self.check_duplicates = True
+
+    @staticmethod
+    def caller(name: str) -> _Scope:
+        """Помечает запросы внутри блока вызывающим name (вне фаз run_once)"""
+        return _Scope(_caller, name)
+
+    def tick(self, market: str) -> _Scope:
+        """Тик пары: повторные чтения ищутся в его пределах. Вложенный тик той же задачи не начинает новый"""
+        def started():
+            self.ticks.inc((market,))
+            self.window_ticks += 1
+            self.total_ticks += 1
+        return _Scope(_tick_reads, set() if _tick_reads.get() is None else None, started)
+
+    def record(self, endpoint: str, market: str, seconds: float, outcome: str = "ok", read=None):
+        """Учитывает завершённый запрос; read=(аргументы, ответ) - чтение, которое проверяется на повтор"""
+        caller = _caller.get()
+        self.calls.inc((endpoint, caller, market, outcome))
+        self.latency.observe((endpoint, caller, market), seconds)
+        duplicate = 0
+        seen = _tick_reads.get()
+        if read is not None and seen is not None and self.check_duplicates:
+            args, res = read
+            key = (endpoint, repr(sorted(args.items())), _fingerprint(getattr(res, "data", res)))
+            if key in seen:
+                duplicate = 1
+                self.duplicates.inc((endpoint, caller, market))
+            else:
+                seen.add(key)
+        error = 0 if outcome == "ok" else 1
+        for acc in (self.window, self.total):
+            row = acc.get((caller, endpoint))
+            if row is None:
+                row = acc[(caller, endpoint)] = [0, 0, 0, 0.0]
+            row[0] += 1
+            row[1] += duplicate
+            row[2] += error
+            row[3] += seconds
+
+    @staticmethod
+    def _rows(acc: Dict[Tuple[str, str], list], ticks: int) -> List[dict]:
+        return [{"caller": caller, "endpoint": endpoint, "calls": n, "per_tick": round(n / ticks, 3) if ticks else None,
+                 "duplicates": dup, "errors": err, "avg_ms": round(sec / n * 1000, 2)}
+                for (caller, endpoint), (n, dup, err, sec) in sorted(acc.items(), key=lambda kv: -kv[1][0])]
+
+    def summary(self) -> dict:
+        """Итог за всё время работы (для summary бэктеста)"""
+        return {"ticks": self.total_ticks, "calls": self._rows(self.total, self.total_ticks)}
+
+    def report(self) -> List[str]:
+        """Строки отчёта за окно с прошлого вызова; окно сбрасывается"""
+        rows, ticks = self._rows(self.window, self.window_ticks), self.window_ticks
+        self.window, self.window_ticks = {}, 0
+        calls = sum(r["calls"] for r in rows)
+        dups = sum(r["duplicates"] for r in rows)
+        per_tick = f"{calls / ticks:.2f}" if ticks else "-"
+        lines = [f"📡 Запросы к бирже: {calls} за {ticks} тиков ({per_tick}/тик), повторных чтений: {dups}"]
+        for r in rows:
+            per = f"{r['per_tick']:.2f}/тик" if r["per_tick"] is not None else "-"
+            lines.append(f"   {r['caller']:<24} {r['endpoint']:<24} {r['calls']:>6} ({per}) "
+                         f"повторы {r['duplicates']}, ошибки {r['errors']}, {r['avg_ms']:.1f} мс")
+        return lines
+
+
+class MetricsServer:
+    """Локальный HTTP-сервер: GET /metrics - текстовый формат Prometheus"""
+
+    def __init__(self, registry: MetricsRegistry, host: str = "127.0.0.1", port: int = 0):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}/metrics"
+
+    async def _handle(self, request):
+        return web.Response(body=self.registry.render().encode("utf-8"),
+                            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Priority-aware client-side rate limiter for Extended Trading Bot v2
+
+Один token bucket на все запросы к бирже. Когда токенов не хватает, запросы ждут
+в очередях по классам приоритета, а внутри класса рынки обслуживаются по кругу,
+чтобы одна активная пара не забирала весь лимит.
+
+Приоритеты (меньше - важнее):
+    STOP_LOSS > CANCEL > SELL > BUY > READ
+
+STOP_LOSS никогда не ждёт: токен списывается сразу (баланс может уйти в минус),
+и задержку получают менее важные запросы.
+
+Приоритет можно поднять для целого участка кода через контекст:
+    with limiter.priority(Priority.STOP_LOSS):
+        ...  # все запросы внутри, включая чтения, идут как STOP_LOSS
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import time
+from collections import OrderedDict, deque
+from enum import IntEnum
+from typing import Dict, Optional
+
+
+class Priority(IntEnum):
+    STOP_LOSS = 0
+    CANCEL = 1
+    SELL = 2
+    BUY = 3
+    READ = 4
+
+
+_priority_floor: contextvars.ContextVar = contextvars.ContextVar("priority_floor", default=None)
+
+
+class PriorityRateLimiter:
+    def __init__(self, rate: float, burst: float):
+        """rate - токенов в секунду (0 = без ограничения), burst - ёмкость корзины"""
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = float(self.burst)
+        self._updated = time.monotonic()
+        # priority -> market -> очередь ожидающих futures
+        self._queues: Dict[int, "OrderedDict[str, deque]"] = {p: OrderedDict() for p in Priority}
+        self._waiting = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.delayed: Dict[int, int] = {p: 0 for p in Priority}
+
+    @contextlib.contextmanager
+    def priority(self, priority: Priority):
+        """Поднимает приоритет всех запросов внутри блока (не понижает)"""
+        current = _priority_floor.get()
+        token = _priority_floor.set(priority if current is None else min(current, priority))
+        try:
+            yield
+        finally:
+            _priority_floor.reset(token)
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, priority: Priority, market: str = "*"):
+        if self.rate <= 0:
+            return
+        floor = _priority_floor.get()
+        if floor is not None:
+            priority = min(priority, floor)
+        self._refill()
+        if priority == Priority.STOP_LOSS or (not self._waiting and self.tokens >= 1):
+            self.tokens -= 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        self._queues[priority].setdefault(market, deque()).append(fut)
+        self._waiting += 1
+        self.delayed[priority] += 1
+        self._schedule()
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if not fut.done():
+                fut.cancel()
+            raise
+
+    def _pop_next(self):
+        for priority in Priority:
+            markets = self._queues[priority]
+            while markets:
+                market, waiters = next(iter(markets.items()))
+                fut = waiters.popleft()
+                self._waiting -= 1
+                # Рынок уходит в конец круга своего приоритета
+                del markets[market]
+                if waiters:
+                    markets[market] = waiters
+                if not fut.cancelled():
+                    return fut
+        return None
+
+    def _schedule(self):
+        if self._timer is not None or not self._waiting:
+            return
+        delay = max(0.0, (1 - self.tokens) / self.rate)
+        self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+
+    def _dispatch(self):
+        self._timer = None
+        self._refill()
+        while self._waiting and self.tokens >= 1:
+            fut = self._pop_next()
+            if fut is None:
+                break
+            self.tokens -= 1
+            fut.set_result(None)
+        self._schedule()
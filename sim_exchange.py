@@ -0,0 +1,424 @@
+# -*- coding: utf-8 -*-
+"""
+Simulated exchange and trading client for Extended Trading Bot v2 backtests
+
+SimExchange - простая модель биржи по одному или нескольким рынкам:
+    - котировка (last / bid / ask) задаётся снаружи из исторического ряда (set_quote)
+    - лимитный BUY исполняется, когда ask <= цены ордера, SELL - когда bid >= цены;
+      исполнение целиком по цене ордера (maker)
+    - ордер, пересекающий рынок при размещении, исполняется сразу по ask / bid (taker)
+    - IOC исполняется сразу или снимается; GTT снимается по expire_time
+    - ограничение для SL: бот закрывает ветку SELL IOC с лимитом last (place_market_sell_ioc),
+      а такой ордер, как и на бирже, исполняется, только если bid >= last. В рядах, где last
+      лежит строго внутри спреда (--synthetic: bid = last - шаг цены), SL не исполняется
+      никогда: ветка закрывается как sl-force, её объём остаётся в позиции биржи, и
+      realized_pnl_bot расходится с realized_pnl_exchange. Число таких SL - стадия
+      sl / ioc_unfilled в order_stages бэктеста
+    - позиция со средней ценой входа, реализованный PnL и комиссии считаются по исполнениям
+
+SimTradingClient повторяет ту часть PerpetualTradingClient, которой пользуется бот
+(markets_info, account, orders, place_order), и считает вызовы API по методам.
+Время берётся у часов бота: в бэктесте - clock.VirtualClock, в режиме EXCHANGE_MODE = "sim" -
+clock.SystemClock, а котировки даёт random_walk_quotes.
+
+FaultProfile добавляет сбои для нагрузочных тестов: задержку запросов (логнормальную),
+лимит запросов биржи и случайные 429 (RateLimitException, как у SDK), частичные исполнения
+и ордера, которые биржа приняла, но потеряла. По умолчанию биржа идеальная.
+
+Цены ряда хранятся float, а в Decimal переводятся только при обращении бота к API и
+при исполнении, чтобы проход по ряду без событий стоил пару сравнений на строку.
+"""
+
+import collections
+import datetime
+import itertools
+import math
+import random
+from dataclasses import dataclass
+from decimal import ROUND_DOWN, Decimal
+from typing import Dict, List, Optional, Tuple
+
+from x10.perpetual.orders import OrderSide, TimeInForce
+from x10.utils.http import RateLimitException
+
+from market_specs import MARKET_SPECS, MarketSpec, compile_spec
+
+INF = float("inf")
+
+
+class SimApiError(Exception):
+    """Ошибка запроса к симулированной бирже (как ответ биржи с ошибкой)"""
+
+
+@dataclass
+class FaultProfile:
+    latency_ms: float = 0.0               # медиана задержки запроса (туда и обратно)
+    latency_sigma: float = 0.0            # разброс задержки (логнормальный), 0 - постоянная
+    rate_limit_per_second: float = 0.0    # лимит запросов биржи (token bucket), 0 - без лимита
+    rate_limit_burst: int = 0             # запас токенов лимита
+    error_429_rate: float = 0.0           # доля случайных 429 сверх лимита
+    partial_fill_rate: float = 0.0        # доля исполнений, проходящих частично (остаток ждёт дальше)
+    drop_rate: float = 0.0                # доля ордеров, принятых биржей, но не попавших в книгу
+    seed: Optional[int] = None
+
+
+@dataclass
+class SimOrder:
+    # Те же имена полей, что у OpenOrderModel из SDK
+    id: int
+    external_id: Optional[str]
+    market: str
+    side: OrderSide
+    price: Decimal
+    qty: Decimal
+    time_in_force: TimeInForce
+    created_time: int                   # мс
+    expiry_time: Optional[int] = None   # мс
+    filled_qty: Decimal = Decimal("0")
+    status: str = "NEW"
+
+
+@dataclass
+class SimPosition:
+    market: str
+    size: Decimal
+    open_price: Decimal
+
+
+@dataclass
+class SimStats:
+    last_price: Decimal
+    bid_price: Decimal
+    ask_price: Decimal
+    mark_price: Decimal
+
+
+@dataclass
+class SimPlacedOrder:
+    id: int
+    external_id: Optional[str]
+
+
+@dataclass
+class SimResponse:
+    data: object
+
+
+@dataclass
+class SimFill:
+    ts: float
+    market: str
+    order_id: int
+    external_id: Optional[str]
+    side: OrderSide
+    price: Decimal
+    qty: Decimal
+    fee: Decimal
+    maker: bool
+
+
+def _dec(v: float) -> Decimal:
+    return Decimal(repr(v))
+
+
+class SimExchange:
+    def __init__(self, clock, maker_fee: Decimal = Decimal("0"), taker_fee: Decimal = Decimal("0"),
+                 faults: Optional[FaultProfile] = None):
+        self.clock = clock
+        self.maker_fee = maker_fee
+        self.taker_fee = taker_fee
+        self.faults = faults or FaultProfile()
+        self.rng = random.Random(self.faults.seed)
+        # Число внесённых сбоев по видам (dropped, partial, 429, rate_limited)
+        self.injected: Dict[str, int] = collections.Counter()
+        self.orders: Dict[int, SimOrder] = {}
+        self.fills: List[SimFill] = []
+        # Счётчик исполнений и истечений: бэктест пропускает тики, только пока он не меняется
+        self.events = 0
+        self._ids = itertools.count(1)
+        # Котировка по рынку (float) и её Decimal-версия, построенная по запросу
+        self._quotes: Dict[str, tuple] = {}
+        self._dec_quotes: Dict[str, SimStats] = {}
+        # Позиция, средняя цена входа, реализованный PnL и комиссии по рынку
+        self.size: Dict[str, Decimal] = collections.defaultdict(Decimal)
+        self.open_price: Dict[str, Decimal] = collections.defaultdict(Decimal)
+        self.realized: Dict[str, Decimal] = collections.defaultdict(Decimal)
+        self.fees: Dict[str, Decimal] = collections.defaultdict(Decimal)
+        # Пороги срабатывания по рынку: самый высокий BUY, самый низкий SELL, ближайшее истечение
+        self._max_buy: Dict[str, float] = {}
+        self._min_sell: Dict[str, float] = {}
+        self._next_expiry = INF
+
+    # ---------- market data ----------
+    def set_quote(self, market: str, last: float, bid: Optional[float] = None, ask: Optional[float] = None):
+        """Новая котировка из ряда; исполняет и снимает ордера, которых она касается"""
+        if bid is None:
+            bid = last
+        if ask is None:
+            ask = last
+        self._quotes[market] = (last, bid, ask)
+        self._dec_quotes.pop(market, None)
+        if ask <= self._max_buy.get(market, -INF) or bid >= self._min_sell.get(market, INF):
+            self._match(market, bid, ask)
+        if self.clock.t * 1000 >= self._next_expiry:
+            self._expire()
+
+    def stats(self, market: str) -> SimStats:
+        st = self._dec_quotes.get(market)
+        if st is None:
+            if market not in self._quotes:
+                raise SimApiError(f"нет котировки для {market}")
+            last, bid, ask = self._quotes[market]
+            st = self._dec_quotes[market] = SimStats(_dec(last), _dec(bid), _dec(ask), _dec(last))
+        return st
+
+    # ---------- orders ----------
+    def place(self, market: str, side: OrderSide, qty: Decimal, price: Decimal, time_in_force: TimeInForce,
+              external_id: Optional[str] = None, expire_time: Optional[datetime.datetime] = None) -> SimOrder:
+        if qty <= 0 or price <= 0:
+            raise SimApiError(f"некорректный ордер {side} {qty}@{price}")
+        quote = self.stats(market)
+        now_ms = int(self.clock.t * 1000)
+        order = SimOrder(
+            id=next(self._ids), external_id=external_id, market=market, side=side, price=price, qty=qty,
+            time_in_force=time_in_force, created_time=now_ms,
+            expiry_time=int(expire_time.timestamp() * 1000) if expire_time else None,
+        )
+        if self.faults.drop_rate and self.rng.random() < self.faults.drop_rate:
+            # Принят, но потерян биржей: id есть, в книге и исполнениях ордера нет
+            order.status = "CANCELLED"
+            self.injected["dropped"] += 1
+            return order
+        # Пересекающий рынок ордер исполняется сразу по лучшей встречной цене
+        if side == OrderSide.BUY and price >= quote.ask_price:
+            self._fill(order, quote.ask_price, maker=False)
+        elif side == OrderSide.SELL and price <= quote.bid_price:
+            self._fill(order, quote.bid_price, maker=False)
+        if order.filled_qty >= order.qty:
+            return order
+        if time_in_force == TimeInForce.IOC:
+            order.status = "CANCELLED"
+        else:
+            self.orders[order.id] = order
+            if side == OrderSide.BUY:
+                self._max_buy[market] = max(self._max_buy.get(market, -INF), float(price))
+            else:
+                self._min_sell[market] = min(self._min_sell.get(market, INF), float(price))
+            if order.expiry_time is not None and order.expiry_time < self._next_expiry:
+                self._next_expiry = order.expiry_time
+        return order
+
+    def cancel(self, order_id: int):
+        order = self.orders.pop(order_id, None)
+        if order is None:
+            raise SimApiError(f"ордер {order_id} не найден")
+        order.status = "CANCELLED"
+        # Уровни пересчитываются, только если снят крайний ордер
+        edge = self._max_buy.get(order.market) if order.side == OrderSide.BUY else self._min_sell.get(order.market)
+        if float(order.price) == edge:
+            self._update_levels(order.market)
+
+    def open_orders(self, markets: Optional[List[str]] = None, side: Optional[OrderSide] = None) -> List[SimOrder]:
+        return [o for o in self.orders.values()
+                if (not markets or o.market in markets) and (side is None or o.side == side)]
+
+    def positions(self, markets: Optional[List[str]] = None) -> List[SimPosition]:
+        return [SimPosition(m, size, self.open_price[m]) for m, size in self.size.items()
+                if size > 0 and (not markets or m in markets)]
+
+    def equity(self, market: str) -> Decimal:
+        """Реализованный PnL + переоценка открытой позиции по last - комиссии"""
+        size = self.size[market]
+        unrealized = (self.stats(market).last_price - self.open_price[market]) * size if size else Decimal("0")
+        return self.realized[market] + unrealized - self.fees[market]
+
+    # ---------- matching ----------
+    def _update_levels(self, market: str):
+        buys = [o.price for o in self.orders.values() if o.market == market and o.side == OrderSide.BUY]
+        sells = [o.price for o in self.orders.values() if o.market == market and o.side == OrderSide.SELL]
+        self._max_buy[market] = float(max(buys)) if buys else -INF
+        self._min_sell[market] = float(min(sells)) if sells else INF
+
+    def _match(self, market: str, bid: float, ask: float):
+        for order in list(self.orders.values()):
+            if order.market != market:
+                continue
+            if (order.side == OrderSide.BUY and ask <= order.price) or (order.side == OrderSide.SELL and bid >= order.price):
+                if self._fill(order, order.price, maker=True):
+                    del self.orders[order.id]
+        self._update_levels(market)
+
+    def _expire(self):
+        now_ms = self.clock.t * 1000
+        touched = set()
+        for order in list(self.orders.values()):
+            if order.expiry_time is not None and order.expiry_time <= now_ms:
+                del self.orders[order.id]
+                order.status = "EXPIRED"
+                self.events += 1
+                touched.add(order.market)
+        for market in touched:
+            self._update_levels(market)
+        self._next_expiry = min((o.expiry_time for o in self.orders.values() if o.expiry_time is not None),
+                                default=INF)
+
+    def _partial(self, order: SimOrder, qty: Decimal) -> Decimal:
+        """Часть остатка ордера (10-90%) с точностью размера ордера; весь остаток, если часть округлилась в 0"""
+        part = (qty * Decimal(repr(self.rng.uniform(0.1, 0.9)))).quantize(
+            Decimal(1).scaleb(order.qty.as_tuple().exponent), rounding=ROUND_DOWN)
+        if 0 < part < qty:
+            self.injected["partial"] += 1
+            return part
+        return qty
+
+    def _fill(self, order: SimOrder, price: Decimal, maker: bool) -> bool:
+        """Исполняет остаток ордера (или его часть при partial_fill_rate); True - ордер исполнен целиком"""
+        qty = order.qty - order.filled_qty
+        if self.faults.partial_fill_rate and self.rng.random() < self.faults.partial_fill_rate:
+            qty = self._partial(order, qty)
+        m = order.market
+        fee = price * qty * (self.maker_fee if maker else self.taker_fee)
+        size = self.size[m]
+        if order.side == OrderSide.BUY:
+            if size > 0:
+                self.open_price[m] = (self.open_price[m] * size + price * qty) / (size + qty)
+            else:
+                self.open_price[m] = price
+            self.size[m] = size + qty
+        else:
+            self.realized[m] += (price - self.open_price[m]) * qty
+            self.size[m] = size - qty
+            if self.size[m] <= 0:
+                self.open_price[m] = Decimal("0")
+        self.fees[m] += fee
+        order.filled_qty += qty
+        order.status = "FILLED" if order.filled_qty >= order.qty else "PARTIALLY_FILLED"
+        self.events += 1
+        self.fills.append(SimFill(self.clock.t, m, order.id, order.external_id, order.side, price, qty, fee, maker))
+        return order.status == "FILLED"
+
+
+class _SimMarketsInfo:
+    def __init__(self, client: "SimTradingClient"):
+        self._client = client
+
+    async def get_market_statistics(self, market_name: str):
+        await self._client._request("get_market_statistics")
+        return await self._client._respond(self._client.exchange.stats(market_name))
+
+
+class _SimAccount:
+    def __init__(self, client: "SimTradingClient"):
+        self._client = client
+
+    async def get_positions(self, market_names: Optional[List[str]] = None, position_side=None):
+        await self._client._request("get_positions")
+        return await self._client._respond(self._client.exchange.positions(market_names))
+
+    async def get_open_orders(self, market_names: Optional[List[str]] = None, order_side: Optional[OrderSide] = None, **kwargs):
+        await self._client._request("get_open_orders")
+        return await self._client._respond(self._client.exchange.open_orders(market_names, order_side))
+
+
+class _SimOrders:
+    def __init__(self, client: "SimTradingClient"):
+        self._client = client
+
+    async def cancel_order(self, order_id: int):
+        await self._client._request("cancel_order")
+        self._client.exchange.cancel(order_id)
+        return await self._client._respond(None)
+
+    async def mass_cancel(self, order_ids: Optional[List[int]] = None, **kwargs):
+        await self._client._request("mass_cancel")
+        for order_id in order_ids or []:
+            if order_id in self._client.exchange.orders:
+                self._client.exchange.cancel(order_id)
+        return await self._client._respond(None)
+
+
+class SimTradingClient:
+    """Замена PerpetualTradingClient поверх SimExchange"""
+
+    def __init__(self, exchange: SimExchange):
+        self.exchange = exchange
+        self.faults = exchange.faults
+        self.calls: Dict[str, int] = collections.Counter()
+        self.markets_info = _SimMarketsInfo(self)
+        self.account = _SimAccount(self)
+        self.orders = _SimOrders(self)
+        self._tokens = float(self.faults.rate_limit_burst or self.faults.rate_limit_per_second)
+        self._refilled = None
+
+    def _latency(self) -> float:
+        """Задержка половины пути запроса, сек"""
+        f = self.faults
+        if not f.latency_ms:
+            return 0.0
+        ms = f.latency_ms * math.exp(f.latency_sigma * self.exchange.rng.gauss(0.0, 1.0)) if f.latency_sigma else f.latency_ms
+        return ms / 2000.0
+
+    def _rate_limited(self) -> bool:
+        f = self.faults
+        if not f.rate_limit_per_second:
+            return False
+        now = self.exchange.clock.monotonic()
+        if self._refilled is not None:
+            burst = f.rate_limit_burst or f.rate_limit_per_second
+            self._tokens = min(burst, self._tokens + (now - self._refilled) * f.rate_limit_per_second)
+        self._refilled = now
+        if self._tokens < 1:
+            return True
+        self._tokens -= 1
+        return False
+
+    async def _request(self, name: str):
+        """Путь запроса до биржи: задержка, лимит запросов и случайные 429"""
+        self.calls[name] += 1
+        delay = self._latency()
+        if delay:
+            await self.exchange.clock.sleep(delay)
+        if self._rate_limited():
+            self.exchange.injected["rate_limited"] += 1
+            raise RateLimitException(f"Rate limited response from {name} (sim)")
+        if self.faults.error_429_rate and self.exchange.rng.random() < self.faults.error_429_rate:
+            self.exchange.injected["429"] += 1
+            raise RateLimitException(f"Rate limited response from {name} (sim)")
+
+    async def _respond(self, data) -> SimResponse:
+        delay = self._latency()
+        if delay:
+            await self.exchange.clock.sleep(delay)
+        return SimResponse(data)
+
+    async def place_order(self, market_name: str, amount_of_synthetic: Decimal, price: Decimal, side: OrderSide,
+                          time_in_force: TimeInForce = TimeInForce.GTT, external_id: Optional[str] = None,
+                          expire_time: Optional[datetime.datetime] = None, **kwargs):
+        await self._request("place_order")
+        order = self.exchange.place(market_name, side, amount_of_synthetic, price, time_in_force,
+                                    external_id=external_id, expire_time=expire_time)
+        return await self._respond(SimPlacedOrder(order.id, order.external_id))
+
+
+async def random_walk_quotes(exchange: SimExchange, markets: List[str], start_prices: Dict[str, float],
+                             volatility: float, interval: float, spread_steps: int = 1, seed: Optional[int] = None):
+    """Котировки для EXCHANGE_MODE = "sim": геометрическое блуждание last раз в interval сек.
+
+    volatility - СКО логарифма цены за секунду; bid / ask - на spread_steps шагов цены от last.
+    """
+    rng = random.Random(seed)
+    prices = {m: float(start_prices.get(m, 100.0)) for m in markets}
+    specs = {m: MARKET_SPECS.get(m) or compile_spec(m) for m in markets}
+    sigma = volatility * math.sqrt(interval)
+    while True:
+        for m in markets:
+            prices[m] *= math.exp(sigma * rng.gauss(0.0, 1.0))
+            exchange.set_quote(m, *walk_quote(specs[m], prices[m], spread_steps))
+        await exchange.clock.sleep(interval)
+
+
+def walk_quote(spec: MarketSpec, price: float, spread_steps: int = 1) -> Tuple[float, float, float]:
+    """(last, bid, ask) блуждания: last - цена на шаге цены, bid / ask - на spread_steps шагов от неё"""
+    step, prec = float(spec.price_step), spec.price_prec
+    last = round(round(price / step) * step, prec)
+    return last, round(last - spread_steps * step, prec), round(last + spread_steps * step, prec)
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+Append-only state journal for Extended Trading Bot v2
+
+Состояние хранится в двух файлах:
+    - bot_state.json          - снимок (тот же формат, что и раньше)
+    - bot_state.json.journal  - журнал изменений после снимка, по одной JSON-записи в строке
+
+Каждое изменение ветки - одна дописанная строка с полным состоянием ветки (upsert),
+поэтому повторное применение записи безопасно. При старте читается снимок и поверх
+него проигрывается журнал. Когда журнал разрастается, состояние сжимается в новый
+снимок: запись во временный файл + os.replace (атомарно), затем журнал обнуляется.
+Если процесс упадёт между этими шагами, журнал просто проиграется поверх нового
+снимка ещё раз. Оборванная последняя строка журнала (падение во время записи)
+игнорируется.
+
+Форматы записей журнала:
+    {"t": "branch", "m": "BTC-USD", "data": {...}}                 - состояние ветки
+    {"t": "meta", "next_branch_id": {...}, "rise_anchor": {...}}   - счётчики и якоря
+    {"t": "closed", "m": "BTC-USD", "id": 7}                       - ветка закрыта и ушла в архив
+"""
+
+import json
+import os
+from typing import Iterable, Optional
+
+from bot_logging import AsyncLogger, get_logger
+
+
+class StateJournal:
+    def __init__(self, path: str, compact_every: int = 1000, fsync: bool = False,
+                 logger: Optional[AsyncLogger] = None):
+        self.path = path
+        self.journal_path = path + ".journal"
+        self.compact_every = compact_every
+        self.fsync = fsync
+        self.records = 0
+        self._fh = None
+        self.logger = logger or get_logger()
+
+    @staticmethod
+    def apply(data: dict, rec: dict):
+        """Применяет запись журнала к словарю состояния в формате снимка"""
+        kind = rec.get("t")
+        if kind == "branch":
+            branch = rec["data"]
+            data.setdefault("branches", {}).setdefault(rec["m"], {})[str(branch["branch_id"])] = branch
+        elif kind == "closed":
+            data.get("branches", {}).get(rec["m"], {}).pop(str(rec["id"]), None)
+        elif kind == "meta":
+            for key in ("next_branch_id", "rise_anchor"):
+                if key in rec:
+                    data[key] = rec[key]
+
+    def load(self) -> dict:
+        """Снимок + проигранный поверх него журнал"""
+        data = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        self.records = 0
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        self.logger.warning(f"⚠️ Журнал состояния: пропущена повреждённая запись после {self.records} записей")
+                        break
+                    self.apply(data, rec)
+                    self.records += 1
+        return data
+
+    def append(self, records: Iterable[dict]):
+        lines = "".join(json.dumps(r, ensure_ascii=False, separators=(",", ":")) + "\n" for r in records)
+        if not lines:
+            return
+        if self._fh is None:
+            self._fh = open(self.journal_path, "a", encoding="utf-8")
+        self._fh.write(lines)
+        self._fh.flush()
+        if self.fsync:
+            os.fsync(self._fh.fileno())
+        self.records += lines.count("\n")
+
+    def needs_compaction(self) -> bool:
+        return self.records >= self.compact_every
+
+    def compact(self, data: dict):
+        """Атомарно записывает новый снимок и обнуляет журнал"""
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        if self._fh is not None:
+            self._fh.close()
+        self._fh = open(self.journal_path, "w", encoding="utf-8")
+        self.records = 0
+
+    def close(self):
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
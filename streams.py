@@ -0,0 +1,358 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming market and account data for Extended Trading Bot v2
+
+MarketDataFeed хранит в памяти последний тикер (last / bid / ask) по каждому рынку
+и уведомляет подписчиков о каждом обновлении. Бот читает цены из фида вместо
+REST-запроса get_market_statistics и реагирует на обновления сразу, не дожидаясь тика.
+Возраст last (поток сделок) и bid/ask (поток стакана) отслеживается отдельно: если один
+из потоков оборвался, устаревает только его поле, и бот берёт его из REST.
+
+AccountEventFeed превращает приватный поток аккаунта в события исполнений (FillEvent)
+и смены статуса ордеров (OrderEvent), по которым бот создаёт и закрывает ветки
+без опроса позиции.
+
+Источники данных (async-генераторы, отдающие словари сообщений):
+    - x10_orderbook_source: лучшие bid/ask из WebSocket-стакана X10 (depth=1)
+    - x10_trades_source:    цена последней сделки из WebSocket-потока сделок X10
+    - x10_account_source:   сделки и ордера аккаунта из приватного потока X10
+    - json_ws_source:       простой JSON-поток, например LocalStreamServer
+
+LocalStreamServer - локальный WebSocket-сервер, который рассылает переданные ему
+сообщения всем подключенным клиентам. Используется как замена бирже в тестах.
+
+Форматы JSON-сообщений:
+    {"type": "ticker", "m": "BTC-USD", "last": "100000", "bid": "99999", "ask": "100001"}
+    {"type": "trade", "m": "BTC-USD", "id": 1, "order_id": 42, "side": "BUY", "price": "100000", "qty": "0.001"}
+    {"type": "order", "m": "BTC-USD", "order_id": 42, "external_id": "...", "side": "BUY", "status": "CANCELLED"}
+"""
+
+import abc
+import asyncio
+import json
+import time
+from collections import deque
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import AsyncIterator, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+import aiohttp
+from aiohttp import web
+
+from bot_logging import AsyncLogger, get_logger
+
+
+@dataclass
+class Ticker:
+    market: str
+    last: Optional[Decimal] = None
+    bid: Optional[Decimal] = None
+    ask: Optional[Decimal] = None
+    ts: float = 0.0        # любое обновление
+    last_ts: float = 0.0   # обновление last
+    book_ts: float = 0.0   # обновление bid / ask
+
+
+@dataclass
+class FillEvent:
+    market: str
+    order_id: int
+    side: str
+    price: Decimal
+    qty: Decimal
+    trade_id: Optional[int] = None
+
+
+@dataclass
+class OrderEvent:
+    market: str
+    order_id: int
+    status: str
+    side: Optional[str] = None
+    external_id: Optional[str] = None
+
+
+def _dec(v) -> Optional[Decimal]:
+    return Decimal(str(v)) if v is not None else None
+
+
+class _StreamFeed(abc.ABC):
+    """Общая часть фидов: подписчики и чтение источников с переподключением"""
+
+    def __init__(self, logger: Optional[AsyncLogger] = None):
+        self._listeners: List[Callable] = []
+        self._tasks: List[asyncio.Task] = []
+        self.logger = logger or get_logger()
+
+    def add_listener(self, listener: Callable):
+        self._listeners.append(listener)
+
+    @abc.abstractmethod
+    def dispatch(self, msg: dict):
+        """Обрабатывает одно сообщение источника"""
+
+    def disconnected(self):
+        pass
+
+    async def consume(self, source_factory: Callable[[], AsyncIterator[dict]], reconnect_delay: float = 1.0):
+        """Читает источник бесконечно, переподключаясь при обрывах"""
+        while True:
+            try:
+                async for msg in source_factory():
+                    self.dispatch(msg)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.warning(f"⚠️ Ошибка потока {type(self).__name__}: {e}")
+            finally:
+                self.disconnected()
+            await asyncio.sleep(reconnect_delay)
+
+    def start(self, *source_factories: Callable[[], AsyncIterator[dict]]):
+        for factory in source_factories:
+            self._tasks.append(asyncio.get_running_loop().create_task(self.consume(factory)))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+
+class MarketDataFeed(_StreamFeed):
+    """Последние тикеры по рынкам + подписчики на обновления"""
+
+    def __init__(self, markets: Iterable[str], logger: Optional[AsyncLogger] = None):
+        super().__init__(logger)
+        self.markets = set(markets)
+        self.tickers: Dict[str, Ticker] = {m: Ticker(market=m) for m in self.markets}
+
+    def dispatch(self, msg: dict):
+        self.update(msg["m"], last=msg.get("last"), bid=msg.get("bid"), ask=msg.get("ask"))
+
+    def update(self, market: str, last=None, bid=None, ask=None):
+        if market not in self.markets:
+            return
+        t = self.tickers[market]
+        now = time.monotonic()
+        if last is not None:
+            t.last = _dec(last)
+            t.last_ts = now
+        if bid is not None:
+            t.bid = _dec(bid)
+        if ask is not None:
+            t.ask = _dec(ask)
+        if bid is not None or ask is not None:
+            t.book_ts = now
+        t.ts = now
+        for listener in self._listeners:
+            listener(t)
+
+    def get(self, market: str, max_age: float) -> Optional[Ticker]:
+        """Тикер рынка, если last обновлялся не позже max_age секунд назад"""
+        t = self.tickers.get(market)
+        if t is None or t.last is None or not t.last_ts or time.monotonic() - t.last_ts > max_age:
+            return None
+        return t
+
+    def book(self, market: str, max_age: float) -> Optional[Tuple[Decimal, Decimal]]:
+        """(bid, ask) рынка, если стакан обновлялся не позже max_age секунд назад"""
+        t = self.tickers.get(market)
+        if t is None or t.bid is None or t.ask is None or not t.book_ts or time.monotonic() - t.book_ts > max_age:
+            return None
+        return t.bid, t.ask
+
+
+class AccountEventFeed(_StreamFeed):
+    """События аккаунта: исполнения (FillEvent) и статусы ордеров (OrderEvent)
+
+    connected=True только пока поток подключен; generation растёт при каждом
+    подключении, чтобы потребитель мог один раз сверить состояние опросом после
+    обрыва (события за время разрыва потеряны).
+    """
+
+    def __init__(self, markets: Iterable[str], dedup_window: int = 10000, logger: Optional[AsyncLogger] = None):
+        super().__init__(logger)
+        self.markets = set(markets)
+        self.connected = False
+        self.generation = 0
+        self._seen_trades = set()
+        self._seen_order = deque(maxlen=dedup_window)
+
+    def disconnected(self):
+        self.connected = False
+
+    def dispatch(self, msg: dict):
+        kind = msg.get("type")
+        if kind == "connected":
+            self.connected = True
+            self.generation += 1
+            return
+        if msg.get("m") not in self.markets:
+            return
+        event: Union[FillEvent, OrderEvent]
+        if kind == "trade":
+            trade_id = msg.get("id")
+            if trade_id is not None:
+                # Повторная доставка одной сделки не должна дважды уменьшать ветку
+                if trade_id in self._seen_trades:
+                    return
+                if len(self._seen_order) == self._seen_order.maxlen:
+                    self._seen_trades.discard(self._seen_order[0])
+                self._seen_order.append(trade_id)
+                self._seen_trades.add(trade_id)
+            event = FillEvent(
+                market=msg["m"],
+                order_id=int(msg["order_id"]),
+                side=str(msg["side"]),
+                price=_dec(msg["price"]),
+                qty=_dec(msg["qty"]),
+                trade_id=trade_id,
+            )
+        elif kind == "order":
+            event = OrderEvent(
+                market=msg["m"],
+                order_id=int(msg["order_id"]),
+                status=str(msg["status"]),
+                side=msg.get("side"),
+                external_id=msg.get("external_id"),
+            )
+        else:
+            return
+        for listener in self._listeners:
+            listener(event)
+
+
+# ---------- sources ----------
+async def x10_orderbook_source(stream_url: str) -> AsyncIterator[dict]:
+    from x10.perpetual.stream_client import PerpetualStreamClient
+
+    stream = PerpetualStreamClient(api_url=stream_url)
+    async with stream.subscribe_to_orderbooks(depth=1) as conn:
+        async for msg in conn:
+            book = msg.data
+            if book is None:
+                continue
+            yield {
+                "m": book.market,
+                "bid": book.bid[0].price if book.bid else None,
+                "ask": book.ask[0].price if book.ask else None,
+            }
+
+
+async def x10_trades_source(stream_url: str) -> AsyncIterator[dict]:
+    from x10.perpetual.stream_client import PerpetualStreamClient
+
+    stream = PerpetualStreamClient(api_url=stream_url)
+    async with stream.subscribe_to_public_trades() as conn:
+        async for msg in conn:
+            for trade in (msg.data or []):
+                yield {"m": trade.market, "last": trade.price}
+
+
+async def x10_account_source(stream_url: str, api_key: str) -> AsyncIterator[dict]:
+    from x10.perpetual.stream_client import PerpetualStreamClient
+
+    stream = PerpetualStreamClient(api_url=stream_url)
+    async with stream.subscribe_to_account_updates(api_key) as conn:
+        yield {"type": "connected"}
+        async for msg in conn:
+            data = msg.data
+            if data is None:
+                continue
+            # Сначала сделки, затем статусы: финальный CANCELLED/EXPIRED приходит после всех fill
+            for t in (data.trades or []):
+                yield {
+                    "type": "trade",
+                    "m": t.market,
+                    "id": t.id,
+                    "order_id": t.order_id,
+                    "side": t.side.value,
+                    "price": t.price,
+                    "qty": t.qty,
+                }
+            for o in (data.orders or []):
+                yield {
+                    "type": "order",
+                    "m": o.market,
+                    "order_id": o.id,
+                    "external_id": o.external_id,
+                    "side": o.side.value,
+                    "status": o.status.value,
+                }
+
+
+async def json_ws_source(url: str, msg_types: Iterable[str] = ("ticker",)) -> AsyncIterator[dict]:
+    msg_types = set(msg_types)
+    async with aiohttp.ClientSession() as session:
+        async with session.ws_connect(url) as ws:
+            if "connected" in msg_types:
+                yield {"type": "connected"}
+            async for raw in ws:
+                if raw.type != aiohttp.WSMsgType.TEXT:
+                    break
+                msg = json.loads(raw.data)
+                if msg.get("type") in msg_types:
+                    yield msg
+
+
+# ---------- local stand-in ----------
+class LocalStreamServer:
+    """Локальный WebSocket-сервер: рассылает опубликованные сообщения всем клиентам"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.host = host
+        self.port = port
+        self._clients: List[web.WebSocketResponse] = []
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def url(self) -> str:
+        return f"ws://{self.host}:{self.port}/"
+
+    async def _handle(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self._clients.append(ws)
+        try:
+            async for _ in ws:
+                pass
+        finally:
+            self._clients.remove(ws)
+        return ws
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        for ws in list(self._clients):
+            await ws.close()
+        if self._runner:
+            await self._runner.cleanup()
+
+    async def publish(self, msg: dict):
+        data = json.dumps(msg, default=str)
+        for ws in list(self._clients):
+            await ws.send_str(data)
+
+    async def publish_ticker(self, market: str, last=None, bid=None, ask=None):
+        await self.publish({"type": "ticker", "m": market, "last": last, "bid": bid, "ask": ask})
+
+    async def publish_trade(self, market: str, order_id: int, side: str, price, qty, trade_id: Optional[int] = None):
+        await self.publish({
+            "type": "trade", "m": market, "id": trade_id, "order_id": order_id,
+            "side": side, "price": price, "qty": qty,
+        })
+
+    async def publish_order(self, market: str, order_id: int, status: str, side: Optional[str] = None,
+                            external_id: Optional[str] = None):
+        await self.publish({
+            "type": "order", "m": market, "order_id": order_id,
+            "status": status, "side": side, "external_id": external_id,
+        })
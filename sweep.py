@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+Parallel parameter sweep over backtests for Extended Trading Bot v2
+
+Перебирает сетку параметров стратегии пары и для каждой комбинации запускает бэктест
+(backtest.Backtest) в пуле процессов - по одному процессу на ядро. Ряд цен в формате
+.bin отображается в память (mmap) в каждом процессе, а не копируется в него: страницы
+файла общие, и добавление процессов не увеличивает расход памяти на ряд. CSV один раз
+переводится в .bin рядом с исходным файлом.
+
+Сетка - JSON (файл или строка), ключи - параметры compile_spec и множитель BUY_QTY:
+    {
+      "rise_pct": [0.002, 0.003, 0.004],                          # BUY6_STEP_PCT
+      "sell_pcts": [[0.003, 0.004, 0.005], [0.004, 0.006, 0.008]], # SELL_STEPS_PCT
+      "sl_pct": [-0.01, -0.02],                                    # BRANCH_SL_PCT
+      "min_order_multiplier": [5, 10],                             # MIN_ORDER_MULTIPLIERS
+      "split": [[0.3, 0.3, 0.4]], "pnl_min_pct": [0.0005]
+    }
+
+Результаты сортируются по --rank (по умолчанию equity) и пишутся в CSV (--out);
+лучшие --top строк печатаются таблицей.
+
+Пример:
+    python sweep.py btc_1s.bin --symbol BTC-USD --grid grid.json --workers 8 --out sweep_btc.csv
+"""
+
+import argparse
+import asyncio
+import csv
+import itertools
+import json
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+from typing import Dict, List, Optional
+
+import config
+from backtest import COLUMNS, Backtest, load_series, read_csv, write_bin
+from market_specs import MARKET_SPECS, compile_spec
+
+SPEC_KEYS = ("rise_pct", "sell_pcts", "split", "pnl_min_pct", "sl_pct", "buy_qty")
+RANK_KEYS = ("equity", "realized_pnl_exchange", "realized_pnl_bot")
+
+# Состояние процесса пула: ряд отображается один раз на процесс
+_worker: Dict[str, object] = {}
+
+
+def expand_grid(grid: Dict[str, list]) -> List[dict]:
+    keys = list(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*(grid[k] for k in keys))]
+
+
+def combo_overrides(symbol: str, combo: dict) -> dict:
+    """Комбинация сетки -> аргументы compile_spec"""
+    unknown = set(combo) - set(SPEC_KEYS) - {"min_order_multiplier"}
+    if unknown:
+        raise ValueError(f"неизвестные параметры сетки: {', '.join(sorted(unknown))}")
+    overrides = {k: v for k, v in combo.items() if k in SPEC_KEYS}
+    if "min_order_multiplier" in combo:
+        overrides["buy_qty"] = Decimal(str(config.MIN_ORDER_SIZES[symbol])) * Decimal(str(combo["min_order_multiplier"]))
+    return overrides
+
+
+def _init_worker(series_path: str, symbol: str, tmp_root: str, options: dict):
+    _worker["series"] = load_series(series_path)
+    _worker["symbol"] = symbol
+    _worker["out_dir"] = os.path.join(tmp_root, f"w{os.getpid()}")
+    _worker["options"] = options
+
+
+def _run_combo(item):
+    index, combo = item
+    symbol = _worker["symbol"]
+    started = time.perf_counter()
+    specs = dict(MARKET_SPECS)
+    specs[symbol] = compile_spec(symbol, **combo_overrides(symbol, combo))
+    bt = Backtest(symbol, _worker["series"], _worker["out_dir"], specs=specs, **_worker["options"])
+    bt.bot.metrics.api.check_duplicates = False  # отчёт о запросах в переборе не нужен
+    bt.bot.tracer.path = None  # трассы ордеров - в summary, без файла на каждую комбинацию
+    asyncio.run(bt.run())
+    summary = bt.summary(time.perf_counter() - started)
+    bt.bot.journal.close()
+    bt.bot.archive.close()
+    return index, combo, summary
+
+
+def prepare_series(path: str) -> str:
+    """Путь к .bin для mmap; CSV переводится один раз (повторно - если CSV новее)"""
+    if path.endswith(".bin"):
+        return path
+    bin_path = os.path.splitext(path)[0] + ".bin"
+    if not os.path.exists(bin_path) or os.path.getmtime(bin_path) < os.path.getmtime(path):
+        write_bin(read_csv(path), bin_path)
+        print(f"✅ {path} -> {bin_path}", flush=True)
+    return bin_path
+
+
+def run_sweep(series_path: str, symbol: str, grid: Dict[str, list], workers: Optional[int] = None,
+              rank: str = "equity", options: Optional[dict] = None) -> List[dict]:
+    combos = expand_grid(grid)
+    for combo in combos:
+        combo_overrides(symbol, combo)  # ошибки сетки - до запуска пула
+    workers = workers or os.cpu_count() or 1
+    tmp_root = tempfile.mkdtemp(prefix="sweep_")
+    results = []
+    started = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(series_path, symbol, tmp_root, options or {})) as pool:
+            # Небольшие пачки: ровная загрузка процессов при разной длительности прогонов
+            chunksize = max(1, len(combos) // (workers * 8))
+            for done, (index, combo, summary) in enumerate(pool.map(_run_combo, enumerate(combos), chunksize=chunksize), 1):
+                results.append(dict(summary, index=index, params=combo))
+                if done % max(1, len(combos) // 20) == 0 or done == len(combos):
+                    elapsed = time.perf_counter() - started
+                    print(f"⏳ {done}/{len(combos)} комбинаций, {elapsed:.0f}s ({done / elapsed:.2f}/s)", flush=True)
+    finally:
+        shutil.rmtree(tmp_root, ignore_errors=True)
+    results.sort(key=lambda r: Decimal(r[rank]), reverse=True)
+    return results
+
+
+def write_results(results: List[dict], path: str):
+    param_keys = sorted({k for r in results for k in r["params"]})
+    fields = ["rank", *param_keys, "equity", "realized_pnl_exchange", "realized_pnl_bot", "fees", "final_position",
+              "branches_opened", "fills", "tick_errors", "wall_seconds"]
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(fields)
+        for i, r in enumerate(results, 1):
+            params = r["params"]
+            w.writerow([i, *(json.dumps(params.get(k)) for k in param_keys), *(r[k] for k in fields[1 + len(param_keys):])])
+
+
+def print_table(results: List[dict], top: int):
+    print(f"{'#':>3}  {'equity':>12}  {'pnl':>12}  {'branches':>8}  параметры")
+    for i, r in enumerate(results[:top], 1):
+        params = ", ".join(f"{k}={json.dumps(v)}" for k, v in r["params"].items())
+        print(f"{i:>3}  {Decimal(r['equity']):>12.2f}  {Decimal(r['realized_pnl_exchange']):>12.2f}  "
+              f"{r['branches_opened']:>8}  {params}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Параллельный перебор параметров стратегии на бэктестах")
+    ap.add_argument("series", help="ряд цен: .bin (mmap) или CSV (будет переведён в .bin)")
+    ap.add_argument("--symbol", default=config.MARKETS[0])
+    ap.add_argument("--grid", required=True, help="JSON-файл или JSON-строка с сеткой параметров")
+    ap.add_argument("--workers", type=int, default=None, help="процессов (по умолчанию - число ядер)")
+    ap.add_argument("--rank", choices=RANK_KEYS, default="equity")
+    ap.add_argument("--top", type=int, default=20)
+    ap.add_argument("--out", default="sweep_results.csv")
+    ap.add_argument("--tick", type=float, default=None)
+    ap.add_argument("--maker-fee", type=Decimal, default=Decimal("0"))
+    ap.add_argument("--taker-fee", type=Decimal, default=Decimal("0"))
+    args = ap.parse_args()
+
+    if os.path.exists(args.grid):
+        with open(args.grid, "r", encoding="utf-8") as f:
+            grid = json.load(f)
+    else:
+        grid = json.loads(args.grid)
+    series_path = prepare_series(args.series)
+    rows = len(load_series(series_path)) // COLUMNS
+    combos = len(expand_grid(grid))
+    workers = args.workers or os.cpu_count() or 1
+    print(f"🔎 {args.symbol}: {combos} комбинаций x {rows} строк, процессов: {workers}", flush=True)
+
+    started = time.perf_counter()
+    options = {"tick_seconds": args.tick, "maker_fee": args.maker_fee, "taker_fee": args.taker_fee}
+    results = run_sweep(series_path, args.symbol, grid, workers, args.rank, options)
+    write_results(results, args.out)
+    print_table(results, args.top)
+    print(f"✅ {len(results)} прогонов за {time.perf_counter() - started:.1f}s -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
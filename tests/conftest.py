@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""Общие фикстуры тестов: модуль бота, бот поверх SimExchange, тихий логгер"""
+
+import io
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from bot_logging import AsyncLogger  # noqa: E402
+from clock import SystemClock  # noqa: E402
+from sim_exchange import SimExchange, SimTradingClient  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def bot_module():
+    """extended-bot-v2-server.py (имя с дефисами - загружается так же, как в backtest.py)"""
+    import backtest
+    return backtest.load_bot_module()
+
+
+@pytest.fixture
+def logger():
+    """Логгер в память: сообщения в logger.stream.getvalue() после logger.flush()"""
+    log = AsyncLogger(stream=io.StringIO())
+    yield log
+    log.close()
+
+
+@pytest.fixture
+def make_bot(bot_module, tmp_path, logger):
+    """Фабрика бота против SimExchange с состоянием во временном каталоге"""
+
+    def make(feed=None, account_feed=None, clock=None):
+        clock = clock or SystemClock()
+        exchange = SimExchange(clock)
+        bot = bot_module.Bot(SimTradingClient(exchange), feed=feed, account_feed=account_feed, clock=clock,
+                             state_file=str(tmp_path / "state.json"), logger=logger)
+        return bot, exchange
+
+    return make
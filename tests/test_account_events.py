@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""События аккаунта: исполнения и статусы ордеров из потока вместо опроса позиции"""
+
+import asyncio
+from decimal import Decimal
+
+from streams import AccountEventFeed, LocalStreamServer, json_ws_source
+
+SYMBOL = "BTC-USD"
+
+
+async def _wait_for(cond, timeout: float = 2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not cond():
+        if asyncio.get_running_loop().time() > deadline:
+            raise AssertionError("условие не выполнилось за отведённое время")
+        await asyncio.sleep(0.01)
+
+
+class AccountStream:
+    """LocalStreamServer + AccountEventFeed + бот против SimExchange"""
+
+    def __init__(self, make_bot, bot_module, logger):
+        self.make_bot = make_bot
+        self.bot_module = bot_module
+        self.logger = logger
+
+    async def __aenter__(self):
+        self.server = LocalStreamServer()
+        await self.server.start()
+        self.feed = AccountEventFeed(self.bot_module.MARKETS, logger=self.logger)
+        self.task = asyncio.ensure_future(
+            self.feed.consume(lambda: json_ws_source(self.server.url, ("connected", "trade", "order")), reconnect_delay=0.05))
+        self.bot, self.exchange = self.make_bot(account_feed=self.feed)
+        self.exchange.set_quote(SYMBOL, 100000.0, 99999.0, 100001.0)
+        await _wait_for(lambda: self.feed.connected and self.server._clients)
+        return self
+
+    async def __aexit__(self, *exc):
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+        await self.server.stop()
+
+    async def place_buy(self):
+        """BUY на росте через maybe_buy_on_rise; ордер стоит в книге у bid"""
+        bot = self.bot
+        bot.rise_anchor[SYMBOL] = Decimal("99000")
+        await bot.maybe_buy_on_rise(SYMBOL, Decimal("100000"))
+        (oid, meta), = bot.pending_buys[SYMBOL].items()
+        return oid, meta
+
+    async def settle(self):
+        """Ждёт, пока бот разберёт все события из потока"""
+        await asyncio.sleep(0.1)
+        await _wait_for(lambda: not self.bot._account_events and
+                        (self.bot._account_task is None or self.bot._account_task.done()))
+
+    def active(self):
+        return [b for b in self.bot.branches[SYMBOL].values() if b.active]
+
+
+def test_buy_fill_event_creates_branch_with_sells(make_bot, bot_module, logger):
+    async def run():
+        async with AccountStream(make_bot, bot_module, logger) as s:
+            oid, meta = await s.place_buy()
+            s.exchange.set_quote(SYMBOL, 99999.0, 99998.0, 99999.0)  # ask дошёл до BUY - исполнен
+            await s.server.publish_trade(SYMBOL, oid, "BUY", str(meta["price"]), str(meta["size"]), trade_id=1)
+            await s.settle()
+
+            assert s.bot.pending_buys[SYMBOL] == {}
+            (b,) = s.active()
+            assert b.size == meta["size"] and b.buy_price == meta["price"]
+            # SELL ноги выставлены сразу по событию, без проверки раз в SELL_CHECK_SECONDS
+            assert b.sells and all(leg.order_id for leg in b.sells.values())
+            assert len(s.exchange.open_orders([SYMBOL])) == len(b.sells)
+
+    asyncio.run(run())
+
+
+def test_repeated_fills_are_applied_once(make_bot, bot_module, logger):
+    async def run():
+        async with AccountStream(make_bot, bot_module, logger) as s:
+            oid, meta = await s.place_buy()
+            for _ in range(2):  # повторная доставка одной сделки BUY
+                await s.server.publish_trade(SYMBOL, oid, "BUY", str(meta["price"]), str(meta["size"]), trade_id=1)
+            await s.settle()
+            (b,) = s.active()
+            assert len(s.bot.branches[SYMBOL]) == 1
+
+            leg = next(leg for leg in b.sells.values() if leg.order_id)
+            part = s.bot.specs[SYMBOL].size_step
+            for _ in range(3):  # та же частичная сделка SELL трижды
+                await s.server.publish_trade(SYMBOL, leg.order_id, "SELL", str(leg.price), str(part), trade_id=2)
+            await s.settle()
+            assert b.size == meta["size"] - part
+            assert s.bot.aggs[SYMBOL].lots == s.bot.specs[SYMBOL].to_lots(b.size)
+
+    asyncio.run(run())
+
+
+def test_cancelled_partial_buy_is_finalized_from_order_event(make_bot, bot_module, logger):
+    async def run():
+        async with AccountStream(make_bot, bot_module, logger) as s:
+            oid, meta = await s.place_buy()
+            spec = s.bot.specs[SYMBOL]
+            part = spec.rsize(meta["size"] / 2)
+            await s.server.publish_trade(SYMBOL, oid, "BUY", str(meta["price"]), str(part), trade_id=1)
+            await s.settle()
+            assert s.bot.pending_buys[SYMBOL][oid]["filled"] == part
+            assert s.active() == []
+
+            # Биржа сняла BUY: ветка на исполненную часть, остаток переразмещается новым client id
+            await s.server.publish_order(SYMBOL, oid, "CANCELLED", side="BUY", external_id=meta["client_id"])
+            await s.settle()
+            (b,) = s.active()
+            assert b.size == part
+            (new_oid, new_meta), = s.bot.pending_buys[SYMBOL].items()
+            assert new_oid != oid
+            assert new_meta["size"] == spec.rsize(meta["size"] - part)
+            assert new_meta["client_id"] != meta["client_id"]
+            assert new_meta["pos_before"] == meta["pos_before"] + part
+
+    asyncio.run(run())
+
+
+def test_polling_resumes_after_stream_reconnect(make_bot, bot_module, logger):
+    async def run():
+        async with AccountStream(make_bot, bot_module, logger) as s:
+            bot, calls = s.bot, s.bot.c.calls
+
+            async def polled() -> bool:
+                bot._update_fill_polling(SYMBOL)
+                before = calls["get_open_orders"]
+                await bot.track_sell_executions(SYMBOL)
+                return calls["get_open_orders"] > before
+
+            # Первое подключение: один тик сверки опросом, дальше исполнения только из потока
+            assert s.feed.generation == 1
+            assert await polled()
+            assert not await polled()
+
+            # Обрыв: пока потока нет - опрос на каждом тике
+            for ws in list(s.server._clients):
+                await ws.close()
+            await _wait_for(lambda: not s.feed.connected)
+            assert await polled()
+
+            # Переподключение: новое поколение - события разрыва потеряны, ещё один тик опросом
+            await _wait_for(lambda: s.feed.connected)
+            assert s.feed.generation == 2
+            assert await polled()
+            assert not await polled()
+
+    asyncio.run(run())
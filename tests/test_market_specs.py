@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""MarketSpec.rsize: совпадение с прежним округлением и шаг лота"""
+
+import random
+from decimal import Decimal
+
+import config
+from market_specs import compile_spec
+
+
+def _baseline_rsize(symbol: str, v: Decimal) -> Decimal:
+    """Округление размера до MarketSpec (rsize бота с частным случаем BTC-USD)"""
+    q = Decimal(10) ** (-config.SIZE_PRECISION.get(symbol, 6))
+    vq = v.quantize(q)
+    if vq == 0 and v > 0:
+        return q
+    min_size = Decimal(str(config.MIN_ORDER_SIZES.get(symbol, "0.0001")))
+    if symbol == "BTC-USD":
+        if vq < min_size:
+            return min_size
+        return max((vq / Decimal("0.0001")).quantize(Decimal("1")) * Decimal("0.0001"), min_size)
+    if vq < min_size:
+        return min_size
+    return vq
+
+
+def test_rsize_matches_baseline_without_lot_step():
+    rnd = random.Random(1)
+    for symbol in config.MIN_ORDER_SIZES:
+        spec = compile_spec(symbol, lot_step=None)
+        if spec.lot_step != spec.size_step:
+            continue
+        for _ in range(2000):
+            v = Decimal(repr(rnd.uniform(0, 3))) * spec.min_size
+            assert spec.rsize(v) == _baseline_rsize(symbol, v), (symbol, v)
+
+
+def test_rsize_tiny_positive_size_is_one_size_step():
+    # Как и раньше: размер, округлившийся в 0, становится одним шагом размера (даже ниже MIN_ORDER_SIZES)
+    op = compile_spec("OP-USD")
+    assert op.rsize(Decimal("0.3")) == op.size_step == Decimal("1")
+    btc = compile_spec("BTC-USD")
+    assert btc.rsize(Decimal("0.00001")) == btc.size_step == Decimal("0.0001")
+
+
+def test_rsize_with_lot_step_rounds_to_whole_lots():
+    eth = compile_spec("ETH-USD", lot_step=0.05)
+    assert eth.size_step == Decimal("0.01")
+    assert eth.rsize(Decimal("0.12")) == Decimal("0.10")
+    assert eth.rsize(Decimal("0.13")) == Decimal("0.15")
+    # Округлившийся в 0 размер - один лот, а не шаг размера: биржа не примет размер не кратный лоту
+    assert eth.rsize(Decimal("0.02")) == Decimal("0.05")
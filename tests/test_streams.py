@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""MarketDataFeed / AccountEventFeed поверх LocalStreamServer и возврат бота к REST"""
+
+import asyncio
+from decimal import Decimal
+
+import pytest
+
+from streams import AccountEventFeed, LocalStreamServer, MarketDataFeed, _StreamFeed, json_ws_source
+
+
+async def _wait_for(cond, timeout: float = 2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not cond():
+        if asyncio.get_running_loop().time() > deadline:
+            raise AssertionError("условие не выполнилось за отведённое время")
+        await asyncio.sleep(0.01)
+
+
+def _age(feed: MarketDataFeed, market: str, last: float = 0.0, book: float = 0.0):
+    """Состаривает поля тикера на заданное число секунд"""
+    t = feed.tickers[market]
+    t.last_ts -= last
+    t.book_ts -= book
+
+
+def test_stream_feed_requires_dispatch():
+    with pytest.raises(TypeError):
+        _StreamFeed()
+
+
+def test_last_and_book_freshness_tracked_separately(logger):
+    feed = MarketDataFeed(["BTC-USD"], logger=logger)
+    feed.update("BTC-USD", last="100000", bid="99999", ask="100001")
+    assert feed.get("BTC-USD", 5).last == Decimal("100000")
+    assert feed.book("BTC-USD", 5) == (Decimal("99999"), Decimal("100001"))
+
+    # Поток стакана замолчал, сделки идут: свежий только last
+    _age(feed, "BTC-USD", book=10)
+    feed.update("BTC-USD", last="100010")
+    assert feed.get("BTC-USD", 5).last == Decimal("100010")
+    assert feed.book("BTC-USD", 5) is None
+
+    # Поток сделок замолчал, стакан идёт: свежие только bid / ask
+    _age(feed, "BTC-USD", last=10)
+    feed.update("BTC-USD", bid="100005", ask="100007")
+    assert feed.get("BTC-USD", 5) is None
+    assert feed.book("BTC-USD", 5) == (Decimal("100005"), Decimal("100007"))
+
+
+def test_market_feed_over_local_stream_server(logger):
+    async def run():
+        server = LocalStreamServer()
+        await server.start()
+        feed = MarketDataFeed(["BTC-USD"], logger=logger)
+        seen = []
+        feed.add_listener(seen.append)
+        feed.start(lambda: json_ws_source(server.url))
+        try:
+            await _wait_for(lambda: server._clients)
+            await server.publish_ticker("BTC-USD", last="100000", bid="99999", ask="100001")
+            await server.publish_ticker("ETH-USD", last="3000")
+            await _wait_for(lambda: seen)
+            assert feed.get("BTC-USD", 5).last == Decimal("100000")
+            assert feed.tickers.keys() == {"BTC-USD"}
+        finally:
+            await feed.stop()
+            await server.stop()
+
+    asyncio.run(run())
+
+
+def test_stream_errors_go_to_logger(logger):
+    async def broken():
+        raise ConnectionError("обрыв")
+        yield  # pragma: no cover
+
+    async def run():
+        feed = AccountEventFeed(["BTC-USD"], logger=logger)
+        task = asyncio.ensure_future(feed.consume(broken, reconnect_delay=0.01))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        assert not feed.connected
+
+    asyncio.run(run())
+    logger.flush()
+    assert "Ошибка потока AccountEventFeed: обрыв" in logger.stream.getvalue()
+
+
+def test_bot_falls_back_to_rest_when_stream_goes_quiet(make_bot, bot_module, logger):
+    async def run():
+        server = LocalStreamServer()
+        await server.start()
+        feed = MarketDataFeed(bot_module.MARKETS, logger=logger)
+        feed.start(lambda: json_ws_source(server.url))
+        bot, exchange = make_bot(feed=feed)
+        exchange.set_quote("BTC-USD", 99000.0, 98999.0, 99001.0)
+        try:
+            await _wait_for(lambda: server._clients)
+            await server.publish_ticker("BTC-USD", last="100000", bid="99999", ask="100001")
+            await _wait_for(lambda: feed.get("BTC-USD", 5) is not None)
+
+            # Поток свежий: цены из фида, REST не вызывается
+            assert await bot.last_price("BTC-USD") == Decimal("100000")
+            assert await bot.best_bid_ask("BTC-USD") == (Decimal("99999"), Decimal("100001"))
+            assert bot.c.calls["get_market_statistics"] == 0
+
+            # Поток замолчал дольше MARKET_STREAM_MAX_AGE: цены из REST (котировка SimExchange)
+            _age(feed, "BTC-USD", last=bot_module.MARKET_STREAM_MAX_AGE + 1, book=bot_module.MARKET_STREAM_MAX_AGE + 1)
+            assert await bot.last_price("BTC-USD") == Decimal("99000.0")
+            assert await bot.best_bid_ask("BTC-USD") == (Decimal("98999.0"), Decimal("99001.0"))
+            assert bot.c.calls["get_market_statistics"] == 2
+
+            # Устарел только стакан: last из фида, bid / ask из REST
+            await server.publish_ticker("BTC-USD", last="100020")
+            await _wait_for(lambda: feed.get("BTC-USD", 5) is not None)
+            assert await bot.last_price("BTC-USD") == Decimal("100020")
+            assert await bot.best_bid_ask("BTC-USD") == (Decimal("98999.0"), Decimal("99001.0"))
+            assert bot.c.calls["get_market_statistics"] == 3
+        finally:
+            await feed.stop()
+            await server.stop()
+
+    asyncio.run(run())
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+Order lifecycle latency tracing for Extended Trading Bot v2
+
+Трасса - путь одного решения бота по стадиям; ключ трассы - client id (external_id) первого ордера.
+    buy: trigger (рост в maybe_buy_on_rise) -> buy_ack (биржа приняла BUY) -> [buy_repost ...]
+         -> fill_detected (исполнение увидено) -> branch_created (on_buy_filled) -> legs_live (все ноги SELL выставлены)
+    sl:  trigger (check_branch_sl) -> ioc_ack (IOC принят) -> ioc_filled | ioc_unfilled | ioc_error
+Переразмещённый BUY получает новый client id, но остаётся в трассе первого (pending_buys[...]["trace"]).
+
+Время стадий - монотонные часы бота (Bot.clock), в бэктесте - виртуальное время ряда.
+Длительность каждой стадии от предыдущей попадает в гистограмму order_stage_seconds{market,kind,stage},
+время от trigger до завершения - в order_trace_seconds{market,kind,outcome} (/metrics, metrics.py).
+Завершённая трасса дописывается JSON-строкой в файл (<BOT_STATE_FILE>_traces.jsonl):
+    {"kind": "buy", "market": "BTC-USD", "key": "...", "branch_id": 12, "started_at": "...",
+     "outcome": "legs_live", "total_s": 1.52, "stages": [["trigger", 0.0], ["buy_ack", 0.08], ...]}
+(смещения стадий - секунды от trigger).
+
+Пример (распределение времени до выставления лестницы SELL):
+    jq -r 'select(.kind=="buy" and .outcome=="legs_live") | .total_s' bot_state_traces.jsonl | sort -n
+"""
+
+import json
+from typing import Dict, List, Optional, Tuple
+
+from metrics import MetricsRegistry
+
+# Корзины длительностей стадий (сек.): от задержки запроса до TTL висячего BUY
+TRACE_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+
+class Trace:
+    __slots__ = ("kind", "symbol", "key", "branch_id", "started_at", "stages", "attrs")
+
+    def __init__(self, kind: str, symbol: str, key: str, t: float, started_at: str):
+        self.kind = kind
+        self.symbol = symbol
+        self.key = key
+        self.branch_id: Optional[int] = None
+        self.started_at = started_at
+        self.stages: List[Tuple[str, float]] = [("trigger", t)]
+        self.attrs: dict = {}
+
+
+class Tracer:
+    def __init__(self, registry: MetricsRegistry, clock, path: Optional[str] = None, max_open: int = 10000):
+        self.clock = clock
+        self.path = path  # None - трассы только в метриках
+        self.max_open = max_open
+        self.stage_seconds = registry.histogram("order_stage_seconds", "Длительность стадии трассы ордера от предыдущей",
+                                                ("market", "kind", "stage"), TRACE_BUCKETS)
+        self.trace_seconds = registry.histogram("order_trace_seconds", "Время трассы ордера от trigger до завершения",
+                                                ("market", "kind", "outcome"), TRACE_BUCKETS)
+        registry.gauge("order_traces_open", "Незавершённые трассы ордеров", ("kind",), self._open_by_kind)
+        self.open: Dict[str, Trace] = {}
+        self.by_branch: Dict[Tuple[str, int], str] = {}
+        # (вид, стадия) -> [количество, сумма сек., максимум сек.] для summary бэктеста
+        self.stats: Dict[Tuple[str, str], list] = {}
+        self._fh = None
+
+    def _open_by_kind(self):
+        counts: Dict[str, int] = {}
+        for tr in self.open.values():
+            counts[tr.kind] = counts.get(tr.kind, 0) + 1
+        return [((kind,), n) for kind, n in counts.items()]
+
+    def _now(self, t: Optional[float]) -> float:
+        return self.clock.monotonic() if t is None else t
+
+    def _observe(self, tr: Trace, stage: str, seconds: float):
+        self.stage_seconds.observe((tr.symbol, tr.kind, stage), seconds)
+        st = self.stats.get((tr.kind, stage))
+        if st is None:
+            st = self.stats[(tr.kind, stage)] = [0, 0.0, 0.0]
+        st[0] += 1
+        st[1] += seconds
+        if seconds > st[2]:
+            st[2] = seconds
+
+    # ---------- стадии ----------
+    def start(self, kind: str, symbol: str, key: str, t: Optional[float] = None, **attrs) -> Trace:
+        """Новая трасса со стадией trigger в момент t (по умолчанию - сейчас)"""
+        if len(self.open) >= self.max_open:
+            # Трассы, которые не завершились (бот перезапущен, ордер потерян), не копятся бесконечно
+            self.finish(next(iter(self.open)), "abandoned")
+        tr = Trace(kind, symbol, key, self._now(t), self.clock.now().isoformat())
+        tr.attrs.update(attrs)
+        self.open[key] = tr
+        return tr
+
+    def mark(self, key: Optional[str], stage: str, t: Optional[float] = None) -> Optional[Trace]:
+        """Отмечает стадию открытой трассы; неизвестный ключ (трасса завершена или до перезапуска) - без действия"""
+        tr = self.open.get(key) if key else None
+        if tr is None:
+            return None
+        t = self._now(t)
+        self._observe(tr, stage, max(0.0, t - tr.stages[-1][1]))
+        tr.stages.append((stage, t))
+        return tr
+
+    def link_branch(self, key: Optional[str], symbol: str, branch_id: int):
+        """Ветка, созданная исполнением BUY трассы key: дальше трасса находится по ветке"""
+        tr = self.open.get(key) if key else None
+        if tr is not None:
+            tr.branch_id = branch_id
+            self.by_branch[(symbol, branch_id)] = key
+
+    def branch_key(self, symbol: str, branch_id: int) -> Optional[str]:
+        return self.by_branch.get((symbol, branch_id))
+
+    def finish(self, key: Optional[str], outcome: str, t: Optional[float] = None, **attrs):
+        """Последняя стадия outcome; трасса уходит в гистограмму полного времени и в файл"""
+        tr = self.mark(key, outcome, t)
+        if tr is None:
+            return
+        del self.open[key]
+        if tr.branch_id is not None and self.by_branch.get((tr.symbol, tr.branch_id)) == key:
+            del self.by_branch[(tr.symbol, tr.branch_id)]
+        tr.attrs.update(attrs)
+        t0 = tr.stages[0][1]
+        total = tr.stages[-1][1] - t0
+        self.trace_seconds.observe((tr.symbol, tr.kind, outcome), total)
+        if self.path:
+            record = {"kind": tr.kind, "market": tr.symbol, "key": tr.key, "branch_id": tr.branch_id,
+                      "started_at": tr.started_at, "outcome": outcome, "total_s": round(total, 6),
+                      "stages": [[stage, round(t - t0, 6)] for stage, t in tr.stages]}
+            record.update(tr.attrs)
+            self._write(record)
+
+    def _write(self, record: dict):
+        if self._fh is None:
+            self._fh = open(self.path, "a", encoding="utf-8")
+        self._fh.write(json.dumps(record, ensure_ascii=False, separators=(",", ":"), default=str) + "\n")
+        self._fh.flush()
+
+    def summary(self) -> List[dict]:
+        """Стадии по видам трасс: количество, среднее и максимум (для summary бэктеста)"""
+        return [{"kind": kind, "stage": stage, "count": n, "avg_s": round(total / n, 3), "max_s": round(mx, 3)}
+                for (kind, stage), (n, total, mx) in sorted(self.stats.items())]
+
+    def close(self):
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None